@@ -0,0 +1,226 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from enum import Enum
+from typing import Dict, List, Tuple, Optional
+
+import numpy as np
+
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram import \
+    NeuriteType
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.swc_persistence import \
+    SWCPersistence
+
+
+class MorphologyProfile(Enum):
+    """
+    Size and branching of synthetic morphologies: (neurite type, number of neurites,
+    number of points per neurite) groups, branching probability per point, step length
+    """
+    INTERNEURON = ([(NeuriteType.BASAL_DENDRITE, 5, 200), (NeuriteType.AXON, 1, 800)], 0.05, 2.)
+    PYRAMIDAL = (
+        [(NeuriteType.BASAL_DENDRITE, 6, 600), (NeuriteType.APICAL_DENDRITE, 1, 2500), (NeuriteType.AXON, 1, 4000)],
+        0.03, 2.
+    )
+    MOUSELIGHT = ([(NeuriteType.BASAL_DENDRITE, 6, 1000), (NeuriteType.AXON, 1, 150000)], 0.01, 5.)
+
+    @property
+    def neurites(self) -> List[Tuple[NeuriteType, int, int]]:
+        return self.value[0]
+
+    @property
+    def branching_probability(self) -> float:
+        return self.value[1]
+
+    @property
+    def step(self) -> float:
+        return self.value[2]
+
+
+class SyntheticMorphology:
+    """
+    Random tree morphologies written as SWC files, to benchmark the TMD pipeline offline.
+    Each neurite grows from the soma by extending random tips with persistent random walks,
+    and branches with a given probability at each new point.
+    """
+
+    SOMA_RADIUS = 5.
+    # Weight of the previous direction of a tip when drawing its next one
+    PERSISTENCE = 0.8
+
+    @staticmethod
+    def _grow_neurite(
+            rng: np.random.Generator, n_points: int, branching_probability: float, step: float,
+            first_index: int, root_parent: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        points = np.empty((n_points, 3))
+        parents = np.empty(n_points, dtype=np.int64)
+
+        direction = rng.standard_normal(3)
+        direction /= np.linalg.norm(direction)
+        start = direction * SyntheticMorphology.SOMA_RADIUS
+
+        noise = rng.standard_normal((n_points, 3))
+        tip_choices = rng.random(n_points)
+        branches = rng.random(n_points) < branching_probability
+
+        # Active tips: (index of the last point, direction)
+        tips: List[Tuple[int, np.ndarray]] = [(root_parent, direction)]
+        positions = {root_parent: start}
+
+        for i in range(n_points):
+            t = int(tip_choices[i] * len(tips))
+            parent, direction = tips[t]
+
+            direction = SyntheticMorphology.PERSISTENCE * direction + (1 - SyntheticMorphology.PERSISTENCE) * noise[i]
+            direction /= np.linalg.norm(direction)
+
+            position = (positions[parent] if parent in positions else points[parent - first_index]) + step * direction
+            points[i] = position
+            parents[i] = parent
+
+            if branches[i] and i > 0:
+                tips.append((first_index + i, direction))
+            else:
+                tips[t] = (first_index + i, direction)
+
+        return points, parents
+
+    @staticmethod
+    def generate(
+            rng: np.random.Generator, profile: MorphologyProfile, scale: float = 1.
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        @param rng: the random generator
+        @param profile: the size and branching of the morphology
+        @param scale: a factor on the number of points of each neurite
+        @return: points, radii, SWC types and parent indices (-1 for the soma), like SWCPersistence.read_swc
+        """
+        all_points = [np.zeros((1, 3))]
+        all_types = [np.array([SWCPersistence.SOMA])]
+        all_parents = [np.array([-1])]
+        n = 1
+
+        for neurite_type, n_neurites, n_points in profile.neurites:
+            n_points = max(1, int(n_points * scale))
+
+            for _ in range(n_neurites):
+                points, parents = SyntheticMorphology._grow_neurite(
+                    rng, n_points, profile.branching_probability, profile.step, first_index=n, root_parent=0
+                )
+                all_points.append(points)
+                all_types.append(np.full(n_points, SWCPersistence.SWC_TYPES[neurite_type]))
+                all_parents.append(parents)
+                n += n_points
+
+        points = np.concatenate(all_points)
+        radii = np.ones(len(points))
+        radii[0] = SyntheticMorphology.SOMA_RADIUS
+
+        return points, radii, np.concatenate(all_types), np.concatenate(all_parents)
+
+    @staticmethod
+    def generate_symmetric(
+            depth: int = 4, segment_length: int = 10, neurite_types: Optional[List[NeuriteType]] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Morphology whose neurites are complete binary trees of axis-aligned segments of the same
+        integer length, so that at every bifurcation both subtrees have exactly the same path
+        distance: every step of the elder rule is a tie.
+        @param depth: the number of bifurcation levels of each neurite
+        @param segment_length: the length of every segment, in points one unit apart
+        @param neurite_types: one neurite is grown per type, basal dendrite only if not provided
+        @return: points, radii, SWC types and parent indices (-1 for the soma), like SWCPersistence.read_swc
+        """
+        neurite_types = neurite_types or [NeuriteType.BASAL_DENDRITE]
+        axes = np.eye(3)
+
+        points: List[np.ndarray] = [np.zeros(3)]
+        types: List[int] = [SWCPersistence.SOMA]
+        parents: List[int] = [-1]
+
+        for k, neurite_type in enumerate(neurite_types):
+            swc_type = SWCPersistence.SWC_TYPES[neurite_type]
+            # (index of the last point, direction) of the tips of the current level
+            tips = [(0, axes[k % 3] * (1 if k < 3 else -1))]
+
+            for level in range(depth + 1):
+                next_tips = []
+
+                for parent, direction in tips:
+                    for _ in range(segment_length):
+                        points.append(points[parent] + direction)
+                        types.append(swc_type)
+                        parents.append(parent)
+                        parent = len(points) - 1
+
+                    # Children go along the two axes orthogonal to the branch
+                    for axis in np.flatnonzero(direction == 0)[:2]:
+                        next_tips.append((parent, axes[axis]))
+
+                tips = next_tips
+
+        radii = np.ones(len(points))
+        radii[0] = SyntheticMorphology.SOMA_RADIUS
+
+        return np.array(points), radii, np.array(types), np.array(parents)
+
+    @staticmethod
+    def write_swc(filename: str, points: np.ndarray, radii: np.ndarray, types: np.ndarray, parents: np.ndarray):
+        ids = np.arange(1, len(points) + 1)
+        parent_ids = np.where(parents >= 0, parents + 1, -1)
+
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+        np.savetxt(
+            filename,
+            np.column_stack([ids, types, points, radii, parent_ids]),
+            fmt=["%d", "%d", "%.3f", "%.3f", "%.3f", "%.3f", "%d"],
+            header="synthetic morphology"
+        )
+
+    @staticmethod
+    def generate_dataset(
+            directory: str, n_morphologies: int, profile: MorphologyProfile, seed: int = 0,
+            scale: float = 1., sizes: Optional[List[float]] = None
+    ) -> Dict[str, str]:
+        """
+        Write synthetic morphologies with the same layout as downloaded distributions
+        @param directory: the directory to write the morphologies to
+        @param n_morphologies: the number of morphologies
+        @param profile: their size and branching
+        @param seed: the seed of the random generators, the same seed giving the same morphologies
+        @param scale: a factor on the number of points of the neurites of all morphologies
+        @param sizes: factors on the number of points, cycled over the morphologies
+        @return: a dictionary of morphology id to SWC filename
+        """
+        sizes = sizes or [1.]
+        id_to_filename = dict()
+
+        for i in range(n_morphologies):
+            # Every parameter the file depends on is part of its id, so that existing files are
+            # only reused for the same generation parameters
+            size = scale * sizes[i % len(sizes)]
+            morphology_id = f"synthetic_{profile.name.lower()}_{seed}_{i}_x{size:g}"
+            filename = os.path.join(directory, morphology_id, f"{morphology_id}.swc")
+
+            if not os.path.exists(filename):
+                rng = np.random.default_rng([seed, i])
+                SyntheticMorphology.write_swc(filename, *SyntheticMorphology.generate(rng, profile, size))
+
+            id_to_filename[morphology_id] = filename
+
+        return id_to_filename
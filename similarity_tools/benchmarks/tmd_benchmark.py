@@ -0,0 +1,320 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline benchmark of the TMD pipeline on synthetic morphologies. Each stage is timed, and
+optionally its peak memory traced, and results can be compared with those of a previous run to
+spot regressions before a production rebuild:
+
+python -m similarity_tools.benchmarks.tmd_benchmark --profile pyramidal -n 50 --sizes 0.5 1 4 \
+    --trace_memory --output run.json --baseline previous_run.json
+
+The native persistence diagrams are first checked against those of tmd, and the persistence
+images of the histogram engine against those of tmd, the run exiting with a non-zero status if
+any differs.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Any
+
+from similarity_tools.helpers.logger import logger
+from similarity_tools.benchmarks.synthetic_morphology import SyntheticMorphology, MorphologyProfile
+
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram import \
+    NeuriteType
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.swc_persistence import \
+    SWCPersistence
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram \
+    .persistence_diagram_store import PersistenceDiagramStore
+from similarity_tools.building.model_impl.tmd_model.diagram_limits import DiagramLimits
+
+
+class StageResult:
+
+    def __init__(self, name: str, elapsed: float, n_items: int, peak_memory: Optional[int]):
+        self.name = name
+        self.elapsed = elapsed
+        self.n_items = n_items
+        self.peak_memory = peak_memory
+
+    @property
+    def throughput(self) -> float:
+        return self.n_items / self.elapsed if self.elapsed > 0 else float("inf")
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "elapsed": self.elapsed,
+            "n_items": self.n_items,
+            "throughput": self.throughput,
+            "peak_memory": self.peak_memory
+        }
+
+
+class TMDBenchmark:
+    """
+    Times the stages of the TMD pipeline on a set of SWC files: parsing, persistence diagram
+    computation, store writing, limits, each VectorisationTechnique, and the kernel density
+    vectors of the unscaled model. If trace_memory is set, peak memory is the peak of the
+    allocations traced by tracemalloc during a second, untimed, run of the stage (numpy arrays
+    included). tracemalloc only traces the main process: the memory of worker processes
+    (N_JOBS > 1) is not included.
+    """
+
+    # Parameters of UnscaledTMDModel
+    KERNEL_DENSITY_PARAMETERS = {"dim": 256, "kernel_width": 120, "max_height": 17000}
+
+    # Relative increase of the duration or peak memory of a stage reported as a regression
+    REGRESSION_TOLERANCE = 0.2
+
+    def __init__(
+            self, id_to_filename: Dict[str, str], work_dir: str, neurite_type: NeuriteType, trace_memory: bool = False
+    ):
+        self.id_to_filename = id_to_filename
+        self.work_dir = work_dir
+        self.neurite_type = neurite_type
+        # Runs every stage a second time to trace its peak memory
+        self.trace_memory = trace_memory
+        self.results: List[StageResult] = []
+        self.persistence_images_match = True
+
+    def measure(self, name: str, function: Callable[[], Any], n_items: int) -> Any:
+        """
+        Run the stage timed, then, if trace_memory is set, a second time with tracemalloc, whose
+        tracing of every allocation would otherwise slow the timed run down
+        """
+        start = time.perf_counter()
+        output = function()
+        elapsed = time.perf_counter() - start
+
+        peak = None
+
+        if self.trace_memory:
+            del output
+            tracemalloc.start()
+
+            try:
+                output = function()
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+        result = StageResult(name, elapsed, n_items, peak)
+        self.results.append(result)
+
+        logger.info(
+            f">  {name}: {elapsed:.3f}s, {result.throughput:.1f} items/s"
+            f"{f', peak memory {peak / 2 ** 20:.1f} MiB (main process only)' if peak is not None else ''}"
+        )
+
+        return output
+
+    def _persistence_data(self, native: bool) -> Dict:
+        from similarity_tools.building.model_impl.tmd_model.persistence_diagram \
+            .neuron_morphology_persistence_diagram import NeuronMorphologyPersistenceDiagram
+
+        previous = NeuronMorphologyPersistenceDiagram.NATIVE
+        NeuronMorphologyPersistenceDiagram.NATIVE = native
+
+        try:
+            return dict(
+                (morphology_id, NeuronMorphologyPersistenceDiagram.get_persistence_data(filename, self.neurite_type))
+                for morphology_id, filename in self.id_to_filename.items()
+            )
+        finally:
+            NeuronMorphologyPersistenceDiagram.NATIVE = previous
+
+    def validate(self) -> List[str]:
+        """
+        Check that the native persistence diagrams are the ones of tmd, for every morphology and
+        for a symmetric morphology whose every elder rule step is a tie of path distances
+        @return: the files and neurite types whose native diagram differs
+        """
+        from similarity_tools.building.model_impl.tmd_model.persistence_diagram \
+            .neuron_morphology_persistence_diagram import NeuronMorphologyPersistenceDiagram
+
+        tie_filename = os.path.join(self.work_dir, "symmetric", "symmetric.swc")
+        SyntheticMorphology.write_swc(
+            tie_filename, *SyntheticMorphology.generate_symmetric(neurite_types=list(NeuriteType))
+        )
+
+        mismatches = [
+            f"{filename} ({neurite_type.value})"
+            for filename in list(self.id_to_filename.values()) + [tie_filename]
+            for neurite_type, same in NeuronMorphologyPersistenceDiagram.validate_native(filename, list(NeuriteType)).items()
+            if not same
+        ]
+
+        for mismatch in mismatches:
+            logger.warning(f">  Native persistence diagram differs from tmd: {mismatch}")
+
+        if not mismatches:
+            logger.info(">  Native persistence diagrams match tmd")
+
+        return mismatches
+
+    def run(self) -> List[StageResult]:
+        # The full stack is only required to run the benchmark
+        from morphio import Morphology, Option
+        from tmd.io.io import load_neuron_from_morphio
+
+        from similarity_tools.building.model_impl.tmd_model.vectorisation import Vectorisation
+        from similarity_tools.building.model_impl.tmd_model.persistence_image import PersistenceImage
+        from similarity_tools.building.model_impl.tmd_model.tmd_model import TMDModelNew, VectorisationTechnique
+
+        filenames = list(self.id_to_filename.values())
+        n = len(filenames)
+
+        logger.info(f"1. Benchmarking the TMD pipeline on {n} morphologies")
+
+        self.measure("parse_native", lambda: [SWCPersistence.read_swc(f) for f in filenames], n)
+
+        self.measure(
+            "parse_morphio",
+            lambda: [load_neuron_from_morphio(Morphology(f, Option.soma_sphere)) for f in filenames], n
+        )
+
+        self.measure("persistence_data_tmd", lambda: self._persistence_data(native=False), n)
+        diagrams = self.measure("persistence_data_native", lambda: self._persistence_data(native=True), n)
+
+        diagrams = dict((k, v) for k, v in diagrams.items() if v is not None)
+        location = os.path.join(self.work_dir, "benchmark_store")
+
+        store = self.measure("store_write", lambda: PersistenceDiagramStore.write(location, diagrams), len(diagrams))
+        limits = self.measure("limits", lambda: DiagramLimits.from_store(store), len(store))
+
+        nm_persistence_diagrams = dict((k, v) for k, v in store.items() if len(v) > 0)
+        n_diagrams = len(nm_persistence_diagrams)
+
+        self.persistence_images_match = PersistenceImage.validate(
+            list(nm_persistence_diagrams.values()), limits.xlim, limits.ylim, Vectorisation.PERSISTENCE_IMAGE_RESOLUTION
+        )
+
+        for technique in VectorisationTechnique:
+            self.measure(
+                f"vectorisation_{technique.name.lower()}",
+                lambda: TMDModelNew.run_static(
+                    vectorisation_technique=technique,
+                    nm_persistence_diagrams=nm_persistence_diagrams,
+                    xlim=limits.xlim,
+                    ylim=limits.ylim
+                ),
+                n_diagrams
+            )
+
+        parameters = dict(TMDBenchmark.KERNEL_DENSITY_PARAMETERS, max_time=limits.max_time)
+
+        self.measure(
+            "compute_persistence_vector",
+            lambda: [
+                Vectorisation.compute_persistence_vector(d, **parameters)
+                for d in nm_persistence_diagrams.values()
+            ],
+            n_diagrams
+        )
+
+        self.measure(
+            "compute_persistence_vectors",
+            lambda: Vectorisation.compute_persistence_vectors(list(nm_persistence_diagrams.values()), **parameters),
+            n_diagrams
+        )
+
+        return self.results
+
+    def to_dict(self) -> Dict:
+        return dict((result.name, result.to_dict()) for result in self.results)
+
+    @staticmethod
+    def regressions(current: Dict, baseline: Dict, tolerance: Optional[float] = None) -> List[str]:
+        """
+        @param current: results of a run, as returned by to_dict
+        @param baseline: results of a previous run on the same dataset
+        @param tolerance: the relative increase reported, REGRESSION_TOLERANCE if not provided
+        @return: a description of each stage whose duration or peak memory increased by more
+        than the tolerance
+        """
+        tolerance = tolerance if tolerance is not None else TMDBenchmark.REGRESSION_TOLERANCE
+        regressions = []
+
+        for name, result in current.items():
+            if name not in baseline:
+                continue
+
+            for metric in ["elapsed", "peak_memory"]:
+                previous, value = baseline[name].get(metric), result[metric]
+
+                # Peak memory is only there for runs tracing it
+                if previous is None or value is None:
+                    continue
+
+                if previous > 0 and value > previous * (1 + tolerance):
+                    regressions.append(f"{name} {metric}: {previous:.4g} -> {value:.4g} (+{value / previous - 1:.0%})")
+
+        return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the TMD pipeline on synthetic morphologies")
+    parser.add_argument("--profile", choices=[p.name.lower() for p in MorphologyProfile], default="interneuron")
+    parser.add_argument("-n", "--n_morphologies", type=int, default=20)
+    parser.add_argument("--scale", type=float, default=1.)
+    parser.add_argument(
+        "--sizes", type=float, nargs="+", default=None,
+        help="Factors on the number of points of the morphologies, cycled over them"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--neurite_type", choices=[t.name.lower() for t in NeuriteType], default="basal_dendrite")
+    parser.add_argument("--work_dir", default="./tmd_benchmark")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+    parser.add_argument(
+        "--trace_memory", action="store_true",
+        help="Run every stage a second time to trace its peak memory, in the main process only"
+    )
+    args = parser.parse_args()
+
+    morphologies = SyntheticMorphology.generate_dataset(
+        os.path.join(args.work_dir, "morphologies"), args.n_morphologies,
+        MorphologyProfile[args.profile.upper()], seed=args.seed, scale=args.scale, sizes=args.sizes
+    )
+
+    benchmark = TMDBenchmark(
+        morphologies, args.work_dir, NeuriteType[args.neurite_type.upper()], trace_memory=args.trace_memory
+    )
+    native_mismatches = benchmark.validate()
+    benchmark.run()
+    results = benchmark.to_dict()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            found = TMDBenchmark.regressions(results, json.load(f))
+
+        for regression in found:
+            logger.warning(f">  Regression: {regression}")
+
+        if not found:
+            logger.info(">  No regression")
+
+    if native_mismatches or not benchmark.persistence_images_match:
+        sys.exit(1)
@@ -0,0 +1,138 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+from similarity_tools.building.model_impl.tmd_model.diagram_limits import DiagramLimits
+from similarity_tools.registration.registration_exception import ModelBuildingException
+
+
+class CanonicalGrid:
+    """
+    Versioned, persisted limits of the grid persistence diagrams are vectorised on.
+
+    A grid is created from the limits of the diagrams of a bucket, with headroom above their
+    upper bounds, so that morphologies added later, with slightly longer barcodes, still fit
+    in it. Vectors computed on the same grid version remain valid and comparable: adding
+    morphologies only requires vectorising them. Changing the grid is an explicit regrid,
+    creating a new version, whose vectors are all recomputed.
+
+    Versions are saved as grid_v{version}.json in a grid directory.
+    """
+
+    HEADROOM = 0.25
+    FILE_PATTERN = re.compile(r"^grid_v(\d+)\.json$")
+
+    def __init__(self, version: int, xlim: List[float], ylim: List[float], headroom: float, limits: Dict):
+        self.version = version
+        self.xlim = xlim
+        self.ylim = ylim
+        self.headroom = headroom
+        # Limits of the diagrams the grid was created from
+        self.limits = limits
+
+    @staticmethod
+    def _expand(low: float, high: float, headroom: float) -> List[float]:
+        return [low, high + headroom * (high - low)]
+
+    @staticmethod
+    def from_limits(limits: DiagramLimits, version: int = 1, headroom: Optional[float] = None) -> 'CanonicalGrid':
+        headroom = headroom if headroom is not None else CanonicalGrid.HEADROOM
+
+        return CanonicalGrid(
+            version=version,
+            xlim=CanonicalGrid._expand(limits.x_min, limits.x_max, headroom),
+            ylim=CanonicalGrid._expand(limits.y_min, limits.y_max, headroom),
+            headroom=headroom,
+            limits=limits.to_dict()
+        )
+
+    def contains(self, limits: DiagramLimits) -> bool:
+        """
+        @return: whether all the bars of the diagrams the limits were computed from are
+        inside the grid
+        """
+        return limits.empty or (
+            self.xlim[0] <= limits.x_min and limits.x_max <= self.xlim[1]
+            and self.ylim[0] <= limits.y_min and limits.y_max <= self.ylim[1]
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": self.version,
+            "xlim": self.xlim,
+            "ylim": self.ylim,
+            "headroom": self.headroom,
+            "limits": self.limits
+        }
+
+    @staticmethod
+    def from_dict(dictionary: Dict) -> 'CanonicalGrid':
+        return CanonicalGrid(**dictionary)
+
+    @staticmethod
+    def path(grid_dir: str, version: int) -> str:
+        return os.path.join(grid_dir, f"grid_v{version}.json")
+
+    @staticmethod
+    def versions(grid_dir: str) -> List[int]:
+        if not os.path.isdir(grid_dir):
+            return []
+
+        matches = (CanonicalGrid.FILE_PATTERN.match(name) for name in os.listdir(grid_dir))
+        return sorted(int(match.group(1)) for match in matches if match is not None)
+
+    def save(self, grid_dir: str):
+        os.makedirs(grid_dir, exist_ok=True)
+        path = CanonicalGrid.path(grid_dir, self.version)
+
+        if os.path.exists(path):
+            raise ModelBuildingException(f"Canonical grid version {self.version} already exists in {grid_dir}")
+
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(grid_dir: str, version: Optional[int] = None) -> Optional['CanonicalGrid']:
+        """
+        @param grid_dir: the grid directory
+        @param version: the version to load, the latest if not provided
+        @return: the grid, None if there is no grid in the directory
+        """
+        versions = CanonicalGrid.versions(grid_dir)
+
+        if len(versions) == 0:
+            return None
+
+        with open(CanonicalGrid.path(grid_dir, version if version is not None else versions[-1]), "r") as f:
+            return CanonicalGrid.from_dict(json.load(f))
+
+    @staticmethod
+    def regrid(grid_dir: str, limits: DiagramLimits, headroom: Optional[float] = None) -> 'CanonicalGrid':
+        """
+        Create and save a new version of the grid, from the limits of the current diagrams
+        """
+        versions = CanonicalGrid.versions(grid_dir)
+        grid = CanonicalGrid.from_limits(limits, version=versions[-1] + 1 if versions else 1, headroom=headroom)
+        grid.save(grid_dir)
+
+        return grid
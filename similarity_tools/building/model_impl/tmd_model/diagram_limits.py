@@ -0,0 +1,136 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, Iterable, Optional, List
+
+import numpy as np
+
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram \
+    .persistence_diagram_store import PersistenceDiagramStore
+
+
+class DiagramLimits:
+    """
+    Extent of a set of persistence diagrams: the minimum and maximum of the first (x) and
+    second (y) value of their bars. Limits are updated one diagram or one block of bars at a
+    time, and limits computed separately (on shards of a store, on several buckets) are merged,
+    so that the diagrams never need to be materialised together.
+    xlim and ylim are the limits given by tmd.Topology.vectorizations.get_limits.
+    """
+
+    # Number of bars of a store read at once
+    CHUNK_SIZE = 2 ** 20
+
+    def __init__(
+            self,
+            x_min: float = np.inf, x_max: float = -np.inf,
+            y_min: float = np.inf, y_max: float = -np.inf,
+            n_bars: int = 0
+    ):
+        self.x_min = float(x_min)
+        self.x_max = float(x_max)
+        self.y_min = float(y_min)
+        self.y_max = float(y_max)
+        self.n_bars = int(n_bars)
+
+    def update(self, bars: np.ndarray) -> 'DiagramLimits':
+        """
+        @param bars: the bars of a diagram, or of several diagrams, of shape (n_bars, 2)
+        @return: the limits, updated in place
+        """
+        bars = np.asarray(bars).reshape(-1, 2)
+
+        if len(bars) == 0:
+            return self
+
+        mins = bars.min(axis=0)
+        maxs = bars.max(axis=0)
+
+        self.x_min = min(self.x_min, float(mins[0]))
+        self.x_max = max(self.x_max, float(maxs[0]))
+        self.y_min = min(self.y_min, float(mins[1]))
+        self.y_max = max(self.y_max, float(maxs[1]))
+        self.n_bars += len(bars)
+
+        return self
+
+    def merge(self, other: 'DiagramLimits') -> 'DiagramLimits':
+        return DiagramLimits(
+            x_min=min(self.x_min, other.x_min), x_max=max(self.x_max, other.x_max),
+            y_min=min(self.y_min, other.y_min), y_max=max(self.y_max, other.y_max),
+            n_bars=self.n_bars + other.n_bars
+        )
+
+    @property
+    def empty(self) -> bool:
+        return self.n_bars == 0
+
+    @property
+    def xlim(self) -> List[float]:
+        return [self.x_min, self.x_max]
+
+    @property
+    def ylim(self) -> List[float]:
+        return [self.y_min, self.y_max]
+
+    @property
+    def max_time(self) -> float:
+        """
+        The largest value of all bars, the global scale of the diagrams
+        """
+        return max(self.x_max, self.y_max)
+
+    def to_dict(self) -> Dict:
+        return {
+            "x_min": self.x_min, "x_max": self.x_max,
+            "y_min": self.y_min, "y_max": self.y_max,
+            "n_bars": self.n_bars
+        }
+
+    @staticmethod
+    def from_dict(dictionary: Dict) -> 'DiagramLimits':
+        return DiagramLimits(**dictionary)
+
+    @staticmethod
+    def from_diagrams(diagrams: Iterable[np.ndarray]) -> 'DiagramLimits':
+        limits = DiagramLimits()
+
+        for diagram in diagrams:
+            limits.update(diagram)
+
+        return limits
+
+    @staticmethod
+    def from_store(store: PersistenceDiagramStore, chunk_size: Optional[int] = None) -> 'DiagramLimits':
+        """
+        Limits of all the diagrams of a store, from a single pass over its (memory-mapped)
+        bars, read CHUNK_SIZE bars at a time
+        """
+        chunk_size = chunk_size or DiagramLimits.CHUNK_SIZE
+        limits = DiagramLimits()
+
+        for start in range(0, len(store.bars), chunk_size):
+            limits.update(store.bars[start:start + chunk_size])
+
+        return limits
+
+    @staticmethod
+    def merge_all(limits: Iterable['DiagramLimits']) -> 'DiagramLimits':
+        result = DiagramLimits()
+
+        for limit in limits:
+            result = result.merge(limit)
+
+        return result
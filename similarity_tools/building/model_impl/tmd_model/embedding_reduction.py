@@ -0,0 +1,253 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from enum import Enum
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from similarity_tools.building.model_impl.tmd_model.vector_encoding import VectorEncoder, VectorEncoding
+from similarity_tools.helpers.logger import logger
+
+
+class ReductionMethod(Enum):
+    PCA = 1
+    RANDOM_PROJECTION = 2
+
+
+class EmbeddingReduction:
+    """
+    Linear dimensionality reduction of embedding vectors: x -> (x - mean) @ components.T,
+    fitted once and saved as an npz artifact, so that vectors of morphologies added later are
+    projected consistently.
+
+    - PCA: randomised PCA (range finder with power iterations), computed with a bounded number
+    of passes over the rows of the data, BATCH_SIZE rows at a time, so that the data can be a
+    memory-mapped matrix larger than memory.
+    - RANDOM_PROJECTION: projection on a random orthonormal basis, which requires no fitting
+    besides the mean.
+
+    In both cases, the variance of the data explained by each component is reported.
+    """
+
+    BATCH_SIZE = 4096
+    OVERSAMPLING = 10
+    POWER_ITERATIONS = 2
+    SEED = 0
+
+    def __init__(
+            self,
+            method: ReductionMethod,
+            mean: np.ndarray,
+            components: np.ndarray,
+            explained_variance: np.ndarray,
+            total_variance: float,
+            n_samples: int
+    ):
+        self.method = method
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+        self.explained_variance = explained_variance
+        self.total_variance = total_variance
+        self.n_samples = n_samples
+
+    @property
+    def dimension(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def n_features(self) -> int:
+        """
+        The dimension of the vectors the reduction applies to
+        """
+        return self.components.shape[1]
+
+    @property
+    def explained_variance_ratio(self) -> np.ndarray:
+        return self.explained_variance / self.total_variance if self.total_variance > 0 \
+            else np.zeros_like(self.explained_variance)
+
+    @staticmethod
+    def _batches(x: np.ndarray) -> Iterator[Tuple[int, np.ndarray]]:
+        for start in range(0, len(x), EmbeddingReduction.BATCH_SIZE):
+            yield start, np.asarray(x[start:start + EmbeddingReduction.BATCH_SIZE], dtype=np.float64)
+
+    @staticmethod
+    def fit(x: np.ndarray, dimension: int, method: ReductionMethod = ReductionMethod.PCA) -> 'EmbeddingReduction':
+        """
+        @param x: the vectors, an array of shape (n_samples, n_features), possibly memory-mapped
+        @type x: np.ndarray
+        @param dimension: the dimension of the reduced vectors
+        @type dimension: int
+        @param method: the reduction method
+        @type method: ReductionMethod
+        @return: the fitted reduction
+        @rtype: EmbeddingReduction
+        """
+        n_samples, n_features = x.shape
+        dimension = min(dimension, n_features, n_samples)
+        rng = np.random.default_rng(EmbeddingReduction.SEED)
+
+        mean = np.zeros(n_features)
+        for _, batch in EmbeddingReduction._batches(x):
+            mean += batch.sum(axis=0)
+        mean /= n_samples
+
+        total_variance = sum(
+            float(((batch - mean) ** 2).sum()) for _, batch in EmbeddingReduction._batches(x)
+        ) / max(n_samples - 1, 1)
+
+        if method == ReductionMethod.RANDOM_PROJECTION:
+            components, _ = np.linalg.qr(rng.standard_normal((n_features, dimension)))
+            components = components.T
+        elif method == ReductionMethod.PCA:
+            components = EmbeddingReduction._randomised_pca(x, mean, dimension, rng)
+        else:
+            raise ValueError(f"Unsupported reduction method {method}")
+
+        # Variance of the data along each component
+        explained_variance = np.zeros(dimension)
+        for _, batch in EmbeddingReduction._batches(x):
+            explained_variance += (((batch - mean) @ components.T) ** 2).sum(axis=0)
+        explained_variance /= max(n_samples - 1, 1)
+
+        return EmbeddingReduction(
+            method=method, mean=mean, components=components, explained_variance=explained_variance,
+            total_variance=total_variance, n_samples=n_samples
+        )
+
+    @staticmethod
+    def _randomised_pca(x: np.ndarray, mean: np.ndarray, dimension: int, rng: np.random.Generator) -> np.ndarray:
+        n_samples, n_features = x.shape
+        rank = min(dimension + EmbeddingReduction.OVERSAMPLING, n_features, n_samples)
+
+        def times(matrix):  # (x - mean) @ matrix, (n_samples, rank)
+            result = np.empty((n_samples, matrix.shape[1]))
+            for start, batch in EmbeddingReduction._batches(x):
+                result[start:start + len(batch)] = (batch - mean) @ matrix
+            return result
+
+        def transpose_times(matrix):  # (x - mean).T @ matrix, (n_features, rank)
+            result = np.zeros((n_features, matrix.shape[1]))
+            for start, batch in EmbeddingReduction._batches(x):
+                result += (batch - mean).T @ matrix[start:start + len(batch)]
+            return result
+
+        # Orthonormal basis of the range of the centered data, refined by power iterations
+        q, _ = np.linalg.qr(times(rng.standard_normal((n_features, rank))))
+
+        for _ in range(EmbeddingReduction.POWER_ITERATIONS):
+            q, _ = np.linalg.qr(transpose_times(q))
+            q, _ = np.linalg.qr(times(q))
+
+        # SVD of the projection of the data on that basis
+        _, _, vt = np.linalg.svd(transpose_times(q).T, full_matrices=False)
+
+        return vt[:dimension]
+
+    def transform(self, x: np.ndarray) -> np.ndarray:
+        """
+        @param x: vectors of shape (n, n_features)
+        @return: the reduced float32 vectors, of shape (n, dimension)
+        """
+        return ((np.asarray(x, dtype=np.float32) - self.mean) @ self.components.T).astype(np.float32)
+
+    @staticmethod
+    def to_array(vector: Union[List, str], encoding: VectorEncoding = VectorEncoding.FLOAT32) -> np.ndarray:
+        """
+        A vector as produced by Vectorisation: a (possibly nested) list, or a base64 string
+        """
+        if isinstance(vector, str):
+            return VectorEncoder.decode(vector, encoding)
+
+        return np.asarray(vector, dtype=np.float32).ravel()
+
+    def iter_transform(
+            self, embeddings: Iterable[Tuple[str, Union[List, str]]],
+            encoding: VectorEncoding = VectorEncoding.FLOAT32
+    ) -> Iterator[Tuple[str, List]]:
+        """
+        Reduce (id, vector) pairs, BATCH_SIZE at a time
+        """
+        keys, batch = [], []
+
+        def flush():
+            for key, reduced in zip(keys, self.transform(np.stack(batch))):
+                yield key, reduced.tolist()
+
+        for key, vector in embeddings:
+            keys.append(key)
+            batch.append(EmbeddingReduction.to_array(vector, encoding))
+
+            if len(batch) == EmbeddingReduction.BATCH_SIZE:
+                yield from flush()
+                keys, batch = [], []
+
+        if len(batch) > 0:
+            yield from flush()
+
+    def transform_embeddings(
+            self, embeddings: Dict[str, Union[List, str]], encoding: VectorEncoding = VectorEncoding.FLOAT32
+    ) -> Dict[str, List]:
+        return dict(self.iter_transform(embeddings.items(), encoding))
+
+    def report(self):
+        ratio = self.explained_variance_ratio
+        logger.info(
+            f">  {self.method.name} reduction to {self.dimension} dimensions, fitted on "
+            f"{self.n_samples} vectors: explained variance {ratio.sum():.4f}"
+            f"{f' (first component {ratio[0]:.4f})' if len(ratio) > 0 else ''}"
+        )
+
+    @staticmethod
+    def exists(location: str) -> bool:
+        return os.path.exists(location)
+
+    def save(self, location: str):
+        os.makedirs(os.path.dirname(os.path.abspath(location)), exist_ok=True)
+        tmp_location = f"{location}.tmp.npz"
+
+        np.savez(
+            tmp_location,
+            method=self.method.value,
+            mean=self.mean,
+            components=self.components,
+            explained_variance=self.explained_variance,
+            total_variance=self.total_variance,
+            n_samples=self.n_samples
+        )
+
+        os.replace(tmp_location, location)
+
+    @staticmethod
+    def load(location: str) -> 'EmbeddingReduction':
+        with np.load(location) as data:
+            return EmbeddingReduction(
+                method=ReductionMethod(int(data["method"])),
+                mean=data["mean"],
+                components=data["components"],
+                explained_variance=data["explained_variance"],
+                total_variance=float(data["total_variance"]),
+                n_samples=int(data["n_samples"])
+            )
+
+    @staticmethod
+    def fit_embeddings(
+            embeddings: Dict[str, Union[List, str]], dimension: int,
+            method: ReductionMethod = ReductionMethod.PCA, encoding: VectorEncoding = VectorEncoding.FLOAT32
+    ) -> 'EmbeddingReduction':
+        x = np.stack([EmbeddingReduction.to_array(vector, encoding) for vector in embeddings.values()])
+        return EmbeddingReduction.fit(x, dimension, method)
@@ -0,0 +1,143 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, Sequence, Tuple, Optional
+
+import numpy as np
+
+
+class ImagePyramid:
+    """
+    Multi-resolution persistence images, and coarse-to-fine nearest neighbour search on them.
+
+    Lower resolution images are obtained by average pooling of the full resolution image over
+    square blocks of pixels, so a resolution must divide the full one (25 and 50 for 100).
+    Candidates are shortlisted on a coarse level, whose vectors are an order of magnitude
+    smaller than the full ones, and only the shortlist is reranked on the full resolution.
+    """
+
+    # Number of candidates shortlisted on the coarse level, per neighbour requested
+    SHORTLIST_FACTOR = 10
+    # Maximum number of elements of the distance matrices computed at once
+    BLOCK_SIZE = 2 ** 24
+
+    @staticmethod
+    def pool(images: np.ndarray, resolution: int) -> np.ndarray:
+        """
+        @param images: an array of shape (n_images, full_resolution, full_resolution)
+        @param resolution: the resolution of the pooled images, dividing full_resolution
+        @return: the pooled images, of shape (n_images, resolution, resolution)
+        """
+        n, full_resolution = images.shape[0], images.shape[1]
+
+        if full_resolution % resolution != 0:
+            raise ValueError(
+                f"Cannot pool images of resolution {full_resolution} to the resolution {resolution}"
+            )
+
+        factor = full_resolution // resolution
+
+        return images.reshape(n, resolution, factor, resolution, factor).mean(axis=(2, 4))
+
+    @staticmethod
+    def pyramid(images: np.ndarray, levels: Sequence[int], normalize: bool = True) -> Dict[int, np.ndarray]:
+        """
+        @param images: full resolution images, of shape (n_images, full_resolution, full_resolution)
+        @param levels: the resolutions of the pooled images
+        @param normalize: whether to divide each image of each level by its maximum, like
+        Vectorisation.FLATTEN_NORMALIZE does for the full resolution images
+        @return: for each resolution (the levels and the full one), the flattened images, of shape
+        (n_images, resolution ** 2)
+        """
+        full_resolution = images.shape[1]
+        result = dict()
+
+        for resolution in sorted(set(levels) | {full_resolution}):
+            pooled = images if resolution == full_resolution else ImagePyramid.pool(images, resolution)
+            pooled = pooled.reshape(len(images), -1).astype(np.float32)
+
+            if normalize:
+                maxs = pooled.max(axis=1, keepdims=True)
+                pooled = np.divide(pooled, maxs, out=np.zeros_like(pooled), where=maxs > 0)
+
+            result[resolution] = pooled
+
+        return result
+
+    @staticmethod
+    def squared_distances(queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """
+        Squared euclidean distances between two sets of vectors, of shape (n_queries, n_vectors)
+        """
+        queries = queries.astype(np.float64)
+        vectors = vectors.astype(np.float64)
+
+        distances = (queries ** 2).sum(axis=1)[:, None] + (vectors ** 2).sum(axis=1)[None, :] \
+            - 2 * queries @ vectors.T
+
+        return np.maximum(distances, 0)
+
+    @staticmethod
+    def search(
+            query_levels: Dict[int, np.ndarray],
+            levels: Dict[int, np.ndarray],
+            k: int,
+            coarse_resolution: Optional[int] = None,
+            shortlist: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Two-stage euclidean k nearest neighbour search
+        @param query_levels: the pyramids of the queries, as returned by pyramid
+        @param levels: the pyramids of the vectors searched, as returned by pyramid
+        @param k: the number of neighbours
+        @param coarse_resolution: the resolution candidates are shortlisted on, the smallest if
+        not provided
+        @param shortlist: the number of candidates reranked on the full resolution,
+        k * SHORTLIST_FACTOR if not provided
+        @return: the indices of the neighbours and their full resolution distances, of shape
+        (n_queries, k), sorted by increasing distance
+        """
+        coarse_resolution = coarse_resolution or min(levels.keys())
+        full_resolution = max(levels.keys())
+
+        coarse_queries, coarse = query_levels[coarse_resolution], levels[coarse_resolution]
+        full_queries, full = query_levels[full_resolution], levels[full_resolution]
+
+        n_queries = len(coarse_queries)
+        k = min(k, len(coarse))
+        shortlist = min(max(k, shortlist or k * ImagePyramid.SHORTLIST_FACTOR), len(coarse))
+
+        indices = np.empty((n_queries, k), dtype=np.int64)
+        distances = np.empty((n_queries, k), dtype=np.float32)
+
+        # Bounded by the coarse distance matrix and the shortlisted full resolution vectors
+        batch_size = max(1, ImagePyramid.BLOCK_SIZE // max(len(coarse), shortlist * full.shape[1], 1))
+
+        for start in range(0, n_queries, batch_size):
+            end = min(start + batch_size, n_queries)
+
+            # Stage 1: shortlist on the coarse level
+            coarse_distances = ImagePyramid.squared_distances(coarse_queries[start:end], coarse)
+            candidates = np.argpartition(coarse_distances, shortlist - 1, axis=1)[:, :shortlist]
+
+            # Stage 2: rerank the shortlist on the full resolution
+            differences = full[candidates] - full_queries[start:end, None, :]
+            full_distances = np.sqrt(np.einsum("qcd,qcd->qc", differences, differences))
+
+            order = np.argsort(full_distances, axis=1)[:, :k]
+            indices[start:end] = np.take_along_axis(candidates, order, axis=1)
+            distances[start:end] = np.take_along_axis(full_distances, order, axis=1)
+
+        return indices, distances
@@ -0,0 +1,119 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+from typing import Dict, Optional, Any, Iterable
+
+
+class ContentDigest:
+    """
+    Content addressing of morphology files, so that a file published in several buckets (or
+    by several resources) is downloaded and processed once, and its results mapped back to
+    every id + rev referencing it.
+    Distributions registered in Nexus carry the digest of their content, which identifies
+    identical files before downloading them. Local files are identified by the SHA-256 of
+    their bytes.
+    """
+
+    ALGORITHM = "SHA-256"
+    READ_SIZE = 2 ** 20
+    # Prefix of the persistence diagram cache keys of digests, distinguishing them from ids
+    CACHE_KEY_PREFIX = "digest:"
+
+    @staticmethod
+    def of_distribution(distribution: Optional[Any]) -> Optional[str]:
+        """
+        @param distribution: a DataDownload resource
+        @return: the digest registered with the distribution, prefixed by its algorithm, None
+        if it has none
+        """
+        digest = getattr(distribution, "digest", None) if distribution is not None else None
+        value = getattr(digest, "value", None) if digest is not None else None
+
+        if value is None:
+            return None
+
+        return f"{getattr(digest, 'algorithm', ContentDigest.ALGORITHM)}:{value}"
+
+    @staticmethod
+    def of_file(filename: str) -> Optional[str]:
+        """
+        @return: the SHA-256 of the content of the file, prefixed by its algorithm, None if the
+        file does not exist
+        """
+        if not os.path.isfile(filename):
+            return None
+
+        sha256 = hashlib.sha256()
+
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(ContentDigest.READ_SIZE), b""):
+                sha256.update(block)
+
+        return f"{ContentDigest.ALGORITHM}:{sha256.hexdigest()}"
+
+    @staticmethod
+    def content_size(distribution: Optional[Any]) -> Optional[int]:
+        content_size = getattr(distribution, "contentSize", None) if distribution is not None else None
+        value = getattr(content_size, "value", None) if content_size is not None else None
+        return int(value) if value is not None else None
+
+    @staticmethod
+    def matches(filename: str, distribution: Optional[Any]) -> bool:
+        """
+        @return: whether the file exists and has the content of the distribution, checked by
+        its digest if it is a SHA-256 one, else by its size. False if the distribution has
+        neither
+        """
+        if distribution is None or not os.path.isfile(filename):
+            return False
+
+        digest = ContentDigest.of_distribution(distribution)
+
+        if digest is not None and digest.lower().startswith(f"{ContentDigest.ALGORITHM.lower()}:"):
+            return ContentDigest.of_file(filename).lower() == digest.lower()
+
+        size = ContentDigest.content_size(distribution)
+
+        return size is not None and os.path.getsize(filename) == size
+
+    @staticmethod
+    def representatives(digests: Dict[str, Optional[str]]) -> Dict[str, str]:
+        """
+        @param digests: the digest of the content of each key, None if unknown
+        @return: for each key, the first key with the same digest. Keys without a digest are
+        their own representative
+        """
+        first: Dict[str, str] = dict()
+
+        return dict(
+            (key, first.setdefault(digest, key) if digest is not None else key)
+            for key, digest in digests.items()
+        )
+
+    @staticmethod
+    def cache_key(digest: str) -> str:
+        return f"{ContentDigest.CACHE_KEY_PREFIX}{digest}"
+
+    @staticmethod
+    def cache_keys(digests: Dict[str, Optional[str]], keys: Iterable[str]) -> Dict[str, str]:
+        """
+        The cache key of the digest of each of the keys that has one
+        """
+        return dict(
+            (key, ContentDigest.cache_key(digests[key]))
+            for key in keys if digests.get(key) is not None
+        )
@@ -0,0 +1,238 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import resource
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+from similarity_tools.helpers.logger import logger
+
+
+class ComputationFailure:
+    TIMEOUT = "timeout"
+    MEMORY = "memory"
+    CRASH = "crash"
+    ERROR = "error"
+
+    def __init__(self, id_rev: str, reason: str, elapsed: Optional[float], message: Optional[str] = None):
+        self.id_rev = id_rev
+        self.reason = reason
+        self.elapsed = elapsed
+        self.message = message
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id_rev,
+            "reason": self.reason,
+            "elapsed": self.elapsed,
+            "message": self.message
+        }
+
+    @staticmethod
+    def from_dict(dictionary: Dict) -> 'ComputationFailure':
+        return ComputationFailure(
+            dictionary["id"], dictionary["reason"], dictionary["elapsed"], dictionary["message"]
+        )
+
+
+class IsolatedComputation:
+    """
+    Run a function on every file in a bounded set of worker processes, under a wall-clock timeout
+    and a memory ceiling. A worker exceeding either is stopped, the file recorded as a failure and
+    the worker replaced, while the other workers keep going, so that one pathological file cannot
+    stall or kill a whole run. Workers are reused from one file to the next.
+    """
+
+    POLL_INTERVAL = 1
+
+    @staticmethod
+    def _virtual_memory_size() -> int:
+        """
+        @return: the size in bytes of the address space of the current process, 0 if unknown
+        """
+        try:
+            with open("/proc/self/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmSize:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+
+        return 0
+
+    @staticmethod
+    def _serve(
+            connection, function: Callable, argument, memory_limit: Optional[int],
+            initializer: Optional[Callable], initargs: Tuple
+    ):
+        if initializer is not None:
+            initializer(*initargs)
+
+        if memory_limit is not None:
+            # Caps the address space of the worker at what it already maps (inherited from the
+            # parent, libraries, thread stacks) plus the limit, allocations beyond raise MemoryError
+            limit = IsolatedComputation._virtual_memory_size() + memory_limit
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+        try:
+            while True:
+                filename = connection.recv()
+
+                if filename is None:
+                    break
+
+                try:
+                    connection.send((None, function(filename, argument)))
+                except MemoryError as e:
+                    # The worker exits, to be replaced by one with a fresh address space
+                    connection.send((ComputationFailure.MEMORY, repr(e)))
+                    break
+                except Exception as e:
+                    connection.send((ComputationFailure.ERROR, repr(e)))
+        except EOFError:
+            pass
+        finally:
+            connection.close()
+
+    @staticmethod
+    def run(
+            function: Callable,
+            id_to_filename: Dict[str, str],
+            argument,
+            n_jobs: int,
+            timeout: Optional[float],
+            memory_limit: Optional[int],
+            initializer: Optional[Callable] = None,
+            initargs: Tuple = ()
+    ) -> Tuple[Dict[str, Any], List[ComputationFailure]]:
+        """
+        @param function: the function to call as function(filename, argument)
+        @param id_to_filename: the files to process, by morphology id + rev
+        @param n_jobs: the number of worker processes
+        @param timeout: the maximum duration in seconds of the computation of a file
+        @param memory_limit: the maximum number of bytes a worker process can allocate on top of
+        its address space once started
+        @param initializer: a function called with initargs in every worker before the computation
+        @return: the results, by id + rev, of the files that did not fail, and the failures
+        """
+        context = multiprocessing.get_context()
+        pending = deque(id_to_filename.items())
+
+        # Task (id + rev, filename, start time) of each worker, None when idle
+        workers: Dict[Any, Tuple[Any, Optional[Tuple[str, str, float]]]] = dict()
+
+        results: Dict[str, Any] = dict()
+        failures: List[ComputationFailure] = []
+
+        def spawn():
+            connection, child_connection = context.Pipe(duplex=True)
+            process = context.Process(
+                target=IsolatedComputation._serve,
+                args=(child_connection, function, argument, memory_limit, initializer, initargs),
+                daemon=True
+            )
+            process.start()
+            child_connection.close()
+            workers[connection] = (process, None)
+
+        def retire(connection):
+            process, _ = workers.pop(connection)
+            process.kill()
+            process.join()
+            connection.close()
+
+        def fail(id_rev: str, filename: str, reason: str, elapsed: float, message: str):
+            failures.append(ComputationFailure(id_rev, reason, elapsed, message))
+            logger.warning(f">  {filename} failed: {reason} after {elapsed:.1f}s")
+
+        for _ in range(min(max(n_jobs, 1), len(pending))):
+            spawn()
+
+        while pending or any(task is not None for _, task in workers.values()):
+
+            for connection, (process, task) in list(workers.items()):
+                if task is None and pending:
+                    id_rev, filename = pending.popleft()
+
+                    try:
+                        connection.send(filename)
+                    except (BrokenPipeError, OSError):
+                        # The worker died while idle, the file goes to its replacement
+                        pending.appendleft((id_rev, filename))
+                        retire(connection)
+                        spawn()
+                        continue
+
+                    workers[connection] = (process, (id_rev, filename, time.monotonic()))
+
+            busy = [connection for connection, (_, task) in workers.items() if task is not None]
+            wait(busy, timeout=IsolatedComputation.POLL_INTERVAL)
+
+            now = time.monotonic()
+
+            for connection in busy:
+                process, (id_rev, filename, start) = workers[connection]
+
+                if connection.poll():
+                    try:
+                        reason, value = connection.recv()
+                    except EOFError:
+                        # The worker died without sending anything, e.g. killed by the OOM killer
+                        process.join()
+                        reason, value = ComputationFailure.CRASH, f"exit code {process.exitcode}"
+
+                    elapsed = time.monotonic() - start
+
+                    if reason is None:
+                        results[id_rev] = value
+                        workers[connection] = (process, None)
+                        continue
+
+                    fail(id_rev, filename, reason, elapsed, value)
+
+                    if reason == ComputationFailure.ERROR:
+                        workers[connection] = (process, None)
+                        continue
+
+                elif timeout is not None and now - start > timeout:
+                    fail(id_rev, filename, ComputationFailure.TIMEOUT, now - start, f"Exceeded the timeout of {timeout}s")
+                else:
+                    continue
+
+                # Workers that timed out, ran out of memory or crashed are replaced
+                retire(connection)
+
+                if pending:
+                    spawn()
+
+        for connection in list(workers.keys()):
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+
+            process, _ = workers.pop(connection)
+            process.join(timeout=IsolatedComputation.POLL_INTERVAL)
+
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+            connection.close()
+
+        return results, failures
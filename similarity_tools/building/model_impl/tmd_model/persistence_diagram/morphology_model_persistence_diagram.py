@@ -13,10 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ThreadPoolExecutor
+
 from kgforge.core import KnowledgeGraphForge, Resource
-from typing import Optional, List
+from typing import Optional, List, Dict, Iterable
 
 from similarity_tools.registration.registration_exception import SimilarityToolsException
+from similarity_tools.helpers.elastic import ElasticSearch
+from similarity_tools.helpers.logger import logger
+from similarity_tools.helpers.utils import encode_id_rev_resource
 
 from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram import \
     PersistenceDiagram, NeuriteType
@@ -26,15 +31,92 @@ import json
 
 class MorphologyModelPersistenceDiagram(PersistenceDiagram):
 
+    # Number of morphology model distributions retrieved concurrently, when not resolved
+    # through Elasticsearch
+    RETRIEVE_WORKERS = 8
+
     @classmethod
     def get_distribution(cls, m: Resource, forge: KnowledgeGraphForge) -> Optional[Resource]:
         return forge.retrieve(m.morphologyModelDistribution.id).distribution
 
+    @classmethod
+    def get_distribution_resources(
+            cls, data: List[Resource], forge: KnowledgeGraphForge
+    ) -> Dict[str, Optional[Resource]]:
+        """
+        Resolve the morphologyModelDistribution of all models at once, instead of one
+        retrieve per model
+        """
+        distribution_ids = dict(
+            (encode_id_rev_resource(m), m.morphologyModelDistribution.id) for m in data
+        )
+
+        resolved = cls._resolve_distributions(set(distribution_ids.values()), forge)
+
+        return dict(
+            (id_rev, resolved.get(distribution_id, None))
+            for id_rev, distribution_id in distribution_ids.items()
+        )
+
+    @classmethod
+    def _resolve_distributions(
+            cls, distribution_ids: Iterable[str], forge: KnowledgeGraphForge
+    ) -> Dict[str, Optional[Resource]]:
+        """
+        Fetch the resources in batched Elasticsearch id lookups, and those not found (or not
+        indexed with their distribution) with concurrent retrieves
+        @return: a dictionary with keys the morphology model distribution ids, and values their
+        distribution, None if they could not be retrieved
+        """
+        distribution_ids = list(distribution_ids)
+        resolved: Dict[str, Optional[Resource]] = dict()
+
+        try:
+            for r in ElasticSearch.get_by_ids_batched(distribution_ids, forge):
+                if getattr(r, "distribution", None) is not None:
+                    resolved[r.id] = r.distribution
+        except Exception as e:
+            logger.warning(f">  Elasticsearch resolution of morphology model distributions failed: {e}")
+
+        missing = [i for i in distribution_ids if i not in resolved]
+
+        logger.info(
+            f">  {len(resolved)} morphology model distributions resolved through Elasticsearch, "
+            f"{len(missing)} to retrieve"
+        )
+
+        def retrieve(distribution_id: str) -> Optional[Resource]:
+            try:
+                r = forge.retrieve(distribution_id)
+                return r.distribution if r is not None else None
+            except Exception as e:
+                logger.warning(f">  Could not retrieve {distribution_id}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=cls.RETRIEVE_WORKERS) as executor:
+            resolved.update(zip(missing, executor.map(retrieve, missing)))
+
+        return resolved
+
     @classmethod
     def get_persistence_data(cls, filename, neurite_type: NeuriteType) -> Optional[List]:
+        return cls.get_persistence_data_multi(filename, [neurite_type])[neurite_type]
+
+    @classmethod
+    def get_persistence_data_multi(
+            cls, filename: str, neurite_types: List[NeuriteType]
+    ) -> Dict[NeuriteType, Optional[List]]:
         with open(filename) as f:
             t = json.load(f)
 
+        return dict(
+            (neurite_type, cls._get_compartment_persistence_data(t, neurite_type))
+            for neurite_type in neurite_types
+        )
+
+    @staticmethod
+    def _get_compartment_persistence_data(t, neurite_type: NeuriteType) -> List:
+
         compartment = t[neurite_type.value]
 
         if compartment["filtration_metric"] != PersistenceDiagram.FILTRATION_METRIC:
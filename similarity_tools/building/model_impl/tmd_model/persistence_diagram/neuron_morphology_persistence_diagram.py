@@ -13,8 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Optional, List
+from typing import Optional, List, Dict
 
+import numpy as np
+from scipy.optimize import linear_sum_assignment
 from morphio import Morphology, Option
 from tmd.Topology.methods import get_ph_neuron
 from tmd.io.io import load_neuron_from_morphio
@@ -23,9 +25,30 @@ from kgforge.core import Resource, KnowledgeGraphForge
 
 from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram import \
     PersistenceDiagram, NeuriteType
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.swc_persistence import \
+    SWCPersistence
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.parsed_morphology_cache \
+    import ParsedMorphologyCache
 
 
 class NeuronMorphologyPersistenceDiagram(PersistenceDiagram):
+
+    # Compute path distance diagrams of SWC files from their point and parent arrays,
+    # instead of building morphio and tmd objects
+    NATIVE = False
+    # If set, the native computation loads parsed SWC files from this cache directory
+    PARSED_MORPHOLOGY_CACHE_DIR: Optional[str] = None
+    # Barcodes differing in sorted order are matched bar to bar by same_bars up to this size,
+    # the cost matrix being quadratic in the number of bars
+    MATCHING_MAX_BARS = 4000
+
+    @classmethod
+    def _configuration(cls) -> Dict:
+        return {
+            "NATIVE": cls.NATIVE,
+            "PARSED_MORPHOLOGY_CACHE_DIR": cls.PARSED_MORPHOLOGY_CACHE_DIR
+        }
+
     @classmethod
     def get_distribution(cls, m: Resource, forge: KnowledgeGraphForge) -> Optional[Resource]:
 
@@ -36,19 +59,100 @@ class NeuronMorphologyPersistenceDiagram(PersistenceDiagram):
         except StopIteration:
             return None
 
+    @staticmethod
+    def _get_ph_neuron(neuron, neurite_type: NeuriteType) -> List:
+        return get_ph_neuron(
+            neuron, neurite_type=neurite_type.value,
+            feature=PersistenceDiagram.FILTRATION_METRIC
+        )
+
     @classmethod
     def get_persistence_data(cls, filename: str, neurite_type: NeuriteType) -> Optional[List]:
+        return cls.get_persistence_data_multi(filename, [neurite_type])[neurite_type]
 
-        try:
-            morphology = Morphology(filename, Option.soma_sphere)
-            neuron = load_neuron_from_morphio(morphology)
-
-            return get_ph_neuron(
-                neuron, neurite_type=neurite_type.value,
-                feature=PersistenceDiagram.FILTRATION_METRIC
+    @classmethod
+    def get_persistence_data_multi(
+            cls, filename: str, neurite_types: List[NeuriteType]
+    ) -> Dict[NeuriteType, Optional[List]]:
+        """
+        Errors are raised, for the caller to record them as failures of the file, with their
+        reason (MemoryError included), duration and message, see PersistenceDiagram._timed_call
+        """
+        if cls.NATIVE and filename.lower().endswith(".swc"):
+            return cls.get_persistence_data_native(
+                filename, neurite_types, parsed_morphology_cache_dir=cls.PARSED_MORPHOLOGY_CACHE_DIR
             )
 
-        except Exception as e:
-            print(f"{filename} failed")
-            print(e)
-            return None
+        morphology = Morphology(filename, Option.soma_sphere)
+        neuron = load_neuron_from_morphio(morphology)
+
+        return dict(
+            (neurite_type, cls._get_ph_neuron(neuron, neurite_type))
+            for neurite_type in neurite_types
+        )
+
+    @staticmethod
+    def get_persistence_data_native(
+            filename: str, neurite_types: List[NeuriteType],
+            parsed_morphology_cache_dir: Optional[str] = None
+    ) -> Dict[NeuriteType, Optional[List]]:
+        if parsed_morphology_cache_dir is None:
+            return SWCPersistence.get_persistence_data(filename, neurite_types)
+
+        points, _, types, parents = ParsedMorphologyCache(parsed_morphology_cache_dir).load(filename)
+        return SWCPersistence.get_persistence_diagrams(points, types, parents, neurite_types)
+
+    @staticmethod
+    def same_bars(expected: List, actual: List, rtol=1e-4, atol=1e-3) -> bool:
+        """
+        Whether two barcodes hold the same bars up to their order and the tolerance. If they
+        differ in sorted order, bars are matched optimally: bars with equal births (ties of path
+        distances) can be sorted differently on either side by float rounding alone.
+        """
+        expected = np.array([bar[:2] for bar in expected], dtype=np.float64).reshape(-1, 2)
+        actual = np.array([bar[:2] for bar in actual], dtype=np.float64).reshape(-1, 2)
+
+        if expected.shape != actual.shape:
+            return False
+
+        if len(expected) == 0:
+            return True
+
+        def sort(bars):
+            return bars[np.lexsort((bars[:, 1], bars[:, 0]))]
+
+        if np.allclose(sort(expected), sort(actual), rtol=rtol, atol=atol):
+            return True
+
+        if len(expected) > NeuronMorphologyPersistenceDiagram.MATCHING_MAX_BARS:
+            return False
+
+        # Largest difference of birth or death between every pair of bars
+        cost = np.abs(expected[:, np.newaxis, :] - actual[np.newaxis, :, :]).max(axis=2)
+        rows, columns = linear_sum_assignment(cost)
+
+        tolerance = atol + rtol * np.abs(expected[rows]).max(axis=1)
+
+        return bool(np.all(cost[rows, columns] <= tolerance))
+
+    @staticmethod
+    def validate_native(
+            filename: str, neurite_types: List[NeuriteType], rtol=1e-4, atol=1e-3
+    ) -> Dict[NeuriteType, bool]:
+        """
+        Check that the native SWC computation yields the same bars as get_ph_neuron, up to
+        their order and the float32 precision of morphio points
+        """
+        native = SWCPersistence.get_persistence_data(filename, neurite_types)
+        neuron = load_neuron_from_morphio(Morphology(filename, Option.soma_sphere))
+
+        return dict(
+            (
+                neurite_type,
+                NeuronMorphologyPersistenceDiagram.same_bars(
+                    NeuronMorphologyPersistenceDiagram._get_ph_neuron(neuron, neurite_type), native[neurite_type],
+                    rtol=rtol, atol=atol
+                )
+            )
+            for neurite_type in neurite_types
+        )
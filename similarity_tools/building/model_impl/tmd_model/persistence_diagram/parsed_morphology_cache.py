@@ -0,0 +1,73 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from typing import Tuple
+
+import numpy as np
+
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.swc_persistence import \
+    SWCPersistence
+
+
+class ParsedMorphologyCache:
+    """
+    Cache of parsed SWC files, so that text parsing is paid once per morphology revision.
+    Points, radii, types and parent indices are stored in a compressed .npz file per file.
+    Downloaded files live in a directory per id + rev ({download_dir}/{uuid_rev}/{name}), the
+    cache mirrors this layout and is therefore keyed by id + rev as well.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def path(self, filename: str) -> str:
+        uuid_rev = os.path.basename(os.path.dirname(os.path.abspath(filename)))
+        return os.path.join(self.cache_dir, uuid_rev, f"{os.path.basename(filename)}.npz")
+
+    def __contains__(self, filename: str) -> bool:
+        return os.path.exists(self.path(filename))
+
+    def save(self, filename: str, points, radii, types, parents):
+        path = self.path(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.tmp.npz"
+
+        np.savez_compressed(
+            tmp_path,
+            points=points.astype(np.float32),
+            radii=radii.astype(np.float32),
+            types=types.astype(np.int8),
+            parents=parents.astype(np.int32)
+        )
+        os.replace(tmp_path, path)
+
+    def load(self, filename: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        @return: the points (n, 3), radii (n), types (n) and parent indices (n, -1 for roots)
+        of the file, parsed and added to the cache if it is not in it yet
+        """
+        path = self.path(filename)
+
+        if not os.path.exists(path):
+            points, radii, types, parents = SWCPersistence.read_swc(filename)
+            self.save(filename, points, radii, types, parents)
+
+        with np.load(path) as parsed:
+            return (
+                parsed["points"], parsed["radii"],
+                parsed["types"].astype(np.int64), parsed["parents"].astype(np.int64)
+            )
@@ -15,16 +15,32 @@
 
 import os
 import json
+import time
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import repeat
 
+import numpy as np
 from kgforge.core import Resource, KnowledgeGraphForge
 
 from similarity_tools.helpers.logger import logger
 from similarity_tools.registration.registration_exception import ModelBuildingException
 from similarity_tools.helpers.utils import encode_id_rev, encode_id_rev_resource
-
-from typing import List, Optional, Dict
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram_cache \
+    import PersistenceDiagramCache
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram_store \
+    import PersistenceDiagramStore
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.isolated_computation \
+    import IsolatedComputation, ComputationFailure
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.content_digest \
+    import ContentDigest
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram_checkpoint \
+    import PersistenceDiagramCheckpoint
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.sharded_computation \
+    import ShardedComputation
+
+from typing import List, Optional, Dict, Callable, Tuple, Any, Set
 from enum import Enum
 
 
@@ -37,6 +53,28 @@ class NeuriteType(Enum):
 class PersistenceDiagram(ABC):
     FILTRATION_METRIC = "path_distances"
 
+    # Number of worker processes used to compute persistence diagrams, -1 uses all cores
+    N_JOBS = 1
+    # Number of files sent to a worker process at once
+    CHUNK_SIZE = 8
+    # If either is set, files are computed in isolated worker processes, stopped if they run for
+    # longer than TIMEOUT seconds on a file or allocate more than MEMORY_LIMIT bytes on top of
+    # their own footprint
+    TIMEOUT: Optional[float] = None
+    MEMORY_LIMIT: Optional[int] = None
+    # Download and compute files with identical content once, see ContentDigest
+    DEDUPLICATE = True
+    # Number of distributions downloaded concurrently
+    DOWNLOAD_WORKERS = 8
+    # Number of files after which the diagrams computed are checkpointed, so that an
+    # interrupted recomputation resumes from them. None disables checkpointing
+    CHECKPOINT_SIZE: Optional[int] = 512
+    # Failures recorded in a checkpoint that are computed again when resuming from it, the others
+    # (deterministic errors) are kept as failures
+    RESUME_RETRIED_FAILURES = (ComputationFailure.TIMEOUT, ComputationFailure.MEMORY, ComputationFailure.CRASH)
+    # Number of work units morphologies are partitioned into by a sharded recomputation
+    SHARD_UNITS = 256
+
     @classmethod
     @abstractmethod
     def get_persistence_data(cls, filename: str, neurite_type: NeuriteType) -> Optional[List]:
@@ -47,25 +85,50 @@ class PersistenceDiagram(ABC):
     def get_distribution(cls, m: Resource, forge: KnowledgeGraphForge) -> Optional[Resource]:
         pass
 
+    @classmethod
+    def get_persistence_data_multi(
+            cls, filename: str, neurite_types: List[NeuriteType]
+    ) -> Dict[NeuriteType, Optional[List]]:
+        """
+        Compute the persistence diagrams of several neurite types from a single file.
+        Implementations that parse the file should override this so that it is parsed once.
+        """
+        return dict(
+            (neurite_type, cls.get_persistence_data(filename, neurite_type))
+            for neurite_type in neurite_types
+        )
+
     @classmethod
     def get_distributions(
-            cls, data: List[Resource], download_dir: str, forge: KnowledgeGraphForge, download: bool
+            cls, data: List[Resource], download_dir: str, forge: KnowledgeGraphForge, download: bool,
+            distribution_resources: Optional[Dict[str, Optional[Resource]]] = None
     ) -> Dict[str, str]:
 
         if (data is None or forge is None) and download_dir:
             raise ModelBuildingException("Missing data or forge instance, cannot re-download")
 
-        distribution_resources: Dict[str, Resource] = dict(
-            (encode_id_rev_resource(m), cls.get_distribution(m, forge))
-            for m in data
-        )
+        if distribution_resources is None:
+            distribution_resources = cls.get_distribution_resources(data, forge)
+
+        # Distributions registered with the same digest are downloaded once, into the
+        # directory of the first id + rev referencing them
+        representatives: Dict[str, str] = ContentDigest.representatives(dict(
+            (id_rev, ContentDigest.of_distribution(distribution))
+            for id_rev, distribution in distribution_resources.items()
+        )) if cls.DEDUPLICATE else dict((id_rev, id_rev) for id_rev in distribution_resources.keys())
 
         if not download:
             logger.info("1. Getting local files")
         else:
             logger.info("1. Download content url")
-            PersistenceDiagram._download_distribution(
-                forge=forge, data=data, download_dir=download_dir,
+
+            to_download = [m for m in data if representatives[encode_id_rev_resource(m)] == encode_id_rev_resource(m)]
+
+            if len(to_download) < len(data):
+                logger.info(f">  {len(data) - len(to_download)} distributions are duplicates, not downloaded")
+
+            cls._download_distribution(
+                forge=forge, data=to_download, download_dir=download_dir,
                 distribution_resources=distribution_resources
             )
 
@@ -74,9 +137,24 @@ class PersistenceDiagram(ABC):
         return dict(
             (
                 id_rev,
-                f"{PersistenceDiagram._distribution_path(id_rev, download_dir)}/{distribution.name}"
+                f"{PersistenceDiagram._distribution_path(representative, download_dir)}/"
+                f"{distribution_resources[representative].name}"
             )
-            for id_rev, distribution in distribution_resources.items()
+            for id_rev, representative in representatives.items()
+            if distribution_resources[representative] is not None
+        )
+
+    @classmethod
+    def get_distribution_resources(
+            cls, data: List[Resource], forge: KnowledgeGraphForge
+    ) -> Dict[str, Optional[Resource]]:
+        """
+        @return: a dictionary with keys the morphology id + rev and values the distribution to
+        compute the persistence diagram of, None if it has none
+        """
+        return dict(
+            (encode_id_rev_resource(m), cls.get_distribution(m, forge))
+            for m in data
         )
 
     @staticmethod
@@ -85,26 +163,295 @@ class PersistenceDiagram(ABC):
         uuid_rev = id_rev.split('/')[-1]
         return f"{download_dir}/{uuid_rev}"
 
-    @staticmethod
+    @classmethod
     def _download_distribution(
-            forge: KnowledgeGraphForge, data: List[Resource], download_dir: str,
+            cls, forge: KnowledgeGraphForge, data: List[Resource], download_dir: str,
             distribution_resources: Dict[str, Resource]
     ):
+        """
+        Download the distributions, DOWNLOAD_WORKERS at once. Distributions whose file is
+        already on disk for the same id + rev, with the registered digest (or size), are skipped.
+        """
         logger.info(f"Downloading {len(data)} entities to {download_dir}'...")
 
         os.makedirs(os.path.dirname(download_dir), exist_ok=True)
 
+        to_download: List[Tuple[str, Resource, str]] = []
+        skipped = 0
+
         for m in data:
             id_rev = encode_id_rev_resource(m)
             path = PersistenceDiagram._distribution_path(id_rev, download_dir)
             d = distribution_resources[id_rev]
 
-            if d is not None:
-                forge.download(d, "contentUrl", path=path, overwrite=True)
-            else:
+            if d is None:
                 logger.info(f">  Missing file for {m.name}")
+            elif ContentDigest.matches(os.path.join(path, d.name), d):
+                skipped += 1
+            else:
+                to_download.append((id_rev, d, path))
+
+        logger.info(f">  {skipped} files already downloaded, {len(to_download)} to download")
+
+        def download(d: Resource, path: str) -> int:
+            forge.download(d, "contentUrl", path=path, overwrite=True)
+            return os.path.getsize(os.path.join(path, d.name))
+
+        start = time.perf_counter()
+        downloaded_bytes = 0
+        failed = 0
+
+        with ThreadPoolExecutor(max_workers=cls.DOWNLOAD_WORKERS) as executor:
+            futures = dict(
+                (executor.submit(download, d, path), id_rev) for id_rev, d, path in to_download
+            )
+
+            for future in as_completed(futures):
+                try:
+                    downloaded_bytes += future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f">  Failed to download the distribution of {futures[future]}: {e}")
+
+        elapsed = time.perf_counter() - start
+        n_downloaded = len(to_download) - failed
+
+        logger.info(
+            f">  Finished downloading files: {n_downloaded} files, {downloaded_bytes / 2 ** 20:.1f} MiB "
+            f"in {elapsed:.1f}s ({n_downloaded / max(elapsed, 1e-9):.1f} files/s, "
+            f"{downloaded_bytes / 2 ** 20 / max(elapsed, 1e-9):.1f} MiB/s), {failed} failed"
+        )
+
+    @classmethod
+    def _map_files(
+            cls,
+            function: Callable,
+            id_to_filename: Dict[str, str],
+            argument,
+            n_jobs: Optional[int],
+            chunk_size: Optional[int]
+    ) -> Tuple[Dict[str, Any], List[ComputationFailure]]:
+        n_jobs = n_jobs if n_jobs is not None else cls.N_JOBS
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        chunk_size = chunk_size if chunk_size is not None else cls.CHUNK_SIZE
+
+        ids = list(id_to_filename.keys())
+        filenames = [id_to_filename[id_rev] for id_rev in ids]
+
+        if cls.TIMEOUT is not None or cls.MEMORY_LIMIT is not None:
+            logger.info(
+                f">  Computing persistence diagrams of {len(ids)} files in isolated workers "
+                f"({n_jobs} at once, timeout: {cls.TIMEOUT}s, memory limit: {cls.MEMORY_LIMIT}B)"
+            )
+            results, failures = IsolatedComputation.run(
+                function=function, id_to_filename=id_to_filename, argument=argument,
+                n_jobs=n_jobs, timeout=cls.TIMEOUT, memory_limit=cls.MEMORY_LIMIT,
+                initializer=cls._configure, initargs=(cls._configuration(),)
+            )
+            return dict((id_rev, results[id_rev]) for id_rev in ids if id_rev in results), failures
+
+        if n_jobs <= 1 or len(filenames) <= 1:
+            return cls._collect_outcomes(
+                ids, filenames, [PersistenceDiagram._timed_call(function, filename, argument) for filename in filenames]
+            )
 
-        logger.info(">  Finished downloading files")
+        logger.info(
+            f">  Computing persistence diagrams of {len(filenames)} files with {n_jobs} workers "
+            f"and chunks of {chunk_size}"
+        )
+
+        with ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=cls._configure, initargs=(cls._configuration(),)
+        ) as executor:
+            outcomes = executor.map(
+                PersistenceDiagram._timed_call, repeat(function), filenames, repeat(argument), chunksize=chunk_size
+            )
+            return cls._collect_outcomes(ids, filenames, list(outcomes))
+
+    @staticmethod
+    def _timed_call(function: Callable, filename: str, argument) -> Tuple[Any, Optional[Tuple[str, float, str]]]:
+        """
+        Call function(filename, argument), catching its errors
+        @return: the result, None if the call failed, and if it did, the failure reason, the
+        duration of the call and the error message
+        """
+        start = time.monotonic()
+
+        try:
+            return function(filename, argument), None
+        except MemoryError as e:
+            reason, message = ComputationFailure.MEMORY, repr(e)
+        except Exception as e:
+            reason, message = ComputationFailure.ERROR, repr(e)
+
+        return None, (reason, time.monotonic() - start, message)
+
+    @staticmethod
+    def _collect_outcomes(
+            ids: List[str], filenames: List[str], outcomes: List[Tuple[Any, Optional[Tuple[str, float, str]]]]
+    ) -> Tuple[Dict[str, Any], List[ComputationFailure]]:
+        results: Dict[str, Any] = dict()
+        failures: List[ComputationFailure] = []
+
+        for id_rev, filename, (value, failure) in zip(ids, filenames, outcomes):
+            if failure is None:
+                results[id_rev] = value
+            else:
+                reason, elapsed, message = failure
+                failures.append(ComputationFailure(id_rev, reason, elapsed, message))
+                logger.warning(f">  {filename} failed: {reason} after {elapsed:.1f}s: {message}")
+
+        return results, failures
+
+    @classmethod
+    def _map_unique_files(
+            cls,
+            function: Callable,
+            id_to_filename: Dict[str, str],
+            argument,
+            n_jobs: Optional[int],
+            chunk_size: Optional[int]
+    ) -> Tuple[Dict[str, Any], List[ComputationFailure]]:
+        """
+        Same as _map_files, computing files with identical content once when DEDUPLICATE,
+        and mapping their results and failures back to every id + rev
+        """
+        if not cls.DEDUPLICATE:
+            return cls._map_files(function, id_to_filename, argument, n_jobs=n_jobs, chunk_size=chunk_size)
+
+        unique, representatives = cls._unique_files(id_to_filename)
+
+        results, failures = cls._map_files(function, unique, argument, n_jobs=n_jobs, chunk_size=chunk_size)
+
+        return cls._expand_results(results, failures, representatives)
+
+    @staticmethod
+    def _unique_files(id_to_filename: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """
+        @return: the files with distinct content, keyed by the id + rev of one of the morphologies
+        having them, and the id + rev of this representative morphology of every morphology
+        """
+        file_digests = dict(
+            (filename, ContentDigest.of_file(filename) or os.path.abspath(filename))
+            for filename in set(id_to_filename.values())
+        )
+        representatives = ContentDigest.representatives(dict(
+            (id_rev, file_digests[filename]) for id_rev, filename in id_to_filename.items()
+        ))
+
+        unique = dict((representative, id_to_filename[representative]) for representative in representatives.values())
+
+        if len(unique) < len(id_to_filename):
+            logger.info(f">  {len(id_to_filename) - len(unique)} files are duplicates, computed once")
+
+        return unique, representatives
+
+    @staticmethod
+    def _expand_results(
+            results: Dict[str, Any], failures: List[ComputationFailure], representatives: Dict[str, str]
+    ) -> Tuple[Dict[str, Any], List[ComputationFailure]]:
+        """
+        Map the results and failures of representative morphologies back to every morphology
+        they represent
+        """
+        failures_by_id: Dict[str, List[ComputationFailure]] = dict()
+        for failure in failures:
+            failures_by_id.setdefault(failure.id_rev, []).append(failure)
+
+        return dict(
+            (id_rev, results[representative])
+            for id_rev, representative in representatives.items() if representative in results
+        ), [
+            ComputationFailure(id_rev, failure.reason, failure.elapsed, failure.message)
+            for id_rev, representative in representatives.items()
+            for failure in failures_by_id.get(representative, [])
+        ]
+
+    @classmethod
+    def _configuration(cls) -> Dict:
+        """
+        Class level settings that worker processes must share with the parent process.
+        They are inherited when workers are forked, but not with other start methods.
+        """
+        return dict()
+
+    @classmethod
+    def _configure(cls, configuration: Dict):
+        for name, value in configuration.items():
+            setattr(cls, name, value)
+
+    @classmethod
+    def compute_persistence_data(
+            cls,
+            id_to_filename: Dict[str, str],
+            neurite_type: NeuriteType,
+            n_jobs: Optional[int] = None,
+            chunk_size: Optional[int] = None
+    ) -> Dict[str, Optional[List]]:
+        """
+        Compute the persistence diagram of every file, either serially or in a pool of
+        worker processes. Results are collected in the order of id_to_filename.
+        @param id_to_filename: a dictionary with keys the morphology id + rev and values the
+        path of the file to compute the persistence diagram of
+        @type id_to_filename: Dict[str, str]
+        @param neurite_type: the neurite type to compute the persistence diagrams of
+        @type neurite_type: NeuriteType
+        @param n_jobs: the number of worker processes, -1 for all cores.
+        Defaults to PersistenceDiagram.N_JOBS
+        @type n_jobs: Optional[int]
+        @param chunk_size: the number of files submitted to a worker at once.
+        Defaults to PersistenceDiagram.CHUNK_SIZE
+        @type chunk_size: Optional[int]
+        @return: a dictionary with keys the morphology id + rev and values the persistence
+        diagram, None if its computation failed
+        @rtype: Dict[str, Optional[List]]
+        """
+        results, _ = cls._map_unique_files(
+            cls.get_persistence_data, id_to_filename, neurite_type,
+            n_jobs=n_jobs, chunk_size=chunk_size
+        )
+
+        return dict((id_rev, results.get(id_rev, None)) for id_rev in id_to_filename.keys())
+
+    @classmethod
+    def compute_persistence_data_multi(
+            cls,
+            id_to_filename: Dict[str, str],
+            neurite_types: List[NeuriteType],
+            n_jobs: Optional[int] = None,
+            chunk_size: Optional[int] = None,
+            deduplicate: bool = True
+    ) -> Tuple[Dict[NeuriteType, Dict[str, Optional[List]]], List[ComputationFailure]]:
+        """
+        Same as compute_persistence_data, for several neurite types at once. Each file is
+        parsed a single time for all neurite types.
+        @param deduplicate: whether to compute files with identical content once, when
+        DEDUPLICATE. False when the files are known to be distinct
+        @type deduplicate: bool
+        @return: a dictionary with keys the neurite types and values dictionaries with keys
+        the morphology id + rev and values the persistence diagram, None if its computation failed,
+        and the failures of isolated workers (timeouts, memory, crashes)
+        @rtype: Tuple[Dict[NeuriteType, Dict[str, Optional[List]]], List[ComputationFailure]]
+        """
+        map_method = cls._map_unique_files if deduplicate else cls._map_files
+
+        results, failures = map_method(
+            cls.get_persistence_data_multi, id_to_filename, neurite_types,
+            n_jobs=n_jobs, chunk_size=chunk_size
+        )
+
+        empty = dict((neurite_type, None) for neurite_type in neurite_types)
+
+        return dict(
+            (
+                neurite_type,
+                dict(
+                    (id_rev, results.get(id_rev, empty)[neurite_type])
+                    for id_rev in id_to_filename.keys()
+                )
+            )
+            for neurite_type in neurite_types
+        ), failures
 
     @classmethod
     def recompute_persistence_diagrams(
@@ -114,27 +461,373 @@ class PersistenceDiagram(ABC):
             persistence_diagram_location: str,
             data: List[Resource],
             re_download: bool,
-            neurite_type: NeuriteType
-    ):
+            neurite_type: NeuriteType,
+            n_jobs: Optional[int] = None,
+            cache_dir: Optional[str] = None
+    ) -> PersistenceDiagramStore:
+
+        return cls.recompute_persistence_diagrams_multi(
+            download_dir=download_dir,
+            forge=forge,
+            persistence_diagram_locations={neurite_type: persistence_diagram_location},
+            data=data,
+            re_download=re_download,
+            n_jobs=n_jobs,
+            cache_dir=cache_dir
+        )[neurite_type]
 
-        id_to_filename: Dict[str, str] = cls.get_distributions(
-            data=data, forge=forge, download_dir=download_dir, download=re_download
+    @staticmethod
+    def _latest_failures(failures: List[ComputationFailure]) -> Dict[str, ComputationFailure]:
+        """
+        @param failures: failures in the order they were recorded
+        @return: the last failure of each morphology, by id + rev
+        """
+        return dict((failure.id_rev, failure) for failure in failures)
+
+    @classmethod
+    def recompute_persistence_diagrams_multi(
+            cls,
+            download_dir: str,
+            forge: KnowledgeGraphForge,
+            persistence_diagram_locations: Dict[NeuriteType, str],
+            data: List[Resource],
+            re_download: bool,
+            n_jobs: Optional[int] = None,
+            cache_dir: Optional[str] = None
+    ) -> Dict[NeuriteType, PersistenceDiagramStore]:
+        """
+        Recompute the persistence diagrams of several neurite types in a single pass over the
+        morphologies, and write one store per neurite type.
+        @param persistence_diagram_locations: a dictionary with keys the neurite types to compute
+        the persistence diagrams of, and values the location of their store
+        @type persistence_diagram_locations: Dict[NeuriteType, str]
+        @return: the store of each neurite type
+        @rtype: Dict[NeuriteType, PersistenceDiagramStore]
+        """
+        neurite_types = list(persistence_diagram_locations.keys())
+
+        caches: Dict[NeuriteType, PersistenceDiagramCache] = dict(
+            (
+                neurite_type,
+                PersistenceDiagramCache(
+                    cache_dir=cache_dir, neurite_type_value=neurite_type.value,
+                    filtration_metric=cls.FILTRATION_METRIC
+                )
+            )
+            for neurite_type in neurite_types
+        ) if cache_dir is not None else dict()
+
+        id_revs = [encode_id_rev_resource(m) for m in data]
+
+        cached: Dict[NeuriteType, Dict[str, List]] = dict(
+            (neurite_type, caches[neurite_type].get_all(id_revs) if caches else dict())
+            for neurite_type in neurite_types
         )
 
-        computation: Dict[str, Optional[List]] = dict(
-            (k, cls.get_persistence_data(v, neurite_type)) for k, v in id_to_filename.items()
+        if caches:
+            # A morphology is recomputed for all neurite types if any of them is missing
+            data = [
+                m for m, id_rev in zip(data, id_revs)
+                if any(id_rev not in cached[neurite_type] for neurite_type in neurite_types)
+            ]
+
+            logger.info(
+                f">  {len(id_revs) - len(data)} morphologies found in cache, "
+                f"{len(data)} to compute"
+            )
+
+        checkpoints: Dict[NeuriteType, PersistenceDiagramCheckpoint] = dict(
+            (neurite_type, PersistenceDiagramCheckpoint(persistence_diagram_locations[neurite_type]))
+            for neurite_type in neurite_types
+        ) if cls.CHECKPOINT_SIZE is not None else dict()
+
+        checkpointed_failures: Dict[NeuriteType, Dict[str, ComputationFailure]] = dict(
+            (neurite_type, cls._latest_failures(checkpoint.load_failures()))
+            for neurite_type, checkpoint in checkpoints.items()
         )
 
-        diagrams: Dict[str, List] = dict(
-            (k, v) for k, v in computation.items() if v is not None
+        # Morphologies computed, or whose computation failed for a reason not retried, in an
+        # interrupted computation
+        checkpointed: Dict[NeuriteType, Set[str]] = dict(
+            (
+                neurite_type,
+                set(checkpoint.load().keys()).union(
+                    id_rev for id_rev, failure in checkpointed_failures[neurite_type].items()
+                    if failure.reason not in cls.RESUME_RETRIED_FAILURES
+                )
+            )
+            for neurite_type, checkpoint in checkpoints.items()
         )
 
-        os.makedirs(os.path.dirname(persistence_diagram_location), exist_ok=True)
+        if any(len(failed) > 0 for failed in checkpointed_failures.values()) or \
+                any(len(handled) > 0 for handled in checkpointed.values()):
+            # Resume an interrupted computation: morphologies checkpointed for all neurite
+            # types are not recomputed
+            done = set.intersection(*checkpointed.values())
+            data = [m for m in data if encode_id_rev_resource(m) not in done]
 
-        with open(persistence_diagram_location, "w") as f:
-            json.dump(diagrams, f)
+            failed = set().union(*(failed.keys() for failed in checkpointed_failures.values()))
+            skipped = len(failed.intersection(done))
 
-        return diagrams
+            logger.info(
+                f">  Resuming from checkpoint: {len(done)} morphologies done, of which {skipped} failed and are "
+                f"not retried, {len(failed) - skipped} failures retried, {len(data)} to compute"
+            )
+
+        distribution_resources = cls.get_distribution_resources(data, forge) if len(data) > 0 else dict()
+
+        digest_keys: Dict[str, str] = ContentDigest.cache_keys(
+            dict(
+                (id_rev, ContentDigest.of_distribution(distribution))
+                for id_rev, distribution in distribution_resources.items()
+            ),
+            distribution_resources.keys()
+        ) if caches and cls.DEDUPLICATE else dict()
+
+        if digest_keys:
+            # Morphologies whose file content was computed before, for another id + rev
+            digest_hits = dict(
+                (neurite_type, caches[neurite_type].get_all(set(digest_keys.values())))
+                for neurite_type in neurite_types
+            )
+            found = [
+                id_rev for id_rev, key in digest_keys.items()
+                if all(key in digest_hits[neurite_type] for neurite_type in neurite_types)
+            ]
+
+            for neurite_type in neurite_types:
+                cached[neurite_type].update(
+                    (id_rev, digest_hits[neurite_type][digest_keys[id_rev]]) for id_rev in found
+                )
+
+            found = set(found)
+            data = [m for m in data if encode_id_rev_resource(m) not in found]
+
+            if len(found) > 0:
+                logger.info(f">  {len(found)} morphologies found in cache by content digest")
+
+        id_to_filename: Dict[str, str] = cls.get_distributions(
+            data=data, forge=forge, download_dir=download_dir, download=re_download,
+            distribution_resources=dict(
+                (encode_id_rev_resource(m), distribution_resources[encode_id_rev_resource(m)]) for m in data
+            )
+        ) if len(data) > 0 else dict()
+
+        computed: Dict[NeuriteType, Dict[str, List]] = dict((neurite_type, dict()) for neurite_type in neurite_types)
+        failures: Dict[NeuriteType, List[ComputationFailure]] = dict((neurite_type, []) for neurite_type in neurite_types)
+
+        # Files with identical content are found among all files before chunking, so that
+        # duplicates in different chunks are computed once
+        if cls.DEDUPLICATE:
+            unique, representatives = cls._unique_files(id_to_filename)
+        else:
+            unique, representatives = id_to_filename, dict((id_rev, id_rev) for id_rev in id_to_filename.keys())
+
+        represented: Dict[str, Dict[str, str]] = dict()
+        for id_rev, representative in representatives.items():
+            represented.setdefault(representative, dict())[id_rev] = representative
+
+        ids = list(unique.keys())
+        checkpoint_size = cls.CHECKPOINT_SIZE or max(len(ids), 1)
+
+        for start in range(0, len(ids), checkpoint_size):
+            chunk = dict((id_rev, unique[id_rev]) for id_rev in ids[start:start + checkpoint_size])
+
+            unique_computation, unique_failures = cls.compute_persistence_data_multi(
+                id_to_filename=chunk, neurite_types=neurite_types, n_jobs=n_jobs, deduplicate=False
+            )
+
+            chunk_representatives = dict(
+                (id_rev, representative) for representative in chunk.keys()
+                for id_rev, representative in represented[representative].items()
+            )
+            computation: Dict[NeuriteType, Dict[str, Optional[List]]] = dict(
+                (neurite_type, cls._expand_results(unique_computation[neurite_type], [], chunk_representatives)[0])
+                for neurite_type in neurite_types
+            )
+            _, worker_failures = cls._expand_results(dict(), unique_failures, chunk_representatives)
+
+            failed_in_worker = set(failure.id_rev for failure in worker_failures)
+
+            for neurite_type in neurite_types:
+                chunk_computed = dict((k, v) for k, v in computation[neurite_type].items() if v is not None)
+
+                if caches:
+                    caches[neurite_type].put_all(chunk_computed)
+                    caches[neurite_type].put_all(dict(
+                        (digest_keys[id_rev], v) for id_rev, v in chunk_computed.items() if id_rev in digest_keys
+                    ))
+
+                # Implementations may also return None for a neurite type they could not compute
+                chunk_failures = worker_failures + [
+                    ComputationFailure(
+                        id_rev, ComputationFailure.ERROR, elapsed=None,
+                        message=f"No {neurite_type.value} persistence diagram returned"
+                    )
+                    for id_rev, v in computation[neurite_type].items()
+                    if v is None and id_rev not in failed_in_worker
+                ]
+
+                if checkpoints:
+                    # Kept on disk only, read back from the checkpoint when writing the store
+                    checkpoints[neurite_type].write_segment(chunk_computed, chunk_failures)
+                else:
+                    computed[neurite_type].update(chunk_computed)
+                    failures[neurite_type] += chunk_failures
+
+            if checkpoints:
+                logger.info(f">  Checkpointed {min(start + checkpoint_size, len(ids))}/{len(ids)} morphologies")
+
+        stores = dict()
+
+        for neurite_type in neurite_types:
+
+            if checkpoints:
+                # Only the morphologies requested, in case the checkpoint comes from another run
+                requested = set(id_revs)
+                computed[neurite_type] = dict(
+                    (id_rev, diagram) for id_rev, diagram in checkpoints[neurite_type].load().items()
+                    if id_rev in requested
+                )
+                # A failure retried on resume is superseded by the later outcome of the morphology
+                failures[neurite_type] = [
+                    failure for id_rev, failure in cls._latest_failures(checkpoints[neurite_type].load_failures()).items()
+                    if id_rev in requested and id_rev not in computed[neurite_type]
+                ]
+
+            diagrams: Dict[str, List] = {**cached[neurite_type], **computed[neurite_type]}
+
+            location = persistence_diagram_locations[neurite_type]
+            os.makedirs(os.path.dirname(location), exist_ok=True)
+
+            cls._write_failure_report(f"{location}_failures.json", failures[neurite_type])
+
+            stores[neurite_type] = PersistenceDiagramStore.write(location, diagrams)
+
+        for checkpoint in checkpoints.values():
+            checkpoint.clear()
+
+        return stores
+
+    @classmethod
+    def compute_persistence_diagrams_sharded(
+            cls,
+            queue_dir: str,
+            download_dir: str,
+            forge: KnowledgeGraphForge,
+            data: List[Resource],
+            neurite_types: List[NeuriteType],
+            re_download: bool,
+            n_jobs: Optional[int] = None,
+            cache_dir: Optional[str] = None,
+            n_units: Optional[int] = None
+    ) -> int:
+        """
+        Worker of a sharded recomputation: claim work units of the queue directory until none
+        is left, and compute their persistence diagrams. Any number of workers, on any node
+        mounting queue_dir, may run with the same data, which must be the data the queue was
+        planned with; merge_persistence_diagrams_sharded then writes the stores. A unit left by
+        a crashed worker is claimed again once its lock times out, and resumes from its checkpoint.
+        @param queue_dir: the queue directory, on a filesystem shared by all workers
+        @type queue_dir: str
+        @param n_units: the number of work units, if the queue has not been planned yet.
+        Defaults to PersistenceDiagram.SHARD_UNITS
+        @type n_units: Optional[int]
+        @return: the number of units computed by this worker
+        @rtype: int
+        """
+        queue = ShardedComputation(queue_dir)
+        id_to_resource = dict((encode_id_rev_resource(m), m) for m in data)
+
+        plan = queue.plan(list(id_to_resource.keys()), n_units or cls.SHARD_UNITS)
+        n_computed = 0
+
+        while True:
+            unit = queue.claim()
+
+            if unit is None:
+                break
+
+            logger.info(f">  Computing unit {unit} ({len(plan[unit])} morphologies)")
+
+            try:
+                with queue.heartbeat(unit):
+                    cls.recompute_persistence_diagrams_multi(
+                        download_dir=download_dir,
+                        forge=forge,
+                        persistence_diagram_locations=dict(
+                            (neurite_type, queue.result_location(unit, neurite_type.value))
+                            for neurite_type in neurite_types
+                        ),
+                        data=[id_to_resource[id_rev] for id_rev in plan[unit]],
+                        re_download=re_download,
+                        n_jobs=n_jobs,
+                        cache_dir=cache_dir
+                    )
+            except BaseException:
+                queue.release(unit)
+                raise
+
+            queue.complete(unit)
+            n_computed += 1
+
+        logger.info(f">  No unit left to claim in {queue_dir}, {n_computed} computed by this worker")
+
+        return n_computed
+
+    @classmethod
+    def merge_persistence_diagrams_sharded(
+            cls,
+            queue_dir: str,
+            persistence_diagram_locations: Dict[NeuriteType, str],
+            clear: bool = True
+    ) -> Dict[NeuriteType, PersistenceDiagramStore]:
+        """
+        Write the store of each neurite type from the results of all units of a sharded
+        recomputation, see compute_persistence_diagrams_sharded
+        @param clear: whether to remove the queue directory once the stores are written
+        @type clear: bool
+        @return: the store of each neurite type
+        @rtype: Dict[NeuriteType, PersistenceDiagramStore]
+        """
+        queue = ShardedComputation(queue_dir)
+        missing = queue.missing()
+
+        if len(missing) > 0:
+            raise ModelBuildingException(f"{len(missing)} units of {queue_dir} are not computed yet")
+
+        stores = dict()
+
+        for neurite_type, location in persistence_diagram_locations.items():
+            diagrams: Dict[str, np.ndarray] = dict()
+            failures: List[ComputationFailure] = []
+
+            for result_location in queue.results(neurite_type.value):
+                diagrams.update(PersistenceDiagramStore.load(result_location).items())
+
+                with open(f"{result_location}_failures.json", "r") as f:
+                    failures += [ComputationFailure.from_dict(failure) for failure in json.load(f)]
+
+            os.makedirs(os.path.dirname(location), exist_ok=True)
+
+            cls._write_failure_report(f"{location}_failures.json", failures)
+
+            stores[neurite_type] = PersistenceDiagramStore.write(location, diagrams)
+
+            logger.info(f">  Merged {len(diagrams)} persistence diagrams into {location}")
+
+        if clear:
+            queue.clear()
+
+        return stores
+
+    @staticmethod
+    def _write_failure_report(location: str, failures: List[ComputationFailure]):
+        if len(failures) > 0:
+            logger.warning(f">  {len(failures)} persistence diagrams failed, see {location}")
+
+        with open(location, "w") as f:
+            json.dump([failure.to_dict() for failure in failures], f, indent=2)
 
     @classmethod
     def get_persistence_diagrams(
@@ -145,8 +838,16 @@ class PersistenceDiagram(ABC):
             data: Optional[List[Resource]],
             persistence_diagram_location: str,
             download_dir: str,
-            neurite_type: NeuriteType
-    ) -> Dict[str, List]:
+            neurite_type: NeuriteType,
+            n_jobs: Optional[int] = None,
+            cache_dir: Optional[str] = None
+    ) -> PersistenceDiagramStore:
+        """
+        Load or recompute the persistence diagrams of a list of morphologies.
+        If a cache directory is provided, recomputing only computes the diagrams of
+        morphologies whose id + rev is not yet in the cache, and reuses the others.
+        The diagrams are returned as a memory-mapped PersistenceDiagramStore.
+        """
 
         if (data is None or forge is None) and re_compute:
             raise ModelBuildingException("Missing data or forge instance, cannot recompute")
@@ -158,10 +859,20 @@ class PersistenceDiagram(ABC):
                 forge=forge,
                 data=data,
                 re_download=re_download,
-                neurite_type=neurite_type
+                neurite_type=neurite_type,
+                n_jobs=n_jobs,
+                cache_dir=cache_dir
             )
         else:
-            with open(persistence_diagram_location, "r") as f:
-                diagrams = json.load(f)
+            legacy_location = f"{persistence_diagram_location}.json"
+
+            if not PersistenceDiagramStore.exists(persistence_diagram_location) \
+                    and os.path.exists(legacy_location):
+                logger.info(f">  Converting legacy persistence diagrams {legacy_location}")
+                diagrams = PersistenceDiagramStore.from_json(
+                    legacy_location, persistence_diagram_location
+                )
+            else:
+                diagrams = PersistenceDiagramStore.load(persistence_diagram_location)
 
         return diagrams
@@ -0,0 +1,70 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import hashlib
+
+from typing import Dict, List, Optional, Iterable
+
+
+class PersistenceDiagramCache:
+    """
+    Per-morphology cache of persistence diagrams. Each diagram is stored in its own file,
+    keyed by the morphology id + rev, the neurite type and the filtration metric, so that a
+    new revision of a morphology is never served a diagram computed for a previous one.
+    Diagrams are also stored under the content digest of their file (see ContentDigest), to be
+    reused by other ids + revs referencing identical files.
+    """
+
+    def __init__(self, cache_dir: str, neurite_type_value: str, filtration_metric: str):
+        self.directory = os.path.join(cache_dir, filtration_metric, neurite_type_value)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, id_rev: str) -> str:
+        digest = hashlib.sha1(id_rev.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def __contains__(self, id_rev: str) -> bool:
+        return os.path.exists(self.path(id_rev))
+
+    def get(self, id_rev: str) -> Optional[List]:
+        path = self.path(id_rev)
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "r") as f:
+            entry = json.load(f)
+
+        return entry["persistence_diagram"] if entry["id"] == id_rev else None
+
+    def put(self, id_rev: str, diagram: List):
+        path = self.path(id_rev)
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump({"id": id_rev, "persistence_diagram": diagram}, f)
+
+        # Atomic, so that an interrupted run never leaves a truncated entry behind
+        os.replace(tmp_path, path)
+
+    def get_all(self, id_revs: Iterable[str]) -> Dict[str, List]:
+        entries = ((id_rev, self.get(id_rev)) for id_rev in id_revs)
+        return dict((id_rev, diagram) for id_rev, diagram in entries if diagram is not None)
+
+    def put_all(self, diagrams: Dict[str, List]):
+        for id_rev, diagram in diagrams.items():
+            self.put(id_rev, diagram)
@@ -0,0 +1,93 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+from typing import Dict, List, Union
+
+import numpy as np
+
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram_store \
+    import PersistenceDiagramStore
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.isolated_computation \
+    import ComputationFailure
+
+
+class PersistenceDiagramCheckpoint:
+    """
+    Checkpoint of a persistence diagram store being computed: the diagrams completed so far,
+    written as a sequence of small segment stores next to the final store location, each with
+    the failures of its morphologies in segment_NNNNN_failures.json. An
+    interrupted computation resumes from the segments, and they are removed once the final
+    store is written.
+    """
+
+    SEGMENT_PREFIX = "segment_"
+
+    def __init__(self, location: str):
+        self.directory = f"{location}_checkpoint"
+
+    def segments(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.startswith(PersistenceDiagramCheckpoint.SEGMENT_PREFIX) and "." not in name
+            and PersistenceDiagramStore.exists(os.path.join(self.directory, name))
+        )
+
+    def load(self) -> Dict[str, np.ndarray]:
+        """
+        @return: the diagrams of all segments, as views on their memory-mapped stores
+        """
+        diagrams = dict()
+
+        for segment in self.segments():
+            diagrams.update(PersistenceDiagramStore.load(segment).items())
+
+        return diagrams
+
+    def load_failures(self) -> List[ComputationFailure]:
+        failures = []
+
+        for segment in self.segments():
+            with open(f"{segment}_failures.json", "r") as f:
+                failures += [ComputationFailure.from_dict(failure) for failure in json.load(f)]
+
+        return failures
+
+    def write_segment(self, diagrams: Dict[str, Union[List, np.ndarray]], failures: List[ComputationFailure]):
+        if len(diagrams) == 0 and len(failures) == 0:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Segments are numbered after the existing ones, and written atomically by the store
+        existing = self.segments()
+        index = int(os.path.basename(existing[-1])[len(PersistenceDiagramCheckpoint.SEGMENT_PREFIX):]) + 1 \
+            if existing else 0
+
+        segment = os.path.join(self.directory, f"{PersistenceDiagramCheckpoint.SEGMENT_PREFIX}{index:05d}")
+
+        # Written before the store, whose existence makes the segment part of the checkpoint
+        with open(f"{segment}_failures.json", "w") as f:
+            json.dump([failure.to_dict() for failure in failures], f)
+
+        PersistenceDiagramStore.write(segment, diagrams)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
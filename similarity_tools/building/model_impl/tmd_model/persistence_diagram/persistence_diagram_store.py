@@ -0,0 +1,158 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+import uuid
+
+from collections.abc import Mapping
+from typing import Dict, List, Union, Iterator, Optional
+
+import numpy as np
+
+from similarity_tools.registration.registration_exception import ModelBuildingException
+
+
+class PersistenceDiagramStore(Mapping):
+    """
+    Ragged on-disk store of persistence diagrams. All bars of all diagrams are kept in a single
+    (n_bars, 2) float32 array, diagram i being the rows offsets[i]:offsets[i + 1].
+    The arrays are memory-mapped when loaded, and indexing the store by morphology id + rev
+    returns a view on them, without copying.
+    """
+
+    VALUES_FILE = "values.npy"
+    OFFSETS_FILE = "offsets.npy"
+    IDS_FILE = "ids.json"
+
+    DTYPE = np.float32
+
+    def __init__(self, ids: List[str], bars: np.ndarray, offsets: np.ndarray):
+        if len(offsets) != len(ids) + 1:
+            raise ModelBuildingException(
+                f"Inconsistent persistence diagram store: {len(ids)} ids for "
+                f"{len(offsets) - 1} diagrams"
+            )
+
+        self.ids = ids
+        # Not named values, which would shadow Mapping.values
+        self.bars = bars
+        self.offsets = offsets
+        self._index: Dict[str, int] = dict((id_rev, i) for i, id_rev in enumerate(ids))
+
+    def diagram(self, i: int) -> np.ndarray:
+        return self.bars[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, id_rev: str) -> np.ndarray:
+        return self.diagram(self._index[id_rev])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, id_rev) -> bool:
+        return id_rev in self._index
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @staticmethod
+    def exists(location: str) -> bool:
+        return all(
+            os.path.exists(os.path.join(location, f))
+            for f in [
+                PersistenceDiagramStore.VALUES_FILE,
+                PersistenceDiagramStore.OFFSETS_FILE,
+                PersistenceDiagramStore.IDS_FILE
+            ]
+        )
+
+    @staticmethod
+    def load(location: str, mmap: bool = True) -> 'PersistenceDiagramStore':
+        if not PersistenceDiagramStore.exists(location):
+            raise ModelBuildingException(f"No persistence diagram store found at {location}")
+
+        mmap_mode = "r" if mmap else None
+
+        values = np.load(
+            os.path.join(location, PersistenceDiagramStore.VALUES_FILE), mmap_mode=mmap_mode
+        )
+        offsets = np.load(os.path.join(location, PersistenceDiagramStore.OFFSETS_FILE))
+
+        with open(os.path.join(location, PersistenceDiagramStore.IDS_FILE), "r") as f:
+            ids = json.load(f)
+
+        return PersistenceDiagramStore(ids=ids, bars=values, offsets=offsets)
+
+    @staticmethod
+    def write(
+            location: str, diagrams: Dict[str, Union[List, np.ndarray]]
+    ) -> 'PersistenceDiagramStore':
+        """
+        Write diagrams to a store at the provided location, replacing any existing store.
+        Diagrams are copied one by one into a memory-mapped output file, so no concatenated
+        copy of all diagrams is ever held in memory.
+        """
+        ids = list(diagrams.keys())
+
+        lengths = np.array([len(diagrams[id_rev]) for id_rev in ids], dtype=np.int64)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # Own temporary directory of each writer, so that concurrent writers never share one
+        tmp_location = f"{location}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_location)
+
+        try:
+            values = np.lib.format.open_memmap(
+                os.path.join(tmp_location, PersistenceDiagramStore.VALUES_FILE), mode="w+",
+                dtype=PersistenceDiagramStore.DTYPE, shape=(int(offsets[-1]), 2)
+            )
+
+            for i, id_rev in enumerate(ids):
+                if lengths[i] > 0:
+                    values[offsets[i]:offsets[i + 1]] = np.asarray(diagrams[id_rev])[:, :2]
+
+            values.flush()
+            del values
+
+            np.save(os.path.join(tmp_location, PersistenceDiagramStore.OFFSETS_FILE), offsets)
+
+            with open(os.path.join(tmp_location, PersistenceDiagramStore.IDS_FILE), "w") as f:
+                json.dump(ids, f)
+        except BaseException:
+            shutil.rmtree(tmp_location, ignore_errors=True)
+            raise
+
+        shutil.rmtree(location, ignore_errors=True)
+        os.replace(tmp_location, location)
+
+        return PersistenceDiagramStore.load(location)
+
+    @staticmethod
+    def from_json(json_location: str, location: Optional[str] = None) -> 'PersistenceDiagramStore':
+        """
+        Convert a legacy persistence diagram JSON dump (dict of nested lists) into a store
+        """
+        with open(json_location, "r") as f:
+            diagrams = json.load(f)
+
+        location = location if location is not None else os.path.splitext(json_location)[0]
+
+        return PersistenceDiagramStore.write(location, diagrams)
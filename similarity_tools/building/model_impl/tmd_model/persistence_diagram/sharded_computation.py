@@ -0,0 +1,257 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+
+from similarity_tools.registration.registration_exception import ModelBuildingException
+
+
+class ShardedComputation:
+    """
+    Work queue of a persistence diagram computation sharded across worker processes on any
+    number of nodes, through a directory on a shared filesystem, without any broker.
+    Morphologies are partitioned into work units by a hash of their id + rev, workers claim
+    units by creating their lock file exclusively, and mark them as done once their results
+    are written. Layout of the queue directory:
+    - plan.json: the id + rev of the morphologies of every unit
+    - locks/unit_NNNNN: held by the worker computing the unit, touched every HEARTBEAT_INTERVAL
+    - done/unit_NNNNN: written once the results of the unit are complete
+    - results/<neurite type>/unit_NNNNN: the persistence diagram store of the unit
+    """
+
+    PLAN_FILE = "plan.json"
+    UNIT_PREFIX = "unit_"
+
+    # Locks not touched for this many seconds are considered left by a crashed worker, and are
+    # broken so that their unit is computed again. None never breaks locks
+    LOCK_TIMEOUT: Optional[float] = 600
+    # Number of seconds between two touches of the lock of the unit a worker computes
+    HEARTBEAT_INTERVAL = 60
+
+    def __init__(self, queue_dir: str):
+        self.queue_dir = queue_dir
+        self.locks_dir = os.path.join(queue_dir, "locks")
+        self.done_dir = os.path.join(queue_dir, "done")
+        self.results_dir = os.path.join(queue_dir, "results")
+
+    @staticmethod
+    def unit_of(id_rev: str, n_units: int) -> int:
+        # Stable across processes and nodes, unlike hash()
+        return int(hashlib.sha256(id_rev.encode("utf-8")).hexdigest()[:16], 16) % n_units
+
+    @staticmethod
+    def unit_name(unit: int) -> str:
+        return f"{ShardedComputation.UNIT_PREFIX}{unit:05d}"
+
+    def plan(self, id_revs: List[str], n_units: int) -> Dict[str, List[str]]:
+        """
+        Partition the morphologies into units, unless a plan already exists in the queue
+        directory, in which case it is returned. Only non-empty units are part of the plan.
+        The first worker to run creates the plan, the others use it.
+        @return: a dictionary with keys the unit names and values the id + rev of their morphologies
+        """
+        plan_path = os.path.join(self.queue_dir, ShardedComputation.PLAN_FILE)
+        id_revs = set(id_revs)
+
+        if not os.path.exists(plan_path):
+            units: Dict[str, List[str]] = dict()
+
+            for id_rev in sorted(id_revs):
+                units.setdefault(
+                    ShardedComputation.unit_name(ShardedComputation.unit_of(id_rev, n_units)), []
+                ).append(id_rev)
+
+            os.makedirs(self.queue_dir, exist_ok=True)
+            tmp_path = f"{plan_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+
+            with open(tmp_path, "w") as f:
+                json.dump(dict(sorted(units.items())), f)
+
+            # Linking fails if another worker created the plan in the meantime, theirs is kept
+            try:
+                os.link(tmp_path, plan_path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+
+        plan = self.load_plan()
+        planned = set(id_rev for unit_id_revs in plan.values() for id_rev in unit_id_revs)
+
+        if planned != id_revs:
+            raise ModelBuildingException(
+                f"The queue {self.queue_dir} was planned for other morphologies "
+                f"({len(planned - id_revs)} planned not in the data, {len(id_revs - planned)} in the data not planned), "
+                f"clear it or use another queue directory"
+            )
+
+        return plan
+
+    def load_plan(self) -> Dict[str, List[str]]:
+        with open(os.path.join(self.queue_dir, ShardedComputation.PLAN_FILE), "r") as f:
+            return json.load(f)
+
+    def result_location(self, unit: str, neurite_type_value: str) -> str:
+        return os.path.join(self.results_dir, neurite_type_value, unit)
+
+    def is_done(self, unit: str) -> bool:
+        return os.path.exists(os.path.join(self.done_dir, unit))
+
+    def missing(self) -> List[str]:
+        """
+        @return: the units of the plan not done yet
+        """
+        return [unit for unit in self.load_plan().keys() if not self.is_done(unit)]
+
+    def _try_lock(self, unit: str) -> bool:
+        lock_path = os.path.join(self.locks_dir, unit)
+
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}, f)
+
+        return True
+
+    def _break_stale_lock(self, unit: str) -> bool:
+        if ShardedComputation.LOCK_TIMEOUT is None:
+            return False
+
+        lock_path = os.path.join(self.locks_dir, unit)
+        stale_path = f"{lock_path}.{socket.gethostname()}.{os.getpid()}.stale"
+
+        try:
+            stale = os.stat(lock_path)
+
+            if time.time() - stale.st_mtime < ShardedComputation.LOCK_TIMEOUT:
+                return False
+
+            os.rename(lock_path, stale_path)
+        except FileNotFoundError:
+            return False
+
+        renamed = os.stat(stale_path)
+
+        if (renamed.st_ino, renamed.st_mtime) != (stale.st_ino, stale.st_mtime):
+            # Between stat and rename, the lock was touched by its worker, or broken and taken by
+            # another worker: the lock renamed is a live one, and is put back
+            try:
+                os.link(stale_path, lock_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+
+        os.remove(stale_path)
+
+        return True
+
+    def heartbeat(self, unit: str) -> 'LockHeartbeat':
+        """
+        @return: a context manager touching the lock of the unit every HEARTBEAT_INTERVAL
+        seconds, from a background thread, while the unit is computed
+        """
+        return LockHeartbeat(os.path.join(self.locks_dir, unit), ShardedComputation.HEARTBEAT_INTERVAL)
+
+    def claim(self) -> Optional[str]:
+        """
+        Lock a unit not done yet. Units are tried in random order to limit contention
+        between workers starting together.
+        @return: the name of the unit claimed, None if all units are done or locked
+        """
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+        units = self.missing()
+        random.shuffle(units)
+
+        for unit in units:
+            if not self._try_lock(unit) and not (self._break_stale_lock(unit) and self._try_lock(unit)):
+                continue
+
+            # Completed by another worker between listing and locking
+            if self.is_done(unit):
+                self.release(unit)
+                continue
+
+            return unit
+
+        return None
+
+    def release(self, unit: str):
+        try:
+            os.remove(os.path.join(self.locks_dir, unit))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, unit: str):
+        os.makedirs(self.done_dir, exist_ok=True)
+
+        with open(os.path.join(self.done_dir, unit), "w") as f:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}, f)
+
+        self.release(unit)
+
+    def results(self, neurite_type_value: str) -> List[str]:
+        """
+        @return: the store locations of the results of all units of the plan, for a neurite type
+        """
+        return [self.result_location(unit, neurite_type_value) for unit in self.load_plan().keys()]
+
+    def clear(self):
+        shutil.rmtree(self.queue_dir, ignore_errors=True)
+
+
+class LockHeartbeat:
+    """
+    Touches a lock file at a regular interval from a daemon thread, so that other workers do
+    not consider it stale. It stops touching it if the lock file is replaced.
+    """
+
+    def __init__(self, lock_path: str, interval: float):
+        self.lock_path = lock_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._inode: Optional[int] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if os.stat(self.lock_path).st_ino != self._inode:
+                    return
+                os.utime(self.lock_path)
+            except FileNotFoundError:
+                return
+
+    def __enter__(self) -> 'LockHeartbeat':
+        self._inode = os.stat(self.lock_path).st_ino
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
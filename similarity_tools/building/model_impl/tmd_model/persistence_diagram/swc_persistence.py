@@ -0,0 +1,171 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Tuple, List, Dict
+
+import numpy as np
+
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram.persistence_diagram import \
+    NeuriteType
+
+
+class SWCPersistence:
+    """
+    Path distance persistence diagrams computed directly from the point and parent arrays of an
+    SWC file, without building morphio and tmd objects. The barcode is the one of
+    tmd.Topology.methods.get_ph_neuron with feature="path_distances": each neurite tree
+    yields one bar per non-surviving branch at every bifurcation (elder rule), plus a
+    [longest path distance, 0] bar for its root.
+    """
+
+    SOMA = 1
+
+    SWC_TYPES: Dict[NeuriteType, int] = {
+        NeuriteType.AXON: 2,
+        NeuriteType.BASAL_DENDRITE: 3,
+        NeuriteType.APICAL_DENDRITE: 4
+    }
+
+    @staticmethod
+    def read_swc(filename: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        @return: the points (n, 3), radii (n), types (n) and parent indices (n, -1 for roots)
+        of the SWC file. Parent indices are positions in these arrays, not SWC sample ids.
+        """
+        data = np.loadtxt(filename, comments="#", usecols=range(7), ndmin=2)
+
+        ids = data[:, 0].astype(np.int64)
+        parent_ids = data[:, 6].astype(np.int64)
+
+        order = np.argsort(ids)
+        sorted_ids = ids[order]
+        position = np.minimum(np.searchsorted(sorted_ids, parent_ids), len(ids) - 1)
+        has_parent = (parent_ids >= 0) & (sorted_ids[position] == parent_ids)
+
+        parents = np.where(has_parent, order[position], -1)
+
+        return data[:, 2:5], data[:, 5], data[:, 1].astype(np.int64), parents
+
+    @staticmethod
+    def _neurite_parents(types: np.ndarray, parents: np.ndarray) -> np.ndarray:
+        # Neurites are detached from the soma: their first point becomes a root
+        attached_to_soma = (parents >= 0) & (types[np.maximum(parents, 0)] == SWCPersistence.SOMA)
+        neurite_parents = np.where(attached_to_soma, -1, parents)
+        neurite_parents[types == SWCPersistence.SOMA] = -1
+        return neurite_parents
+
+    @staticmethod
+    def _list_ranking(parents: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Sum of the weights on the path from every node to its root, by pointer jumping:
+        O(n log(depth)) array operations instead of a traversal of the tree.
+        """
+        total = weights.astype(np.float64)
+        ancestors = parents.copy()
+        jumping = np.flatnonzero(ancestors >= 0)
+
+        while len(jumping) > 0:
+            current = ancestors[jumping]
+            total[jumping] += total[current]
+            ancestors[jumping] = ancestors[current]
+            jumping = jumping[ancestors[jumping] >= 0]
+
+        return total
+
+    @staticmethod
+    def _pointer_jump(pointers: np.ndarray, stop: np.ndarray) -> np.ndarray:
+        # Follow pointers until they reach a node where stop is True (or -1)
+        pointers = pointers.copy()
+        jumping = np.flatnonzero((pointers >= 0) & ~stop[np.maximum(pointers, 0)])
+
+        while len(jumping) > 0:
+            pointers[jumping] = pointers[pointers[jumping]]
+            jumping = jumping[(pointers[jumping] >= 0) & ~stop[np.maximum(pointers[jumping], 0)]]
+
+        return pointers
+
+    @staticmethod
+    def path_distances(points: np.ndarray, parents: np.ndarray) -> np.ndarray:
+        has_parent = parents >= 0
+        segment_lengths = np.zeros(len(points))
+        segment_lengths[has_parent] = np.linalg.norm(
+            points[has_parent] - points[parents[has_parent]], axis=1
+        )
+        return SWCPersistence._list_ranking(parents, segment_lengths)
+
+    @staticmethod
+    def get_persistence_diagrams(
+            points: np.ndarray, types: np.ndarray, parents: np.ndarray,
+            neurite_types: List[NeuriteType]
+    ) -> Dict[NeuriteType, List]:
+        n = len(points)
+        indices = np.arange(n)
+
+        neurite_parents = SWCPersistence._neurite_parents(types, parents)
+        distances = SWCPersistence.path_distances(points, neurite_parents)
+
+        is_root = (neurite_parents < 0) & (types != SWCPersistence.SOMA)
+        # -1 for soma points
+        tree_root = SWCPersistence._pointer_jump(np.where(is_root, indices, neurite_parents), is_root)
+
+        n_children = np.bincount(neurite_parents[neurite_parents >= 0], minlength=n)
+        is_key = (is_root | (n_children != 1)) & (tree_root >= 0)
+
+        # Reduced tree: every key node (root, bifurcation, termination) points to its closest
+        # key ancestor, nodes in between are only relevant through their path distance
+        key_parent = SWCPersistence._pointer_jump(neurite_parents, is_key)
+        key_parent[~is_key | is_root] = -1
+
+        depth = SWCPersistence._list_ranking(key_parent, (key_parent >= 0).astype(np.float64))
+        depth = depth.astype(np.int64)
+
+        # Value of the surviving branch of every subtree, propagated up level by level
+        survivor = np.where(is_key & (n_children == 0), distances, -np.inf)
+
+        for level in range(depth.max(initial=0), 0, -1):
+            nodes = np.flatnonzero(is_key & (depth == level))
+            np.maximum.at(survivor, key_parent[nodes], survivor[nodes])
+
+        # Elder rule: at every key node, the child subtree with the longest survivor continues,
+        # every other child subtree dies there
+        children = np.flatnonzero(key_parent >= 0)
+        children = children[np.lexsort((-survivor[children], key_parent[children]))]
+        first_of_parent = np.ones(len(children), dtype=bool)
+        first_of_parent[1:] = key_parent[children[1:]] != key_parent[children[:-1]]
+        dying = children[~first_of_parent]
+
+        tree_type = types[np.maximum(tree_root, 0)]
+
+        diagrams = dict()
+
+        for neurite_type in neurite_types:
+            swc_type = SWCPersistence.SWC_TYPES[neurite_type]
+
+            dying_in_type = dying[tree_type[dying] == swc_type]
+            roots_in_type = np.flatnonzero(is_root & (types == swc_type))
+
+            bars = np.concatenate([
+                np.stack([survivor[dying_in_type], distances[key_parent[dying_in_type]]], axis=1),
+                np.stack([survivor[roots_in_type], np.zeros(len(roots_in_type))], axis=1)
+            ])
+
+            diagrams[neurite_type] = bars.tolist()
+
+        return diagrams
+
+    @staticmethod
+    def get_persistence_data(filename: str, neurite_types: List[NeuriteType]) -> Dict[NeuriteType, List]:
+        points, _, types, parents = SWCPersistence.read_swc(filename)
+        return SWCPersistence.get_persistence_diagrams(points, types, parents, neurite_types)
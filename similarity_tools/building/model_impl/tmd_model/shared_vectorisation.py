@@ -0,0 +1,204 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Sequence, Tuple, Callable, Dict, Optional, List
+
+import numpy as np
+
+from similarity_tools.helpers.logger import logger
+
+
+class SharedArray:
+    """
+    A numpy array in a shared memory block, that other processes attach to by name, without
+    copying or pickling its content
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype, name: Optional[str] = None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)
+
+    @property
+    def spec(self) -> Tuple[str, Tuple[int, ...], str]:
+        return self.memory.name, self.shape, self.dtype.str
+
+    @staticmethod
+    def attach(spec: Tuple[str, Tuple[int, ...], str]) -> 'SharedArray':
+        name, shape, dtype = spec
+        return SharedArray(shape, dtype, name=name)
+
+    def close(self):
+        del self.array
+        self.memory.close()
+
+    def unlink(self):
+        self.close()
+        self.memory.unlink()
+
+
+class SharedVectorisation:
+    """
+    Parallel vectorisation of persistence diagrams without pickling them.
+
+    The diagrams are packed once into a shared-memory ragged buffer: all bars in a (n_bars, 2)
+    float32 array, diagram i being the rows offsets[i]:offsets[i + 1]. Worker processes attach
+    to it, vectorise ranges of diagrams, and write the vectors into a preallocated shared
+    float32 result matrix. Only range bounds and the vectorisation function, referenced by
+    name, go through the pipes to the workers.
+
+    Vectorisation functions take a sequence of diagrams and keyword arguments, and return a
+    (n_diagrams, dimension) array, like Vectorisation.compute_persistence_vectors or
+    Vectorisation.betti_curves. They must be importable module-level or static methods.
+    """
+
+    # Number of diagrams per task sent to a worker
+    CHUNK_SIZE = 64
+
+    _bars: Optional[SharedArray] = None
+    _offsets: Optional[SharedArray] = None
+    _result: Optional[SharedArray] = None
+
+    @staticmethod
+    def pack(diagrams: Sequence) -> Tuple[SharedArray, SharedArray]:
+        diagrams = [np.asarray(diagram, dtype=np.float32).reshape(-1, 2) for diagram in diagrams]
+
+        offsets = SharedArray((len(diagrams) + 1,), np.int64)
+        offsets.array[0] = 0
+        np.cumsum([len(diagram) for diagram in diagrams], out=offsets.array[1:])
+
+        bars = SharedArray((int(offsets.array[-1]), 2), np.float32)
+
+        for i, diagram in enumerate(diagrams):
+            bars.array[offsets.array[i]:offsets.array[i + 1]] = diagram
+
+        return bars, offsets
+
+    @staticmethod
+    def _attach(bars_spec, offsets_spec, result_spec):
+        SharedVectorisation._bars = SharedArray.attach(bars_spec)
+        SharedVectorisation._offsets = SharedArray.attach(offsets_spec)
+        SharedVectorisation._result = SharedArray.attach(result_spec)
+
+    @staticmethod
+    def _work(function: Callable, start: int, end: int, kwargs: Dict) -> Tuple[int, int, List[Tuple[int, str]]]:
+        bars = SharedVectorisation._bars.array
+        offsets = SharedVectorisation._offsets.array
+        result = SharedVectorisation._result.array
+
+        diagrams = [bars[offsets[i]:offsets[i + 1]] for i in range(start, end)]
+
+        try:
+            result[start:end] = function(diagrams, **kwargs)
+            return start, end, []
+        except Exception:
+            pass
+
+        # One diagram failing must not fail the others of its chunk: they are vectorised again
+        # one by one, and only the ones failing on their own are reported
+        failures = []
+
+        for i, diagram in zip(range(start, end), diagrams):
+            try:
+                result[i] = function([diagram], **kwargs)[0]
+            except Exception as e:
+                failures.append((i, str(e)))
+
+        return start, end, failures
+
+    @staticmethod
+    def _dimension(function: Callable, diagrams: Sequence, kwargs: Dict) -> Optional[int]:
+        """
+        @return: the dimension of the vectors, from the first diagram that can be vectorised,
+        None if none can
+        """
+        for diagram in diagrams:
+            try:
+                return np.asarray(function([diagram], **kwargs)).shape[1]
+            except Exception:
+                continue
+
+        return None
+
+    @staticmethod
+    def map(
+            function: Callable, diagrams: Sequence, n_jobs: int, chunk_size: Optional[int] = None,
+            dimension: Optional[int] = None, **kwargs
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        @param function: the vectorisation function, applied to chunks of diagrams
+        @type function: Callable
+        @param diagrams: the diagrams to vectorise
+        @type diagrams: Sequence
+        @param n_jobs: the number of worker processes
+        @type n_jobs: int
+        @param chunk_size: the number of diagrams per task, CHUNK_SIZE if not provided
+        @type chunk_size: Optional[int]
+        @param dimension: the dimension of the vectors, from the first diagram that can be
+        vectorised if not provided
+        @type dimension: Optional[int]
+        @param kwargs: keyword arguments of the vectorisation function
+        @return: the (n_diagrams, dimension) float32 matrix of vectors, and a boolean mask of
+        the diagrams whose vectorisation failed (their rows are zeros)
+        @rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        chunk_size = chunk_size or SharedVectorisation.CHUNK_SIZE
+        failed = np.zeros(len(diagrams), dtype=bool)
+
+        if len(diagrams) == 0:
+            return np.zeros((0, 0), dtype=np.float32), failed
+
+        dimension = dimension if dimension is not None else SharedVectorisation._dimension(function, diagrams, kwargs)
+
+        if dimension is None:
+            logger.warning(f">  Failed vectorisation of all {len(diagrams)} diagrams")
+            return np.zeros((len(diagrams), 0), dtype=np.float32), ~failed
+
+        bars, offsets = SharedVectorisation.pack(diagrams)
+        result = SharedArray((len(diagrams), dimension), np.float32)
+        result.array[:] = 0
+
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    initializer=SharedVectorisation._attach,
+                    initargs=(bars.spec, offsets.spec, result.spec)
+            ) as executor:
+
+                futures = [
+                    executor.submit(
+                        SharedVectorisation._work, function, start, min(start + chunk_size, len(diagrams)), kwargs
+                    )
+                    for start in range(0, len(diagrams), chunk_size)
+                ]
+
+                for future in futures:
+                    _, _, failures = future.result()
+
+                    for i, error in failures:
+                        logger.warning(f">  Failed vectorisation of diagram {i}: {error}")
+                        failed[i] = True
+
+            return np.array(result.array), failed
+
+        finally:
+            bars.unlink()
+            offsets.unlink()
+            result.unlink()
@@ -0,0 +1,170 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Sequence, Tuple, Optional, Mapping, List
+
+import numpy as np
+
+
+class SlicedWasserstein:
+    """
+    Sliced-Wasserstein sketches of persistence diagrams.
+
+    Each diagram, seen as a uniform measure over its bars, is projected onto a fixed set of
+    directions of the (birth, death) plane, and the quantile function of every projection is
+    sampled at N_QUANTILES fixed levels. The mean absolute difference between the sketches of
+    two diagrams approximates their sliced 1-Wasserstein distance: the 1D Wasserstein distance
+    is the L1 distance between quantile functions, averaged over the directions.
+    Sketches have a fixed size, so that all-pairs and top-k distances are computed as
+    vectorised operations over batches of sketches, instead of pairwise diagram matchings.
+    """
+
+    N_DIRECTIONS = 16
+    N_QUANTILES = 64
+    # Maximum number of elements of the temporary arrays built when computing distances
+    BLOCK_SIZE = 2 ** 24
+
+    @staticmethod
+    def directions(n_directions: int = N_DIRECTIONS) -> np.ndarray:
+        """
+        Unit vectors evenly spread over half of the circle, the projections onto opposite
+        directions giving the same distances.
+        @return: an array of shape (n_directions, 2)
+        """
+        angles = np.pi * (np.arange(n_directions) / n_directions - 0.5)
+        return np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+    @staticmethod
+    def quantile_levels(n_quantiles: int = N_QUANTILES) -> np.ndarray:
+        return (np.arange(n_quantiles) + 0.5) / n_quantiles
+
+    @staticmethod
+    def sketch(
+            diagram: np.ndarray, n_directions: int = N_DIRECTIONS, n_quantiles: int = N_QUANTILES
+    ) -> np.ndarray:
+        """
+        @param diagram: the bars of the diagram, an array of shape (n_bars, 2)
+        @return: the flattened sketch of the diagram, of size n_directions * n_quantiles,
+        direction-major
+        """
+        diagram = np.asarray(diagram, dtype=np.float64).reshape(-1, 2)
+
+        if len(diagram) == 0:
+            raise ValueError("Cannot sketch an empty persistence diagram")
+
+        projections = np.sort(diagram @ SlicedWasserstein.directions(n_directions).T, axis=0)
+
+        # Inverse of the empirical cumulative distribution function at the quantile levels
+        ranks = np.floor(SlicedWasserstein.quantile_levels(n_quantiles) * len(diagram)).astype(np.int64)
+
+        return projections[ranks].T.ravel().astype(np.float32)
+
+    @staticmethod
+    def sketches(
+            diagrams: Sequence[np.ndarray], n_directions: int = N_DIRECTIONS, n_quantiles: int = N_QUANTILES
+    ) -> np.ndarray:
+        """
+        @return: the sketches of the diagrams, an array of shape (n_diagrams, n_directions * n_quantiles)
+        """
+        result = np.empty((len(diagrams), n_directions * n_quantiles), dtype=np.float32)
+
+        for i, diagram in enumerate(diagrams):
+            result[i] = SlicedWasserstein.sketch(diagram, n_directions, n_quantiles)
+
+        return result
+
+    @staticmethod
+    def sketch_store(
+            store: Mapping[str, np.ndarray], n_directions: int = N_DIRECTIONS, n_quantiles: int = N_QUANTILES
+    ) -> Tuple[List[str], np.ndarray]:
+        """
+        Sketches of all the non-empty diagrams of a persistence diagram store
+        @return: the ids of the diagrams sketched, and their sketches, in the same order
+        """
+        ids = [key for key, diagram in store.items() if len(diagram) > 0]
+        return ids, SlicedWasserstein.sketches([store[key] for key in ids], n_directions, n_quantiles)
+
+    @staticmethod
+    def _row_batch_size(n_rows: int, dimension: int) -> int:
+        return max(1, SlicedWasserstein.BLOCK_SIZE // max(1, n_rows * dimension))
+
+    @staticmethod
+    def distances(queries: np.ndarray, sketches: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Approximate sliced-Wasserstein distances between two sets of sketches
+        @param queries: sketches of shape (n_queries, dimension)
+        @param sketches: sketches of shape (n_sketches, dimension), the queries if not provided
+        @return: the distance matrix, of shape (n_queries, n_sketches)
+        """
+        queries = np.atleast_2d(queries)
+        sketches = queries if sketches is None else np.atleast_2d(sketches)
+
+        result = np.empty((len(queries), len(sketches)), dtype=np.float32)
+        batch_size = SlicedWasserstein._row_batch_size(len(sketches), queries.shape[1])
+
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            result[start:start + batch_size] = np.abs(batch[:, None, :] - sketches[None, :, :]).mean(axis=2)
+
+        return result
+
+    @staticmethod
+    def top_k(
+            queries: np.ndarray, sketches: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The k nearest sketches of each query, without holding the whole distance matrix
+        @return: the indices of the nearest sketches and their distances, both of shape
+        (n_queries, k), sorted by increasing distance
+        """
+        queries = np.atleast_2d(queries)
+        k = min(k, len(sketches))
+
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+
+        batch_size = SlicedWasserstein._row_batch_size(len(sketches), queries.shape[1])
+
+        for start in range(0, len(queries), batch_size):
+            batch_distances = SlicedWasserstein.distances(queries[start:start + batch_size], sketches)
+
+            nearest = np.argpartition(batch_distances, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(batch_distances, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1)
+
+            indices[start:start + batch_size] = np.take_along_axis(nearest, order, axis=1)
+            distances[start:start + batch_size] = np.take_along_axis(nearest_distances, order, axis=1)
+
+        return indices, distances
+
+    @staticmethod
+    def exact(diagram_1: np.ndarray, diagram_2: np.ndarray, n_directions: int = N_DIRECTIONS) -> float:
+        """
+        Sliced 1-Wasserstein distance between the uniform measures over the bars of two
+        diagrams, over the same directions as the sketches, for validation
+        """
+        distances = []
+
+        for direction in SlicedWasserstein.directions(n_directions):
+            projection_1 = np.sort(np.asarray(diagram_1, dtype=np.float64).reshape(-1, 2) @ direction)
+            projection_2 = np.sort(np.asarray(diagram_2, dtype=np.float64).reshape(-1, 2) @ direction)
+
+            # Integral of the absolute difference between the cumulative distribution functions
+            support = np.sort(np.concatenate([projection_1, projection_2]))
+            cdf_1 = np.searchsorted(projection_1, support[:-1], side="right") / len(projection_1)
+            cdf_2 = np.searchsorted(projection_2, support[:-1], side="right") / len(projection_2)
+            distances.append(np.sum(np.abs(cdf_1 - cdf_2) * np.diff(support)))
+
+        return float(np.mean(distances))
@@ -14,11 +14,14 @@
 # limitations under the License.
 
 from abc import ABC, abstractmethod
-from typing import Dict, List, Callable, Union
+from typing import Dict, List, Callable, Union, Optional, Tuple, Iterator
 from typing_extensions import Unpack
 
 import numpy as np
 import os
+import json
+import hashlib
+import itertools
 
 from bluegraph.downstream import EmbeddingPipeline
 
@@ -32,16 +35,32 @@ from similarity_tools.building.model_data_impl.neuron_morphologies_query import
 
 from similarity_tools.building.model_impl.tmd_model.persistence_diagram \
     .neuron_morphology_persistence_diagram import NeuronMorphologyPersistenceDiagram
-
-from similarity_tools.building.model_impl.tmd_model.vectorisation import Vectorisation
+from similarity_tools.building.model_impl.tmd_model.persistence_diagram \
+    .persistence_diagram_store import PersistenceDiagramStore
+
+from similarity_tools.building.model_impl.tmd_model.vectorisation import Vectorisation, \
+    PersistenceImageEngine
+from similarity_tools.building.model_impl.tmd_model.diagram_limits import DiagramLimits
+from similarity_tools.building.model_impl.tmd_model.sliced_wasserstein import SlicedWasserstein
+from similarity_tools.building.model_impl.tmd_model.shared_vectorisation import SharedVectorisation
+from similarity_tools.building.model_impl.tmd_model.embedding_reduction import EmbeddingReduction, \
+    ReductionMethod
+from similarity_tools.building.model_impl.tmd_model.canonical_grid import CanonicalGrid
+from similarity_tools.building.model_impl.tmd_model.vector_encoding import VectorEncoding
+from similarity_tools.helpers.chunked_vectors import ChunkedVectors
+from similarity_tools.helpers.logger import logger
+from similarity_tools.registration.registration_exception import ModelBuildingException
 from enum import Enum
-from tmd.Topology.vectorizations import get_limits
 
 
 class VectorisationTechnique(Enum):
     PERSISTENCE_IMAGE_DATA = 1
     BETTI_CURVE = 2
     LIFE_ENTROPY_CURVE = 3
+    # Offline only: sketches approximate the sliced-Wasserstein distance under the L1 distance,
+    # which registered models are not scored with. See SlicedWasserstein.distances and search
+    SLICED_WASSERSTEIN_SKETCH = 4
+    PERSISTENCE_LANDSCAPE = 5
 
 
 class TMDModel(Model, ABC):
@@ -51,8 +70,39 @@ class TMDModel(Model, ABC):
             model_data: NeuronMorphologiesQuery,
             re_compute: bool,
             re_download: bool,
-            neurite_type: NeuriteType
+            neurite_type: NeuriteType,
+            n_jobs: Optional[int] = None,
+            use_cache: bool = False
     ):
+        persistence_diagram_location, download_dir, cache_dir = TMDModel._get_locations(
+            model_data, neurite_type, use_cache
+        )
+
+        self.persistence_diagram_store: PersistenceDiagramStore = NeuronMorphologyPersistenceDiagram.get_persistence_diagrams(
+            re_download=re_download,
+            re_compute=re_compute,
+            download_dir=download_dir,
+            persistence_diagram_location=persistence_diagram_location,
+            forge=model_data.forge,
+            data=model_data.data,
+            neurite_type=neurite_type,
+            n_jobs=n_jobs,
+            cache_dir=cache_dir
+        )
+
+        # Zero-copy views on the store. Every bar in the store has a birth and a death,
+        # only empty diagrams (no neurite of this type) are left out
+        self.nm_persistence_diagrams: Dict[str, np.ndarray] = dict(
+            (key, value)
+            for key, value in self.persistence_diagram_store.items()
+            if len(value) > 0
+        )
+
+    @staticmethod
+    def _get_locations(
+            model_data: NeuronMorphologiesQuery, neurite_type: NeuriteType, use_cache: bool
+    ) -> Tuple[str, str, Optional[str]]:
+
         persistence_diagram_directory = os.path.join(
             model_data.src_data_dir, "persistence_diagrams"
         )
@@ -62,7 +112,7 @@ class TMDModel(Model, ABC):
         persistence_diagram_location = os.path.join(
             persistence_diagram_directory,
             f"persistence_diagrams_{neurite_type.value}_{model_data.org}_{model_data.project}_"
-            f"{append_env}.json"
+            f"{append_env}"
         )
 
         download_dir = os.path.join(
@@ -70,20 +120,45 @@ class TMDModel(Model, ABC):
             f"morphologies_{model_data.org}_{model_data.project}_{append_env}",
         )
 
-        self.nm_persistence_diagrams: Dict[str, List] = NeuronMorphologyPersistenceDiagram.get_persistence_diagrams(
-            re_download=re_download,
-            re_compute=re_compute,
+        cache_dir = os.path.join(
+            persistence_diagram_directory,
+            f"cache_{model_data.org}_{model_data.project}_{append_env}"
+        ) if use_cache else None
+
+        return persistence_diagram_location, download_dir, cache_dir
+
+    @staticmethod
+    def precompute_persistence_diagrams(
+            model_data: NeuronMorphologiesQuery,
+            re_download: bool,
+            neurite_types: Optional[List[NeuriteType]] = None,
+            n_jobs: Optional[int] = None,
+            use_cache: bool = False
+    ) -> Dict[NeuriteType, PersistenceDiagramStore]:
+        """
+        Compute the persistence diagrams of several neurite types in a single pass over the
+        morphologies, parsing each of them once. TMD models of these neurite types can then be
+        built with re_compute=False.
+        """
+        neurite_types = neurite_types if neurite_types is not None else list(NeuriteType)
+
+        locations = dict(
+            (neurite_type, TMDModel._get_locations(model_data, neurite_type, use_cache))
+            for neurite_type in neurite_types
+        )
+
+        _, download_dir, cache_dir = locations[neurite_types[0]]
+
+        return NeuronMorphologyPersistenceDiagram.recompute_persistence_diagrams_multi(
             download_dir=download_dir,
-            persistence_diagram_location=persistence_diagram_location,
             forge=model_data.forge,
+            persistence_diagram_locations=dict(
+                (neurite_type, location) for neurite_type, (location, _, _) in locations.items()
+            ),
             data=model_data.data,
-            neurite_type=neurite_type
-        )
-
-        self.nm_persistence_diagrams: Dict[str, List] = dict(
-            (key, value)
-            for key, value in self.nm_persistence_diagrams.items()
-            if set(len(val_i) for val_i in value) == {2}  # TODO ??? What is this??
+            re_download=re_download,
+            n_jobs=n_jobs,
+            cache_dir=cache_dir
         )
 
     @abstractmethod
@@ -95,26 +170,258 @@ class TMDModelNew(TMDModel):
 
     vectorisation_technique: VectorisationTechnique
 
+    # Number of diagrams vectorised per shared memory block, when Vectorisation.N_JOBS > 1
+    SHARED_BLOCK_SIZE = 8192
+
+    # Reduction fitted when a reduction location is provided and no reduction is saved there yet
+    REDUCTION_DIMENSION = 512
+    REDUCTION_METHOD = ReductionMethod.PCA
+
     def __init__(
             self,
             model_data: NeuronMorphologiesQuery,
             re_compute: bool,
             re_download: bool,
             neurite_type: NeuriteType,
+            n_jobs: Optional[int] = None,
+            use_cache: bool = False,
+            stream: bool = False,
+            reduction_location: Optional[str] = None,
+            grid_dir: Optional[str] = None
     ):
-        super().__init__(model_data, re_compute, re_download, neurite_type)
+        super().__init__(model_data, re_compute, re_download, neurite_type, n_jobs, use_cache)
+        # If True, run returns a generator of (id, vector) pairs instead of a dict
+        self.stream = stream
+        # If provided, the vectors are reduced by the EmbeddingReduction saved at this
+        # location, which is fitted on them first if it does not exist
+        self.reduction_location = reduction_location
+        # If provided, diagrams are vectorised on the latest CanonicalGrid saved in this directory
+        # instead of on the limits of the current diagrams, and the vectors of each grid version
+        # and vectorisation settings are kept there, so that only morphologies without a vector
+        # are vectorised
+        self.grid_dir = grid_dir
+
+    def run(self) -> Union[EmbeddingPipeline, Dict[str, List], Iterator[Tuple[str, List]]]:
+
+        if self.vectorisation_technique == VectorisationTechnique.SLICED_WASSERSTEIN_SKETCH:
+            raise ModelBuildingException(
+                "Sliced-Wasserstein sketches are only meaningful under the L1 distance and cannot be registered, "
+                "compute them with run_static or iter_static and compare them with SlicedWasserstein"
+            )
+
+        # Base64 vectors are registered as is in the binary ES mapping, whose consumers decode
+        # them as float32. Other encodings are only decoded by the reduction, which outputs lists
+        if Vectorisation.BASE64 and Vectorisation.BASE64_ENCODING != VectorEncoding.FLOAT32 and self.reduction_location is None:
+            raise ModelBuildingException(
+                f"Base64 vectors encoded as {Vectorisation.BASE64_ENCODING.name} cannot be registered, "
+                f"only {VectorEncoding.FLOAT32.name} ones can. Provide a reduction location or use {VectorEncoding.FLOAT32.name}"
+            )
+
+        if self.grid_dir is not None:
+            vectors = self._run_incremental()
+            vectors = vectors if self.stream else dict(vectors)
+        else:
+            limits = DiagramLimits.from_store(self.persistence_diagram_store)
+            xlim, ylim = limits.xlim, limits.ylim
+
+            run_method = TMDModelNew.iter_static if self.stream else TMDModelNew.run_static
+
+            vectors = run_method(
+                vectorisation_technique=self.vectorisation_technique,
+                nm_persistence_diagrams=self.nm_persistence_diagrams,
+                xlim=xlim,
+                ylim=ylim
+            )
+
+        if self.reduction_location is None:
+            return vectors
+
+        return self._reduce(vectors)
+
+    @staticmethod
+    def vectorisation_parameters(vectorisation_technique: VectorisationTechnique) -> Dict:
+        """
+        @return: the Vectorisation settings the vectors of the technique depend on
+        """
+        return {
+            VectorisationTechnique.PERSISTENCE_IMAGE_DATA: lambda: {
+                "resolution": Vectorisation.PERSISTENCE_IMAGE_RESOLUTION,
+                "engine": Vectorisation.PERSISTENCE_IMAGE_ENGINE.name,
+                "flatten_normalize": Vectorisation.FLATTEN_NORMALIZE,
+                "base64": Vectorisation.BASE64,
+                "base64_encoding": Vectorisation.BASE64_ENCODING.name
+            },
+            VectorisationTechnique.BETTI_CURVE: lambda: {
+                "num_bins": Vectorisation.CURVE_NUM_BINS,
+                "shared_bins": Vectorisation.SHARED_CURVE_BINS
+            },
+            VectorisationTechnique.LIFE_ENTROPY_CURVE: lambda: {
+                "num_bins": Vectorisation.CURVE_NUM_BINS,
+                "shared_bins": Vectorisation.SHARED_CURVE_BINS
+            },
+            VectorisationTechnique.SLICED_WASSERSTEIN_SKETCH: lambda: {
+                "n_directions": SlicedWasserstein.N_DIRECTIONS,
+                "n_quantiles": SlicedWasserstein.N_QUANTILES
+            },
+            VectorisationTechnique.PERSISTENCE_LANDSCAPE: lambda: {
+                "layers": Vectorisation.LANDSCAPE_LAYERS,
+                "num_bins": Vectorisation.LANDSCAPE_NUM_BINS
+            }
+        }[vectorisation_technique]()
+
+    def _vectors_location(self, grid: CanonicalGrid) -> str:
+        # Vectors computed with other settings are not reused: they are kept under another key
+        parameters = json.dumps(TMDModelNew.vectorisation_parameters(self.vectorisation_technique), sort_keys=True)
+        digest = hashlib.sha1(parameters.encode("utf-8")).hexdigest()[:12]
+
+        return os.path.join(
+            self.grid_dir, f"vectors_v{grid.version}_{self.vectorisation_technique.name.lower()}_{digest}"
+        )
+
+    def _get_grid(self) -> CanonicalGrid:
+        grid = CanonicalGrid.load(self.grid_dir)
+        limits = DiagramLimits.from_store(self.persistence_diagram_store)
+
+        if grid is None:
+            grid = CanonicalGrid.regrid(self.grid_dir, limits)
+            logger.info(f">  Created canonical grid v{grid.version} in {self.grid_dir}")
+        elif not grid.contains(limits):
+            logger.warning(
+                f">  Persistence diagrams exceed canonical grid v{grid.version} "
+                f"(x: {limits.xlim}, y: {limits.ylim} vs x: {grid.xlim}, y: {grid.ylim}), "
+                f"bars outside of it are not fully represented. Regrid to re-vectorise all diagrams"
+            )
+
+        return grid
+
+    def regrid(self, headroom: Optional[float] = None) -> CanonicalGrid:
+        """
+        Create a new version of the canonical grid from the current diagrams. All diagrams are
+        vectorised again on the next run, vectors of previous versions are left untouched.
+        """
+        if self.grid_dir is None:
+            raise ModelBuildingException("No grid directory provided, the grid is derived from the diagrams at every run")
+
+        limits = DiagramLimits.from_store(self.persistence_diagram_store)
+        grid = CanonicalGrid.regrid(self.grid_dir, limits, headroom=headroom)
+        logger.info(f">  Created canonical grid v{grid.version} in {self.grid_dir}")
+
+        return grid
+
+    def _run_incremental(self) -> Iterator[Tuple[str, List]]:
+        """
+        Vectors of the morphologies on the latest grid, the cached ones read one chunk at a time,
+        then the missing ones, appended to the cache as they are computed
+        """
+        grid = self._get_grid()
+        location = self._vectors_location(grid)
+
+        cached = ChunkedVectors.keys(location) if ChunkedVectors.is_chunked(location) else set()
+
+        missing = dict(
+            (key, value) for key, value in self.nm_persistence_diagrams.items() if key not in cached
+        )
 
-    def run(self) -> Union[EmbeddingPipeline, Dict[str, List]]:
+        logger.info(
+            f">  Canonical grid v{grid.version}: {len(self.nm_persistence_diagrams) - len(missing)} "
+            f"vectors reused, {len(missing)} to compute"
+        )
+
+        def vectors() -> Iterator[Tuple[str, List]]:
+            if len(cached) > 0:
+                # Vectors of morphologies no longer in the data are kept, they stay valid on this grid
+                yield from (
+                    (key, vector) for key, vector in ChunkedVectors.iterate(location)
+                    if key in self.nm_persistence_diagrams
+                )
+
+            if len(missing) > 0:
+                yield from ChunkedVectors.append(location, TMDModelNew.iter_static(
+                    vectorisation_technique=self.vectorisation_technique,
+                    nm_persistence_diagrams=missing,
+                    xlim=grid.xlim,
+                    ylim=grid.ylim
+                ))
+
+        return vectors()
+
+    def _reduce(
+            self, vectors: Union[Dict[str, List], Iterator[Tuple[str, List]]]
+    ) -> Union[Dict[str, List], Iterator[Tuple[str, List]]]:
+
+        if EmbeddingReduction.exists(self.reduction_location):
+            reduction = EmbeddingReduction.load(self.reduction_location)
+
+            # The reduction may have been fitted on vectors of another technique or other settings
+            if isinstance(vectors, dict):
+                first = next(iter(vectors.values()), None)
+            else:
+                first_pair = next(vectors, None)
+                first = first_pair[1] if first_pair is not None else None
+                vectors = itertools.chain([first_pair], vectors) if first_pair is not None else iter([])
+
+            if first is not None:
+                n_features = EmbeddingReduction.to_array(first, Vectorisation.BASE64_ENCODING).size
+
+                if n_features != reduction.n_features:
+                    raise ModelBuildingException(
+                        f"The reduction saved at {self.reduction_location} applies to vectors of dimension "
+                        f"{reduction.n_features}, the vectors have dimension {n_features}. Provide another reduction location"
+                    )
+        else:
+            # Fitting requires all the vectors
+            vectors = dict(vectors)
+            reduction = EmbeddingReduction.fit_embeddings(
+                vectors, dimension=TMDModelNew.REDUCTION_DIMENSION, method=TMDModelNew.REDUCTION_METHOD,
+                encoding=Vectorisation.BASE64_ENCODING
+            )
+            reduction.save(self.reduction_location)
+
+        reduction.report()
+
+        reduced = reduction.iter_transform(
+            vectors.items() if isinstance(vectors, dict) else vectors, encoding=Vectorisation.BASE64_ENCODING
+        )
 
-        xlim, ylim = get_limits(list(self.nm_persistence_diagrams.values()))
+        return reduced if self.stream else dict(reduced)
 
-        return TMDModelNew.run_static(
-            vectorisation_technique=self.vectorisation_technique,
+    def run_pyramid(self) -> Dict[int, Dict[str, List]]:
+        limits = DiagramLimits.from_store(self.persistence_diagram_store)
+
+        return TMDModelNew.run_pyramid_static(
             nm_persistence_diagrams=self.nm_persistence_diagrams,
-            xlim=xlim,
-            ylim=ylim
+            xlim=limits.xlim,
+            ylim=limits.ylim
         )
 
+    @staticmethod
+    def run_pyramid_static(nm_persistence_diagrams: Dict, xlim, ylim) -> Dict[int, Dict[str, List]]:
+        """
+        Persistence images at the full resolution and at the pooled resolutions
+        Vectorisation.PERSISTENCE_IMAGE_PYRAMID_LEVELS, one embedding dict per resolution,
+        the coarse ones being usable to shortlist candidates before scoring the full ones
+        (see ImagePyramid.search)
+        """
+        morphology_ids = list(nm_persistence_diagrams.keys())
+        result: Dict[int, Dict[str, List]] = dict()
+
+        for start in range(0, len(morphology_ids), Vectorisation.BATCH_SIZE):
+            batch_ids = morphology_ids[start:start + Vectorisation.BATCH_SIZE]
+            levels = Vectorisation.persistence_image_pyramid(
+                [nm_persistence_diagrams[i] for i in batch_ids], xlim=xlim, ylim=ylim
+            )
+
+            for resolution, vectors in levels.items():
+                level_result = result.setdefault(resolution, dict())
+
+                for morphology_id, vector in zip(batch_ids, vectors):
+                    encoded = Vectorisation.encode_persistence_image_vector(vector)
+
+                    if encoded is not None:
+                        level_result[morphology_id] = encoded
+
+        return result
+
     @staticmethod
     def run_static(
             vectorisation_technique: VectorisationTechnique,
@@ -124,23 +431,167 @@ class TMDModelNew(TMDModel):
             **kwargs
     ) -> Union[EmbeddingPipeline, Dict[str, List]]:
 
+        return dict(TMDModelNew.iter_static(
+            vectorisation_technique=vectorisation_technique,
+            nm_persistence_diagrams=nm_persistence_diagrams,
+            xlim=xlim,
+            ylim=ylim,
+            **kwargs
+        ))
+
+    @staticmethod
+    def iter_static(
+            vectorisation_technique: VectorisationTechnique,
+            nm_persistence_diagrams: Dict,
+            xlim,
+            ylim,
+            **kwargs
+    ) -> Iterator[Tuple[str, List]]:
+        """
+        Vectorise the persistence diagrams one by one (or one batch at a time for batched
+        techniques), yielding (id, vector) pairs as soon as they are computed.
+        Morphologies whose vectorisation fails are skipped.
+        """
+
         tech_to_method: Dict[VectorisationTechnique, Callable[[Unpack], Callable]] = {
             VectorisationTechnique.PERSISTENCE_IMAGE_DATA: Vectorisation.persistence_image_data,
             VectorisationTechnique.BETTI_CURVE: Vectorisation.betti_curve,
             VectorisationTechnique.LIFE_ENTROPY_CURVE: Vectorisation.life_entropy_curve
         }
 
-        method = tech_to_method[vectorisation_technique](xlim=xlim, ylim=ylim)
+        tech_to_batch_method: Dict[VectorisationTechnique, Callable[[Unpack], Callable]] = {
+            VectorisationTechnique.SLICED_WASSERSTEIN_SKETCH: Vectorisation.sliced_wasserstein_sketch_batch,
+            VectorisationTechnique.PERSISTENCE_LANDSCAPE: Vectorisation.persistence_landscape_batch
+        }
 
-        vectors = dict()
+        if Vectorisation.PERSISTENCE_IMAGE_ENGINE == PersistenceImageEngine.HISTOGRAM:
+            tech_to_batch_method[VectorisationTechnique.PERSISTENCE_IMAGE_DATA] = \
+                Vectorisation.persistence_image_data_batch
+
+        if Vectorisation.SHARED_CURVE_BINS:
+            tech_to_batch_method[VectorisationTechnique.BETTI_CURVE] = \
+                Vectorisation.betti_curve_batch
+            tech_to_batch_method[VectorisationTechnique.LIFE_ENTROPY_CURVE] = \
+                Vectorisation.life_entropy_curve_batch
+
+        if vectorisation_technique in tech_to_batch_method and Vectorisation.N_JOBS > 1:
+            yield from TMDModelNew._iter_shared(
+                *TMDModelNew._matrix_method(vectorisation_technique, xlim=xlim, ylim=ylim),
+                nm_persistence_diagrams
+            )
+            return
+
+        if vectorisation_technique in tech_to_batch_method:
+            yield from TMDModelNew._iter_batched(
+                tech_to_batch_method[vectorisation_technique](xlim=xlim, ylim=ylim),
+                nm_persistence_diagrams
+            )
+            return
+
+        method = tech_to_method[vectorisation_technique](xlim=xlim, ylim=ylim)
 
         for morphology_id, diagram in nm_persistence_diagrams.items():
             try:
-                vectors[morphology_id] = method(diagram)
+                vector = method(diagram)
             except Exception as e:
-                print(f"Failed vectorisation for {morphology_id}: {e}")
+                logger.warning(f">  Failed vectorisation for {morphology_id}: {e}")
+                continue
 
-        return vectors
+            yield morphology_id, vector
+
+    @staticmethod
+    def _iter_batched(batch_method: Callable, nm_persistence_diagrams: Dict) -> Iterator[Tuple[str, List]]:
+        morphology_ids = list(nm_persistence_diagrams.keys())
+
+        for start in range(0, len(morphology_ids), Vectorisation.BATCH_SIZE):
+            batch_ids = morphology_ids[start:start + Vectorisation.BATCH_SIZE]
+
+            try:
+                batch_vectors = batch_method([nm_persistence_diagrams[i] for i in batch_ids])
+            except Exception as e:
+                # One diagram failing must not fail the others of its batch: they are
+                # vectorised again one by one
+                logger.warning(f">  Failed vectorisation of a batch of {len(batch_ids)} diagrams, retrying one by one: {e}")
+                yield from TMDModelNew._iter_one_by_one(batch_method, batch_ids, nm_persistence_diagrams)
+                continue
+
+            for morphology_id, vector in zip(batch_ids, batch_vectors):
+                if vector is None:
+                    logger.warning(f">  Failed vectorisation for {morphology_id}")
+                else:
+                    yield morphology_id, vector
+
+    @staticmethod
+    def _iter_one_by_one(
+            batch_method: Callable, morphology_ids: List[str], nm_persistence_diagrams: Dict
+    ) -> Iterator[Tuple[str, List]]:
+        for morphology_id in morphology_ids:
+            try:
+                vector = batch_method([nm_persistence_diagrams[morphology_id]])[0]
+            except Exception as e:
+                logger.warning(f">  Failed vectorisation for {morphology_id}: {e}")
+                continue
+
+            if vector is None:
+                logger.warning(f">  Failed vectorisation for {morphology_id}")
+            else:
+                yield morphology_id, vector
+
+    @staticmethod
+    def _matrix_method(
+            vectorisation_technique: VectorisationTechnique, xlim, ylim
+    ) -> Tuple[Callable, Dict, Callable]:
+        """
+        The function computing the vectors of a batched technique as a matrix, its keyword
+        arguments, and the function encoding each of the rows like the batch method does
+        """
+        bins = Vectorisation.shared_bins(xlim, ylim, Vectorisation.CURVE_NUM_BINS)
+
+        return {
+            VectorisationTechnique.PERSISTENCE_IMAGE_DATA: (
+                Vectorisation.persistence_images,
+                dict(xlim=xlim, ylim=ylim, resolution=Vectorisation.PERSISTENCE_IMAGE_RESOLUTION),
+                Vectorisation.encode_persistence_image_vector
+            ),
+            VectorisationTechnique.BETTI_CURVE: (Vectorisation.betti_curves, dict(bins=bins), np.ndarray.tolist),
+            VectorisationTechnique.LIFE_ENTROPY_CURVE: (Vectorisation.life_entropy_curves, dict(bins=bins), np.ndarray.tolist),
+            VectorisationTechnique.SLICED_WASSERSTEIN_SKETCH: (SlicedWasserstein.sketches, dict(), np.ndarray.tolist),
+            VectorisationTechnique.PERSISTENCE_LANDSCAPE: (
+                Vectorisation.persistence_landscapes,
+                dict(
+                    grid=Vectorisation.shared_bins(xlim, ylim, Vectorisation.LANDSCAPE_NUM_BINS),
+                    n_layers=Vectorisation.LANDSCAPE_LAYERS
+                ),
+                np.ndarray.tolist
+            )
+        }[vectorisation_technique]
+
+    @staticmethod
+    def _iter_shared(
+            function: Callable, function_kwargs: Dict, encode: Callable, nm_persistence_diagrams: Dict
+    ) -> Iterator[Tuple[str, List]]:
+        """
+        Vectorisation over Vectorisation.N_JOBS processes sharing the diagrams through shared
+        memory, SHARED_BLOCK_SIZE diagrams at a time
+        """
+        morphology_ids = list(nm_persistence_diagrams.keys())
+        block_size = TMDModelNew.SHARED_BLOCK_SIZE
+
+        for start in range(0, len(morphology_ids), block_size):
+            block_ids = morphology_ids[start:start + block_size]
+
+            x, failed = SharedVectorisation.map(
+                function, [nm_persistence_diagrams[i] for i in block_ids],
+                n_jobs=Vectorisation.N_JOBS, chunk_size=Vectorisation.BATCH_SIZE, **function_kwargs
+            )
+
+            for morphology_id, vector, f in zip(block_ids, x, failed):
+                vector = None if f else encode(vector)
+
+                if vector is None:
+                    logger.warning(f">  Failed vectorisation for {morphology_id}")
+                else:
+                    yield morphology_id, vector
 
 
 class TMDModelOld(TMDModel):
@@ -153,22 +604,16 @@ class TMDModelOld(TMDModel):
     def old_vectorisation_run(
             nm_persistence_diagrams, dim, max_time, kernel_width, max_height
     ) -> EmbeddingPipeline:
-        vectors = dict(
-            (
-                morphology_id,
-                Vectorisation.compute_persistence_vector(
-                    diagram=diagram,
-                    dim=dim,
-                    max_time=max_time,
-                    kernel_width=kernel_width,
-                    max_height=max_height
-                )
-            )
-            for morphology_id, diagram in nm_persistence_diagrams.items()
+        keys = list(nm_persistence_diagrams.keys())
+
+        x = Vectorisation.vectorise(
+            Vectorisation.compute_persistence_vectors,
+            list(nm_persistence_diagrams.values()),
+            dim=dim,
+            max_time=max_time,
+            kernel_width=kernel_width,
+            max_height=max_height
         )
-
-        keys = list(vectors.keys())
-        x = np.float32(np.stack(list(vectors.values())))  # TODO check
         x = (x / x.max()).tolist()
 
         similarity_index = ScikitLearnSimilarityIndex(
@@ -219,23 +664,8 @@ class UnscaledTMDModel(TMDModelOld):
         self.kernel_width = 120
         self.max_height = 17000
 
-        # Equivalent to code below, right?
-        flattened = [
-            b
-            for persistent_diagram in self.nm_persistence_diagrams.values()
-            for a in persistent_diagram
-            for b in a
-        ]
-
-        self.max_time = max(flattened)
-
-        # # Compute maximum death/birth time of all diagrams to know the global scale.
-        # all_maxes = []
-        # for d in self.nm_persistence_diagrams.values():
-        #     d = np.array(d)
-        #     all_maxes += [d[:, 0].max(), d[:, 1].max()]
-        #
-        # self.max_time = max(all_maxes)
+        # Maximum death/birth time of all diagrams, to know the global scale
+        self.max_time = DiagramLimits.from_store(self.persistence_diagram_store).max_time
 
 
 class ScaledTMDModel(TMDModelOld):
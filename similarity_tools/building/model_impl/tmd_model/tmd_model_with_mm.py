@@ -15,6 +15,7 @@
 
 import numpy as np
 import os
+from typing import Optional
 
 from bluegraph.downstream import EmbeddingPipeline
 
@@ -26,11 +27,15 @@ from similarity_tools.building.model_data_impl.morphology_models import ModelDat
 from similarity_tools.building.model_impl.tmd_model.persistence_diagram\
     .morphology_model_persistence_diagram import MorphologyModelPersistenceDiagram
 from similarity_tools.building.model_impl.tmd_model.vectorisation import Vectorisation
+from similarity_tools.building.model_impl.tmd_model.diagram_limits import DiagramLimits
 
 
 class TMDModelWithMM(Model):
 
-    def __init__(self, model_data: ModelDataMorphologyModels, re_compute: bool, re_download: bool):
+    def __init__(
+            self, model_data: ModelDataMorphologyModels, re_compute: bool, re_download: bool,
+            n_jobs: Optional[int] = None, use_cache: bool = False
+    ):
 
         env = model_data.deployment.name.lower()
 
@@ -38,11 +43,13 @@ class TMDModelWithMM(Model):
             model_data.src_data_dir, "persistence_diagrams_morphology_models"
         )
         persistence_diagram_location = os.path.join(
-            persistence_diagram_dir, f"persistence_diagrams_{env}.json"
+            persistence_diagram_dir, f"persistence_diagrams_{env}"
         )
 
         download_dir = os.path.join(model_data.src_data_dir, "morphology_models", env)
 
+        cache_dir = os.path.join(persistence_diagram_dir, f"cache_{env}") if use_cache else None
+
         ist = MorphologyModelPersistenceDiagram()
 
         self.model_persistence_diagrams = ist.get_persistence_diagrams(
@@ -52,7 +59,9 @@ class TMDModelWithMM(Model):
                 download_dir=download_dir,
                 persistence_diagram_location=persistence_diagram_location,
                 re_compute=re_compute,
-                neurite_type=NeuriteType.BASAL_DENDRITE
+                neurite_type=NeuriteType.BASAL_DENDRITE,
+                n_jobs=n_jobs,
+                cache_dir=cache_dir
             )
 
     def run(self) -> EmbeddingPipeline:
@@ -68,22 +77,14 @@ class TMDModelWithMM(Model):
     @staticmethod
     def rest(nm_persistence_diagrams, dim, max_time, kernel_width, max_height) -> EmbeddingPipeline:
 
-        vectors = dict(
-            (
-                morphology_id,
-                Vectorisation.compute_persistence_vector(
-                    diagram=diagram,
-                    dim=dim,
-                    max_time=max_time,
-                    kernel_width=kernel_width,
-                    max_height=max_height
-                )
-            )
-            for morphology_id, diagram in nm_persistence_diagrams.items()
+        x = Vectorisation.vectorise(
+            Vectorisation.compute_persistence_vectors,
+            list(nm_persistence_diagrams.values()),
+            dim=dim,
+            max_time=max_time,
+            kernel_width=kernel_width,
+            max_height=max_height
         )
-
-        # keys = list(vectors.keys())
-        x = np.float32(np.stack(list(vectors.values())))  # TODO check
         x = (x / x.max()).tolist()
 
         # TODO uncomment
@@ -129,12 +130,7 @@ class UnscaledTMDModelWithMM(TMDModelWithMM):
         self.max_height = 17000
 
         # Compute maximum death/birth time of all diagrams to know the global scale.
-        all_maxes = []
-        for d in self.model_persistence_diagrams.values():
-            d = np.array(d)
-            all_maxes += [d[:, 0].max(), d[:, 1].max()]
-
-        self.max_time = max(all_maxes)
+        self.max_time = DiagramLimits.from_store(self.model_persistence_diagrams).max_time
 
 
 class ScaledTMDModel(TMDModelWithMM):
@@ -0,0 +1,97 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+from enum import Enum
+from typing import Union, Sequence
+
+import numpy as np
+
+
+class VectorEncoding(Enum):
+    FLOAT32 = 1
+    FLOAT16 = 2
+    INT8 = 3
+
+
+class VectorEncoder:
+    """
+    Base64 encoding of embedding vectors. All encodings are little-endian:
+    - FLOAT32: the float32 values (the historic format, 4 bytes per value), the only one
+    registered in the binary ES mapping, whose consumers decode it as such
+    - FLOAT16: the float16 values (2 bytes per value)
+    - INT8: a float32 scale followed by the int8 values, value = int8 * scale (1 byte per value)
+    FLOAT16 and INT8 only shrink vectors kept locally, e.g. before their reduction.
+    """
+
+    INT8_SCALE_BYTES = 4
+
+    @staticmethod
+    def to_bytes(vector: Union[np.ndarray, Sequence[float]], encoding: VectorEncoding) -> bytes:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+
+        if encoding == VectorEncoding.FLOAT32:
+            return vector.astype("<f4").tobytes()
+
+        if encoding == VectorEncoding.FLOAT16:
+            return vector.astype("<f2").tobytes()
+
+        if encoding == VectorEncoding.INT8:
+            max_abs = float(np.abs(vector).max()) if vector.size > 0 else 0.
+            scale = max_abs / 127 if max_abs > 0 else 1.
+            quantised = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+            return np.array([scale], dtype="<f4").tobytes() + quantised.tobytes()
+
+        raise ValueError(f"Unsupported vector encoding {encoding}")
+
+    @staticmethod
+    def from_bytes(data: bytes, encoding: VectorEncoding) -> np.ndarray:
+
+        if encoding == VectorEncoding.FLOAT32:
+            return np.frombuffer(data, dtype="<f4").astype(np.float32)
+
+        if encoding == VectorEncoding.FLOAT16:
+            return np.frombuffer(data, dtype="<f2").astype(np.float32)
+
+        if encoding == VectorEncoding.INT8:
+            scale = np.frombuffer(data[:VectorEncoder.INT8_SCALE_BYTES], dtype="<f4")[0]
+            quantised = np.frombuffer(data[VectorEncoder.INT8_SCALE_BYTES:], dtype=np.int8)
+            return quantised.astype(np.float32) * scale
+
+        raise ValueError(f"Unsupported vector encoding {encoding}")
+
+    @staticmethod
+    def encode(vector: Union[np.ndarray, Sequence[float]], encoding: VectorEncoding = VectorEncoding.FLOAT32) -> str:
+        """
+        @param vector: the vector to encode
+        @type vector: Union[np.ndarray, Sequence[float]]
+        @param encoding: the binary representation of the values
+        @type encoding: VectorEncoding
+        @return: the base64 string of the encoded vector
+        @rtype: str
+        """
+        return str(base64.b64encode(VectorEncoder.to_bytes(vector, encoding)), "utf-8")
+
+    @staticmethod
+    def decode(encoded: str, encoding: VectorEncoding = VectorEncoding.FLOAT32) -> np.ndarray:
+        """
+        @param encoded: a base64 string produced by encode
+        @type encoded: str
+        @param encoding: the encoding the string was produced with
+        @type encoding: VectorEncoding
+        @return: the decoded float32 vector
+        @rtype: np.ndarray
+        """
+        return VectorEncoder.from_bytes(base64.b64decode(encoded), encoding)
@@ -15,8 +15,20 @@
 
 import numpy as np
 from tmd.Topology import vectorizations
-import base64
-import struct
+from typing import Tuple, Sequence, List, Callable, Union, Optional, Dict
+from enum import Enum
+
+from similarity_tools.building.model_impl.tmd_model.persistence_image import PersistenceImage
+from similarity_tools.building.model_impl.tmd_model.image_pyramid import ImagePyramid
+from similarity_tools.building.model_impl.tmd_model.sliced_wasserstein import SlicedWasserstein
+from similarity_tools.building.model_impl.tmd_model.shared_vectorisation import SharedVectorisation
+from similarity_tools.registration.registration_exception import ModelBuildingException
+from similarity_tools.building.model_impl.tmd_model.vector_encoding import VectorEncoder, VectorEncoding
+
+
+class PersistenceImageEngine(Enum):
+    TMD = 1
+    HISTOGRAM = 2
 
 
 class Vectorisation:
@@ -24,6 +36,30 @@ class Vectorisation:
     PERSISTENCE_IMAGE_RESOLUTION = 100
     FLATTEN_NORMALIZE = True
     BASE64 = False
+    # Binary representation of the values of base64 encoded vectors. Only FLOAT32 vectors can
+    # be registered, FLOAT16 and INT8 ones must be reduced by TMDModelNew first
+    BASE64_ENCODING = VectorEncoding.FLOAT32
+    PERSISTENCE_IMAGE_ENGINE = PersistenceImageEngine.TMD
+    # Resolutions of the pooled images computed along with the full resolution ones by
+    # persistence_image_pyramid. They must divide PERSISTENCE_IMAGE_RESOLUTION
+    PERSISTENCE_IMAGE_PYRAMID_LEVELS = (25, 50)
+    # Number of diagrams transformed together by batched vectorisation engines
+    BATCH_SIZE = 64
+    CURVE_NUM_BINS = 500
+    # Compute Betti and life entropy curves of all diagrams on the same bins, in batch
+    SHARED_CURVE_BINS = False
+    # Persistence landscape vectors have LANDSCAPE_LAYERS * LANDSCAPE_NUM_BINS dimensions
+    LANDSCAPE_LAYERS = 5
+    LANDSCAPE_NUM_BINS = 64
+    # Maximum number of elements of the padded tent function arrays built for landscapes
+    LANDSCAPE_BLOCK_SIZE = 2 ** 22
+
+    # Number of worker processes of batched vectorisations, diagrams being shared with them
+    # through shared memory when greater than 1
+    N_JOBS = 1
+
+    # Maximum number of elements of the temporary arrays built by the kernel density engine
+    KERNEL_DENSITY_BLOCK_SIZE = 2 ** 22
 
     @staticmethod
     def diagram_to_persistence_points(diagram):
@@ -39,22 +75,39 @@ class Vectorisation:
     def evaluate_composed_density(points, x, width):
         centers = points[:, 0]
         masses = points[:, 1]
-        return np.array([Vectorisation.kernel_density(el, centers, masses, width) for el in x])
+
+        x = np.asarray(x)
+        density = np.zeros(len(x))
+        block = max(1, Vectorisation.KERNEL_DENSITY_BLOCK_SIZE // max(len(centers), 1))
+
+        for start in range(0, len(x), block):
+            kernel = Vectorisation._gaussian_kernel(x[start:start + block, np.newaxis], centers, width)
+            density[start:start + block] = kernel @ masses
+
+        return density
+
+    @staticmethod
+    def _gaussian_kernel(x, centers, kernel_width):
+        return np.exp(- (2 * kernel_width) ** -2 * (x - centers) ** 2)
 
     @staticmethod
     def kernel_density(x, centers, masses, kernel_width):
-        density = np.sum(
-            masses * np.exp(- (2 * kernel_width) ** -2 * (x - centers) ** 2))
+        density = np.sum(masses * Vectorisation._gaussian_kernel(x, centers, kernel_width))
         return density
 
     @staticmethod
-    def compute_persistence_vector(diagram, dim, max_time, kernel_width, max_height):
-
+    def _split_dim(dim) -> Tuple[int, int]:
         if not dim % 2:
             lower_dim = upper_dim = int(dim / 2)
         else:
             lower_dim = int(dim / 2) + 1
             upper_dim = dim - lower_dim
+        return lower_dim, upper_dim
+
+    @staticmethod
+    def compute_persistence_vector(diagram, dim, max_time, kernel_width, max_height):
+
+        lower_dim, upper_dim = Vectorisation._split_dim(dim)
 
         lower_points, upper_points = Vectorisation.diagram_to_persistence_points(diagram)
 
@@ -74,6 +127,113 @@ class Vectorisation:
 
         return np.concatenate([lower_vector, upper_vector])
 
+    @staticmethod
+    def pack_diagrams(diagrams: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pack diagrams into a ragged representation: a (n_bars, 2) array of all bars, and the
+        offsets of each diagram in it, diagram i being values[offsets[i]:offsets[i + 1]]
+        """
+        arrays = [np.asarray(diagram, dtype=np.float64).reshape(-1, 2) for diagram in diagrams]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(a) for a in arrays], out=offsets[1:])
+        values = np.concatenate(arrays) if len(arrays) > 0 else np.zeros((0, 2))
+        return values, offsets
+
+    @staticmethod
+    def _batched_composed_density(centers, masses, diagram_index, n_diagrams, x, width):
+        """
+        Evaluate the composed density of many diagrams on the same grid. Points must be sorted
+        by diagram index. Points are processed in blocks so that the kernel matrix never exceeds
+        KERNEL_DENSITY_BLOCK_SIZE elements, and the contributions of each block are summed per
+        diagram.
+        """
+        density = np.zeros((n_diagrams, len(x)))
+        block = max(1, Vectorisation.KERNEL_DENSITY_BLOCK_SIZE // max(len(x), 1))
+
+        for start in range(0, len(centers), block):
+            end = start + block
+            contribution = masses[start:end, np.newaxis] * Vectorisation._gaussian_kernel(
+                x[np.newaxis, :], centers[start:end, np.newaxis], width
+            )
+            index = diagram_index[start:end]
+            segment_starts = np.concatenate([[0], np.flatnonzero(np.diff(index)) + 1])
+            density[index[segment_starts]] += np.add.reduceat(contribution, segment_starts, axis=0)
+
+        return density
+
+    @staticmethod
+    def compute_persistence_vectors_packed(
+            values: np.ndarray, offsets: np.ndarray, dim, max_time, kernel_width, max_height
+    ) -> np.ndarray:
+        """
+        Batched equivalent of compute_persistence_vector over diagrams packed as ragged
+        arrays (see pack_diagrams).
+        @return: a (n_diagrams, dim) float32 matrix
+        """
+        lower_dim, upper_dim = Vectorisation._split_dim(dim)
+        n_diagrams = len(offsets) - 1
+
+        values = np.asarray(values, dtype=np.float64)
+        diagram_index = np.repeat(np.arange(n_diagrams), np.diff(offsets))
+
+        s, t = values[:, 0], values[:, 1]
+        lower, upper = s >= t, s <= t
+
+        vectors = np.zeros((n_diagrams, dim), dtype=np.float32)
+
+        vectors[:, :lower_dim] = Vectorisation._batched_composed_density(
+            s[lower], (s - t)[lower], diagram_index[lower], n_diagrams,
+            np.linspace(0, max_time, num=lower_dim), kernel_width
+        )
+        vectors[:, lower_dim:] = Vectorisation._batched_composed_density(
+            s[upper], (t - s)[upper], diagram_index[upper], n_diagrams,
+            np.linspace(0, max_time, num=upper_dim), kernel_width
+        )
+
+        return vectors
+
+    @staticmethod
+    def compute_persistence_vectors(
+            diagrams: Sequence, dim, max_time, kernel_width, max_height
+    ) -> np.ndarray:
+        values, offsets = Vectorisation.pack_diagrams(diagrams)
+        return Vectorisation.compute_persistence_vectors_packed(
+            values, offsets, dim=dim, max_time=max_time, kernel_width=kernel_width,
+            max_height=max_height
+        )
+
+    @staticmethod
+    def vectorise(function: Callable, diagrams: Sequence, **kwargs) -> np.ndarray:
+        """
+        Apply a batched vectorisation function, returning a (n_diagrams, dimension) array,
+        over N_JOBS worker processes if N_JOBS > 1
+        """
+        if Vectorisation.N_JOBS <= 1:
+            return function(diagrams, **kwargs)
+
+        x, failed = SharedVectorisation.map(function, diagrams, n_jobs=Vectorisation.N_JOBS, **kwargs)
+
+        if failed.any():
+            # Chunks are retried diagram by diagram, these are the diagrams failing on their own
+            raise ModelBuildingException(
+                f"Vectorisation failed for {failed.sum()} persistence diagrams, at indices {np.flatnonzero(failed).tolist()}"
+            )
+
+        return x
+
+    @staticmethod
+    def _encode_persistence_image(temp: np.ndarray) -> Union[List, str]:
+
+        if not Vectorisation.FLATTEN_NORMALIZE:
+            return temp.tolist()
+
+        normalized = temp/temp.max()  # should occur in image_diff_data
+
+        if not Vectorisation.BASE64:
+            return list(normalized.flatten())
+
+        return VectorEncoder.encode(normalized, Vectorisation.BASE64_ENCODING)
+
     @staticmethod
     def persistence_image_data(**kwargs):
 
@@ -88,33 +248,76 @@ class Vectorisation:
                 ph, xlim=xlim, ylim=ylim, bw_method=bw_method, weights=weights,
                 resolution=Vectorisation.PERSISTENCE_IMAGE_RESOLUTION
             )
-            if not Vectorisation.FLATTEN_NORMALIZE:
-                return temp.tolist()
+            return Vectorisation._encode_persistence_image(temp)
 
-            normalized = temp/temp.max()  # should occur in image_diff_data
-            normalized_flattened = list(normalized.flatten())
+        return fc
+
+    @staticmethod
+    def persistence_image_data_batch(**kwargs) -> Callable[[Sequence], List]:
+        """
+        Batched persistence images computed with the histogram + FFT-convolution engine.
+        The returned function maps a list of diagrams to their list of vectors, None for
+        diagrams that cannot be vectorised (no bar inside the grid).
+        """
+        xlim = kwargs["xlim"]
+        ylim = kwargs["ylim"]
 
-            if not Vectorisation.BASE64:
-                return normalized_flattened
+        def fc(phs):
+            images = Vectorisation.persistence_images(
+                phs, xlim=xlim, ylim=ylim, resolution=Vectorisation.PERSISTENCE_IMAGE_RESOLUTION
+            )
+            return [Vectorisation.encode_persistence_image_vector(image) for image in images]
 
-            bytes_array = bytearray()
+        return fc
 
-            for f in normalized_flattened:
-                bytes_array.extend(struct.pack('f', f))
+    @staticmethod
+    def persistence_images(diagrams: Sequence, xlim, ylim, resolution: int) -> np.ndarray:
+        """
+        Histogram + FFT-convolution persistence images, flattened into a (n_diagrams, resolution ** 2) array
+        """
+        return PersistenceImage.images(diagrams, xlim=xlim, ylim=ylim, resolution=resolution) \
+            .reshape(len(diagrams), -1)
 
-            val_encoded = base64.b64encode(bytes_array)
+    @staticmethod
+    def encode_persistence_image_vector(vector: np.ndarray) -> Optional[Union[List, str]]:
+        """
+        Encode a flattened (square) persistence image like persistence_image_data, None if it
+        is zero (no bar inside the grid)
+        """
+        if vector.max() <= 0:
+            return None
 
-            return str(val_encoded, "utf-8")
+        resolution = int(round(np.sqrt(len(vector))))
+        return Vectorisation._encode_persistence_image(np.asarray(vector).reshape(resolution, resolution))
 
-            # return str(base64.b64encode(struct.pack(f'{len(normalized_flattened)}f', *normalized_flattened)), "utf-8")
+    @staticmethod
+    def persistence_image_pyramid(diagrams: Sequence, xlim, ylim) -> Dict[int, np.ndarray]:
+        """
+        Persistence images of the diagrams at the resolution PERSISTENCE_IMAGE_RESOLUTION,
+        computed with PERSISTENCE_IMAGE_ENGINE, and their average pooling to the resolutions
+        PERSISTENCE_IMAGE_PYRAMID_LEVELS
+        @return: for each resolution, the (n_diagrams, resolution ** 2) array of the flattened
+        images, normalized by their maximum if FLATTEN_NORMALIZE
+        """
+        resolution = Vectorisation.PERSISTENCE_IMAGE_RESOLUTION
 
-        return fc
+        if Vectorisation.PERSISTENCE_IMAGE_ENGINE == PersistenceImageEngine.HISTOGRAM:
+            images = PersistenceImage.images(diagrams, xlim=xlim, ylim=ylim, resolution=resolution)
+        else:
+            images = np.array([
+                vectorizations.persistence_image_data(ph, xlim=xlim, ylim=ylim, resolution=resolution)
+                for ph in diagrams
+            ]).reshape(len(diagrams), resolution, resolution)
+
+        return ImagePyramid.pyramid(
+            images, Vectorisation.PERSISTENCE_IMAGE_PYRAMID_LEVELS, normalize=Vectorisation.FLATTEN_NORMALIZE
+        )
 
     @staticmethod
     def betti_curve(**kwargs):
 
         bins = None
-        num_bins = 500
+        num_bins = Vectorisation.CURVE_NUM_BINS
 
         return lambda ph: vectorizations.betti_curve(
             ph, bins=bins, num_bins=num_bins
@@ -123,8 +326,128 @@ class Vectorisation:
     @staticmethod
     def life_entropy_curve(**kwargs):
         bins = None
-        num_bins = 500
+        num_bins = Vectorisation.CURVE_NUM_BINS
 
         return lambda ph: vectorizations.life_entropy_curve(
             ph, bins=bins, num_bins=num_bins
         )[0]
+
+    @staticmethod
+    def shared_bins(xlim, ylim, num_bins: int) -> np.ndarray:
+        return np.linspace(min(xlim[0], ylim[0]), max(xlim[1], ylim[1]), num_bins)
+
+    @staticmethod
+    def _sweep_curves(values: np.ndarray, offsets: np.ndarray, bins: np.ndarray, weights: np.ndarray):
+        """
+        Sum, for every diagram and every bin t, the weights of the bars alive at t
+        (min(bar) <= t <= max(bar)). Each bar adds its weight at the first bin it covers and
+        removes it after the last one, the curves being the cumulative sums of these events.
+        """
+        n_diagrams, n_bins = len(offsets) - 1, len(bins)
+        diagram_index = np.repeat(np.arange(n_diagrams), np.diff(offsets))
+
+        start = np.searchsorted(bins, values.min(axis=1), side="left")
+        end = np.searchsorted(bins, values.max(axis=1), side="right")
+
+        row = diagram_index * (n_bins + 1)
+        events = np.bincount(row + start, weights=weights, minlength=n_diagrams * (n_bins + 1)) - \
+            np.bincount(row + end, weights=weights, minlength=n_diagrams * (n_bins + 1))
+
+        curves = np.cumsum(events.reshape(n_diagrams, n_bins + 1), axis=1)[:, :n_bins]
+
+        return curves.astype(np.float32)
+
+    @staticmethod
+    def betti_curves(diagrams: Sequence, bins: np.ndarray) -> np.ndarray:
+        """
+        Betti curves of all diagrams on the same bins
+        @return: a (n_diagrams, n_bins) float32 matrix
+        """
+        values, offsets = Vectorisation.pack_diagrams(diagrams)
+        return Vectorisation._sweep_curves(values, offsets, bins, np.ones(len(values)))
+
+    @staticmethod
+    def life_entropy_curves(diagrams: Sequence, bins: np.ndarray) -> np.ndarray:
+        """
+        Life entropy curves of all diagrams on the same bins: each bar alive at t contributes
+        -p log(p), p being its lifetime relative to the total lifetime of its diagram
+        @return: a (n_diagrams, n_bins) float32 matrix
+        """
+        values, offsets = Vectorisation.pack_diagrams(diagrams)
+
+        lifetimes = np.abs(values[:, 1] - values[:, 0])
+        diagram_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        total_lifetimes = np.bincount(diagram_index, weights=lifetimes, minlength=len(offsets) - 1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = lifetimes / total_lifetimes[diagram_index]
+            entropy = np.where(relative > 0, -relative * np.log(relative), 0)
+
+        return Vectorisation._sweep_curves(values, offsets, bins, entropy)
+
+    @staticmethod
+    def betti_curve_batch(**kwargs) -> Callable[[Sequence], List]:
+        bins = Vectorisation.shared_bins(kwargs["xlim"], kwargs["ylim"], Vectorisation.CURVE_NUM_BINS)
+        return lambda phs: Vectorisation.betti_curves(phs, bins).tolist()
+
+    @staticmethod
+    def life_entropy_curve_batch(**kwargs) -> Callable[[Sequence], List]:
+        bins = Vectorisation.shared_bins(kwargs["xlim"], kwargs["ylim"], Vectorisation.CURVE_NUM_BINS)
+        return lambda phs: Vectorisation.life_entropy_curves(phs, bins).tolist()
+
+    @staticmethod
+    def persistence_landscapes(diagrams: Sequence, grid: np.ndarray, n_layers: int) -> np.ndarray:
+        """
+        Persistence landscapes of all diagrams on the same grid: layer k at t is the k-th largest
+        value at t of the tent functions max(0, min(t - birth, death - t)) of the bars.
+        Consecutive diagrams are padded to the same number of bars and evaluated together,
+        the padded arrays never exceeding LANDSCAPE_BLOCK_SIZE elements when possible.
+        @return: a (n_diagrams, n_layers * len(grid)) float32 matrix, layers being concatenated
+        """
+        values, offsets = Vectorisation.pack_diagrams(diagrams)
+        lengths = np.diff(offsets)
+        n_diagrams, n_bins = len(lengths), len(grid)
+
+        births, deaths = values.min(axis=1), values.max(axis=1)
+        landscapes = np.zeros((n_diagrams, n_layers, n_bins), dtype=np.float32)
+
+        start = 0
+        while start < n_diagrams:
+            end, width = start + 1, max(int(lengths[start]), 1)
+
+            while end < n_diagrams and \
+                    (end + 1 - start) * max(width, lengths[end]) * n_bins <= Vectorisation.LANDSCAPE_BLOCK_SIZE:
+                width = max(width, int(lengths[end]))
+                end += 1
+
+            bars = slice(offsets[start], offsets[end])
+            group_lengths = lengths[start:end]
+            diagram_index = np.repeat(np.arange(end - start), group_lengths)
+            bar_index = np.arange(offsets[start], offsets[end]) - np.repeat(offsets[start:end], group_lengths)
+
+            tents = np.zeros((end - start, width, n_bins), dtype=np.float32)
+            tents[diagram_index, bar_index] = np.maximum(0, np.minimum(
+                grid[np.newaxis, :] - births[bars, np.newaxis], deaths[bars, np.newaxis] - grid[np.newaxis, :]
+            ))
+
+            if width > n_layers:
+                tents = np.partition(tents, width - n_layers, axis=1)[:, width - n_layers:]
+
+            layers = -np.sort(-tents, axis=1)
+            landscapes[start:end, :layers.shape[1]] = layers[:, :n_layers]
+            start = end
+
+        return landscapes.reshape(n_diagrams, n_layers * n_bins)
+
+    @staticmethod
+    def persistence_landscape_batch(**kwargs) -> Callable[[Sequence], List]:
+        grid = Vectorisation.shared_bins(kwargs["xlim"], kwargs["ylim"], Vectorisation.LANDSCAPE_NUM_BINS)
+        return lambda phs: Vectorisation.persistence_landscapes(phs, grid, Vectorisation.LANDSCAPE_LAYERS).tolist()
+
+    @staticmethod
+    def sliced_wasserstein_sketch_batch(**kwargs) -> Callable[[Sequence], List]:
+        """
+        Sliced-Wasserstein sketches, to be compared with the L1 distance (mean absolute
+        difference), offline only. They do not depend on the limits of the diagrams.
+        """
+        return lambda phs: SlicedWasserstein.sketches(phs).tolist()
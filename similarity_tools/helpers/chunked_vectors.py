@@ -0,0 +1,138 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Chunked on-disk storage of embedding vectors, written incrementally."""
+import os
+import json
+import shutil
+from typing import Iterable, Tuple, Any, Iterator, Dict, List, Set
+
+
+class ChunkedVectors:
+    """
+    Embedding vectors stored as a directory of JSON files, each holding a dict of at most
+    CHUNK_SIZE (id, vector) entries. Vectors are written as they are produced, so that
+    writing them never requires holding all of them in memory.
+    """
+
+    CHUNK_SIZE = 1000
+    CHUNK_PREFIX = "chunk_"
+
+    @staticmethod
+    def write(path: str, vectors: Iterable[Tuple[str, Any]], chunk_size: int = CHUNK_SIZE) -> int:
+        """
+        @param path: the directory to write the chunks to, replaced if it exists
+        @param vectors: the (id, vector) pairs to write, typically from a generator
+        @param chunk_size: the maximum number of vectors per chunk
+        @return: the number of vectors written
+        """
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        chunk: Dict[str, Any] = dict()
+        n_chunks = 0
+        count = 0
+
+        def flush():
+            chunk_path = os.path.join(tmp_path, f"{ChunkedVectors.CHUNK_PREFIX}{n_chunks:05d}.json")
+            with open(chunk_path, "w") as f:
+                json.dump(chunk, f)
+
+        for key, vector in vectors:
+            chunk[key] = vector
+            count += 1
+
+            if len(chunk) == chunk_size:
+                flush()
+                n_chunks += 1
+                chunk = dict()
+
+        if len(chunk) > 0:
+            flush()
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+        return count
+
+    @staticmethod
+    def append(path: str, vectors: Iterable[Tuple[str, Any]], chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+        """
+        Append vectors to the chunks of a directory, created if it does not exist, as new chunks
+        after the existing ones. Each chunk is written as soon as it is full.
+        @param path: the directory of the chunks
+        @param vectors: the (id, vector) pairs to append, typically from a generator
+        @param chunk_size: the maximum number of vectors per new chunk
+        @return: the (id, vector) pairs, yielded as they are appended
+        """
+        os.makedirs(path, exist_ok=True)
+        n_chunks = len(ChunkedVectors._chunk_files(path))
+        chunk: Dict[str, Any] = dict()
+
+        def flush():
+            chunk_path = os.path.join(path, f"{ChunkedVectors.CHUNK_PREFIX}{n_chunks:05d}.json")
+
+            with open(f"{chunk_path}.tmp", "w") as f:
+                json.dump(chunk, f)
+
+            os.replace(f"{chunk_path}.tmp", chunk_path)
+
+        try:
+            for key, vector in vectors:
+                chunk[key] = vector
+                yield key, vector
+
+                if len(chunk) == chunk_size:
+                    flush()
+                    n_chunks += 1
+                    chunk = dict()
+        finally:
+            # Also keeps the vectors computed when the consumer stops early
+            if len(chunk) > 0:
+                flush()
+
+    @staticmethod
+    def is_chunked(path: str) -> bool:
+        return os.path.isdir(path)
+
+    @staticmethod
+    def _chunk_files(path: str) -> List[str]:
+        return sorted(
+            f for f in os.listdir(path) if f.startswith(ChunkedVectors.CHUNK_PREFIX) and f.endswith(".json")
+        )
+
+    @staticmethod
+    def iterate(path: str) -> Iterator[Tuple[str, Any]]:
+        for chunk_file in ChunkedVectors._chunk_files(path):
+            with open(os.path.join(path, chunk_file), "r") as f:
+                yield from json.load(f).items()
+
+    @staticmethod
+    def keys(path: str) -> Set[str]:
+        """
+        @return: the ids of the vectors, read one chunk at a time
+        """
+        keys: Set[str] = set()
+
+        for chunk_file in ChunkedVectors._chunk_files(path):
+            with open(os.path.join(path, chunk_file), "r") as f:
+                keys.update(json.load(f).keys())
+
+        return keys
+
+    @staticmethod
+    def load(path: str) -> Dict[str, Any]:
+        return dict(ChunkedVectors.iterate(path))
@@ -21,6 +21,8 @@ from kgforge.core import KnowledgeGraphForge, Resource
 
 class ElasticSearch:
     NO_LIMIT = 10000
+    # Number of ids per terms query of get_by_ids_batched
+    IDS_BATCH_SIZE = 1000
 
     @staticmethod
     def get_all_documents_query():
@@ -71,3 +73,28 @@ class ElasticSearch:
         }
 
         return forge.elastic(json.dumps(q), debug=False)
+
+    @staticmethod
+    def get_by_ids_batched(
+            ids: List[str], forge: KnowledgeGraphForge, batch_size: Optional[int] = None
+    ) -> List[Resource]:
+        """
+        Same as get_by_ids, with one query per batch of ids, so that any number of ids can be
+        retrieved in a few round trips
+        @param ids: the list of ids of the resources to retrieve
+        @type ids: List[str]
+        @param forge: a forge instance
+        @type forge: KnowledgeGraphForge
+        @param batch_size: the number of ids per query, IDS_BATCH_SIZE if not provided
+        @type batch_size: Optional[int]
+        @return: the Resources retrieved, without those of unsuccessful queries
+        @rtype: List[Resource]
+        """
+        batch_size = batch_size or ElasticSearch.IDS_BATCH_SIZE
+        resources = []
+
+        for start in range(0, len(ids), batch_size):
+            batch = ElasticSearch.get_by_ids(ids[start:start + batch_size], forge)
+            resources.extend(batch or [])
+
+        return resources
@@ -0,0 +1,83 @@
+# This file is part of knowledge-graph-similarity.
+# Copyright 2024 Blue Brain Project / EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Embedding vectors stored as a JSON Lines file, written and read incrementally."""
+import os
+import json
+from typing import Iterable, Tuple, Any, Iterator, Dict, Optional
+
+
+class JsonLinesVectors:
+    """
+    Embedding vectors stored as a single JSON Lines file, one [id, vector] pair per line.
+    Vectors are written as they are produced and read back in batches, so that neither saving
+    nor registering a model requires holding all of its vectors in memory.
+    """
+
+    EXTENSION = ".jsonl"
+    CONTENT_TYPE = "application/x-ndjson"
+    # Number of vectors read at once
+    BATCH_SIZE = 1000
+
+    @staticmethod
+    def is_json_lines(path: str) -> bool:
+        return path.endswith(JsonLinesVectors.EXTENSION)
+
+    @staticmethod
+    def write(path: str, vectors: Iterable[Tuple[str, Any]]) -> int:
+        """
+        @param path: the file to write the vectors to, replaced if it exists
+        @param vectors: the (id, vector) pairs to write, typically from a generator
+        @return: the number of vectors written
+        """
+        tmp_path = f"{path}.tmp"
+        count = 0
+
+        with open(tmp_path, "w") as f:
+            for key, vector in vectors:
+                f.write(json.dumps([key, vector]))
+                f.write("\n")
+                count += 1
+
+        os.replace(tmp_path, path)
+
+        return count
+
+    @staticmethod
+    def iterate(path: str) -> Iterator[Tuple[str, Any]]:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    key, vector = json.loads(line)
+                    yield key, vector
+
+    @staticmethod
+    def batches(path: str, batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        batch_size = batch_size if batch_size is not None else JsonLinesVectors.BATCH_SIZE
+        batch: Dict[str, Any] = dict()
+
+        for key, vector in JsonLinesVectors.iterate(path):
+            batch[key] = vector
+
+            if len(batch) == batch_size:
+                yield batch
+                batch = dict()
+
+        if len(batch) > 0:
+            yield batch
+
+    @staticmethod
+    def first(path: str) -> Optional[Tuple[str, Any]]:
+        return next(JsonLinesVectors.iterate(path), None)
@@ -15,7 +15,7 @@
 
 import os
 import json
-from typing import List, Dict, Optional, Tuple, Callable, Union
+from typing import List, Dict, Optional, Tuple, Callable, Union, Iterator
 
 from bluegraph.core import GraphElementEmbedder
 from bluegraph.downstream import EmbeddingPipeline
@@ -25,6 +25,7 @@ from kgforge.specializations.mappings import DictionaryMapping
 from similarity_tools.registration.helper_functions.common import _persist
 from similarity_tools.registration.helper_functions.software_agents import get_wasAssociatedWith
 from similarity_tools.helpers.logger import logger
+from similarity_tools.helpers.json_lines_vectors import JsonLinesVectors
 from similarity_tools.registration.types import Types
 from similarity_tools.helpers.utils import encode_id_rev, get_model_tag, parse_id_rev, create_id, \
     create_id_with_forge
@@ -37,9 +38,11 @@ def load_embedding_model(
         download_dir: str = ".",
         path: Optional[str] = None,
         tag: Optional[str] = None
-) -> Tuple[Optional[int], Optional[str], Union[Dict, EmbeddingPipeline]]:
+) -> Tuple[Optional[int], Optional[str], Union[Dict, EmbeddingPipeline, Iterator[Dict]]]:
     """
-    Load embedding model embedding pipeline zip file into memory
+    Load embedding model embedding pipeline zip file into memory. Streamed models (JSON Lines)
+    are not loaded at once, their vectors are returned as an iterator of dictionaries of at most
+    JsonLinesVectors.BATCH_SIZE vectors
     @param forge: a forge instance to fetch the model with, if no path is provided and a model id is provided
     @type forge: Optional[KnowledgeGraphForge]
     @param model_id: the id of the model
@@ -57,7 +60,7 @@ def load_embedding_model(
     - The provided tag else a tag made of the concatenation of the model uuid and rev
     - and the model embedding pipeline
     In the case of a model loaded with a path: no model revision, the provided tag else no tag, and the model embedding pipeline
-    @rtype: Tuple[Optional[int], Optional[str], Union[Dict, EmbeddingPipeline]]
+    @rtype: Tuple[Optional[int], Optional[str], Union[Dict, EmbeddingPipeline, Iterator[Dict]]]
     """
 
     retrieval_str = f"{model_id}{'?rev='}{model_revision}" \
@@ -81,7 +84,9 @@ def load_embedding_model(
         model_revision = None
         model_tag = tag
 
-    if "json" in path:
+    if JsonLinesVectors.is_json_lines(path):
+        pipeline = JsonLinesVectors.batches(path)
+    elif "json" in path:
         with open(path, "r") as f:
             pipeline = json.load(f)
     else:
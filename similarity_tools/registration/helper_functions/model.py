@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import json
 from shutil import ReadError
 from typing import Any, Optional, Dict
@@ -26,6 +27,7 @@ from bluegraph.downstream import EmbeddingPipeline
 from similarity_tools.registration.helper_functions.common import _fetch_one, add_contribution
 from similarity_tools.registration.helper_functions.software_agents import get_wasAssociatedWith
 from similarity_tools.helpers.logger import logger
+from similarity_tools.helpers.json_lines_vectors import JsonLinesVectors
 from similarity_tools.registration.types import Types
 from similarity_tools.helpers.utils import create_id_with_forge
 
@@ -161,23 +163,32 @@ def push_model(
     @return: the updated/created model
     @rtype: Resource
     """
-    try:
-        path = f"{pipeline_path}.zip"
-        pipeline: EmbeddingPipeline = EmbeddingPipeline.load(
-            path=path, embedder_interface=GraphElementEmbedder, embedder_ext="zip"
-        )
-        vector_dimension = pipeline.generate_embedding_table().iloc[0]["embedding"].shape[0]
-        content_type = "application/octet-stream"
-        pipeline_path = path
-
-    except ReadError:
-        path = f"{pipeline_path}.json"
-        with open(path, "r") as f:
-            pipeline: Dict = json.load(f)
-
-        vector_dimension = len(list(pipeline.values())[0])
-        content_type = "application/json"
-        pipeline_path = path
+    json_lines_path = f"{pipeline_path}{JsonLinesVectors.EXTENSION}"
+
+    if os.path.exists(json_lines_path):
+        # Streamed model, only its first vector is read, for the vector dimension
+        _, first_vector = JsonLinesVectors.first(json_lines_path)
+        vector_dimension = len(first_vector)
+        content_type = JsonLinesVectors.CONTENT_TYPE
+        pipeline_path = json_lines_path
+    else:
+        try:
+            path = f"{pipeline_path}.zip"
+            pipeline: EmbeddingPipeline = EmbeddingPipeline.load(
+                path=path, embedder_interface=GraphElementEmbedder, embedder_ext="zip"
+            )
+            vector_dimension = pipeline.generate_embedding_table().iloc[0]["embedding"].shape[0]
+            content_type = "application/octet-stream"
+            pipeline_path = path
+
+        except ReadError:
+            path = f"{pipeline_path}.json"
+            with open(path, "r") as f:
+                pipeline: Dict = json.load(f)
+
+            vector_dimension = len(list(pipeline.values())[0])
+            content_type = "application/json"
+            pipeline_path = path
 
     existing_model = fetch_model(forge, model_name=model_name)
 
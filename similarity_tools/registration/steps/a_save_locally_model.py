@@ -15,10 +15,11 @@
 
 import os
 import json
-from typing import Optional, Union, Dict, List
+from typing import Optional, Union, Dict, List, Iterator, Tuple
 
 from similarity_tools.registration.model_registration_step import ModelRegistrationStep
 from similarity_tools.helpers.logger import logger
+from similarity_tools.helpers.json_lines_vectors import JsonLinesVectors
 
 from similarity_tools.data_classes.model import Model
 from similarity_tools.data_classes.model_description import ModelDescription
@@ -33,7 +34,7 @@ from bluegraph.downstream import EmbeddingPipeline
 def save_locally_model(
         model_description: ModelDescription,
         model_data: Optional[ModelData],
-        pipeline: Optional[Union[EmbeddingPipeline, Dict[str, List]]] = None
+        pipeline: Optional[Union[EmbeddingPipeline, Dict[str, List], Iterator[Tuple[str, List]]]] = None
 ):
     if not pipeline:
         logger.info("1. Initializing model")
@@ -42,7 +43,7 @@ def save_locally_model(
 
         logger.info("2. Running model")
 
-        pipeline: Union[EmbeddingPipeline, Dict[str, List]] = model_instance.run()
+        pipeline: Union[EmbeddingPipeline, Dict[str, List], Iterator[Tuple[str, List]]] = model_instance.run()
 
     filename = f"{model_description.filename}_{model_data.org}_{model_data.project}_{model_data.deployment.name.lower()}"
 
@@ -60,8 +61,18 @@ def save_locally_model(
 
     os.makedirs(os.path.dirname(pipeline_directory), exist_ok=True)
 
+    # The model is pushed from whichever of these files exists, outputs of previous runs in
+    # another format must not be pushed instead of this one
+    for extension in [".zip", ".json", JsonLinesVectors.EXTENSION]:
+        if os.path.exists(f"{save_path}{extension}"):
+            os.remove(f"{save_path}{extension}")
+
     if isinstance(pipeline, EmbeddingPipeline):
         pipeline.save(save_path, compress=True)
+    elif isinstance(pipeline, Iterator):
+        # Streamed embeddings are written line by line as they are computed
+        count = JsonLinesVectors.write(f"{save_path}{JsonLinesVectors.EXTENSION}", pipeline)
+        logger.info(f">  Saved {count} embeddings")
     else:
         with open(f"{save_path}.json", "w") as outfile:
             json.dump(pipeline, outfile)
@@ -15,7 +15,7 @@
 
 import os
 from importlib.resources import Resource
-from typing import List, Tuple, Optional, Callable
+from typing import List, Tuple, Optional, Callable, Iterator
 
 from similarity_tools.helpers.bucket_configuration import NexusBucketConfiguration
 from similarity_tools.registration.helper_functions.model import fetch_model
@@ -129,30 +129,49 @@ def register_model_embeddings(
     model_tag = embedding_tag_transformer(model_tag) if embedding_tag_transformer is not None \
         else model_tag
 
-    logger.info("3. Getting embedding vectors from model pipeline")
+    forge_push = push_bc.allocate_forge_session() if push_bc != model_bc else forge_model
+    forge_data = data_bc.allocate_forge_session() if data_bc != model_bc else forge_model
 
-    missing_list, embedding_dict = get_embedding_vectors_from_pipeline(
-        pipeline=pipeline, resource_id_rev_list=resource_id_rev_list
-    )
+    # Streamed models are registered one batch of vectors at a time
+    batches = pipeline if isinstance(pipeline, Iterator) else [pipeline]
 
-    if resource_id_rev_list is not None:
-        logger.info(f">  Number of missing embeddings in the embedding table: {len(missing_list)}")
+    requested = set(resource_id_rev_list) if resource_id_rev_list is not None else None
+    embedding_tag, vector_dimension = model_tag, None
 
-    logger.info("4. Registering embeddings")
+    for i, batch in enumerate(batches):
+        logger.info(f"3. Getting embedding vectors from model pipeline{f' (batch {i})' if i > 0 else ''}")
 
-    forge_push = push_bc.allocate_forge_session() if push_bc != model_bc else forge_model
-    forge_data = data_bc.allocate_forge_session() if data_bc != model_bc else forge_model
+        # Only the resources not found in previous batches are looked for
+        _, embedding_dict = get_embedding_vectors_from_pipeline(
+            pipeline=batch, resource_id_rev_list=list(requested) if requested is not None else None
+        )
 
-    embedding_tag, vector_dimension = register_embeddings(
-        forge_data=forge_data,
-        forge_push=forge_push,
-        vectors=embedding_dict,
-        model_revision=model_revision,
-        model_id=model_id,
-        embedding_tag=model_tag,
-        mapping_path=EMBEDDING_MAPPING_PATH,
-        bluegraph=bluegraph
-    )
+        if requested is not None:
+            found_ids = set(resource_id for resource_id, _ in embedding_dict.keys())
+            requested = set(
+                (resource_id, resource_rev) for resource_id, resource_rev in requested
+                if (resource_id, resource_rev) not in embedding_dict
+                and not (resource_rev is None and resource_id in found_ids)
+            )
+
+        if len(embedding_dict) == 0:
+            continue
+
+        logger.info("4. Registering embeddings")
+
+        embedding_tag, vector_dimension = register_embeddings(
+            forge_data=forge_data,
+            forge_push=forge_push,
+            vectors=embedding_dict,
+            model_revision=model_revision,
+            model_id=model_id,
+            embedding_tag=model_tag,
+            mapping_path=EMBEDDING_MAPPING_PATH,
+            bluegraph=bluegraph
+        )
+
+    if requested is not None:
+        logger.info(f">  Number of missing embeddings in the embedding table: {len(requested)}")
 
     logger.info(f">  Embedding tags: {embedding_tag}")
     logger.info(f">  Embedding vector dimension: {vector_dimension}")